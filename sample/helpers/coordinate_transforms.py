@@ -342,6 +342,80 @@ def rotation_interpolation(t, rotmats_dict, t_query):
         return rot_interp
 
 
+def skew_matrices(omega):
+    """
+    Cross-product matrices [omega]_x, e.g. omega = (n1, n2, n3) gives
+    n1 * G1 + n2 * G2 + n3 * G3 with the generators of SO3
+    :param omega: rotation vectors, Nx3
+    :return: cross-product matrices, Nx3x3
+    """
+    omega = np.asarray(omega, dtype=np.float64)
+    skew = np.zeros(omega.shape[:-1] + (3, 3))
+    skew[..., 0, 1] = -omega[..., 2]
+    skew[..., 0, 2] = omega[..., 1]
+    skew[..., 1, 0] = omega[..., 2]
+    skew[..., 1, 2] = -omega[..., 0]
+    skew[..., 2, 0] = -omega[..., 1]
+    skew[..., 2, 1] = omega[..., 0]
+    return skew
+
+
+def rotvecs2rotmats(omega):
+    """
+    Exponential map of SO3 for many rotation vectors at once (Rodrigues formula),
+    same as sp.expm(skew(omega)) for each row
+    :param omega: rotation vectors (axis times angle), Nx3
+    :return: rotation matrices, Nx3x3
+    """
+    skew = skew_matrices(omega)
+    theta = np.linalg.norm(omega, axis=-1)[..., np.newaxis, np.newaxis]
+    small = theta < 1e-6
+    theta_safe = np.where(small, 1.0, theta)
+    # Taylor expansions of sin(theta) / theta and (1 - cos(theta)) / theta^2 near 0
+    a = np.where(small, 1.0 - theta ** 2 / 6.0, np.sin(theta_safe) / theta_safe)
+    b = np.where(
+        small, 0.5 - theta ** 2 / 24.0, (1.0 - np.cos(theta_safe)) / theta_safe ** 2
+    )
+    return np.identity(3) + a * skew + b * np.matmul(skew, skew)
+
+
+def rotmats2rotvecs(R):
+    """
+    Logarithm map of SO3 for many rotation matrices at once, inverse of
+    rotvecs2rotmats (angles in [0, pi])
+    :param R: rotation matrices, Nx3x3
+    :return: rotation vectors (axis times angle), Nx3
+    """
+    R = np.asarray(R, dtype=np.float64)
+    cos_theta = np.clip((np.trace(R, axis1=-2, axis2=-1) - 1.0) / 2.0, -1.0, 1.0)
+    theta = np.arccos(cos_theta)
+    w = np.stack(
+        (
+            R[..., 2, 1] - R[..., 1, 2],
+            R[..., 0, 2] - R[..., 2, 0],
+            R[..., 1, 0] - R[..., 0, 1],
+        ),
+        axis=-1,
+    )
+    # Most rotations: axis from the antisymmetric part, 2 sin(theta) [u]_x
+    sin_theta = np.sin(theta)
+    small = sin_theta < 1e-6
+    factor = np.where(small, 0.5, theta / (2.0 * np.where(small, 1.0, sin_theta)))
+    omega = factor[..., np.newaxis] * w
+
+    # Rotations with an angle close to pi: axis from the symmetric part,
+    # (R + I) / 2 = u u^T, with the sign given by the antisymmetric part
+    near_pi = small & (cos_theta < 0)
+    if np.any(near_pi):
+        B = 0.25 * (R[near_pi] + np.swapaxes(R[near_pi], -2, -1)) + 0.5 * np.identity(3)
+        k = np.argmax(np.diagonal(B, axis1=-2, axis2=-1), axis=-1)
+        axis = B[np.arange(len(k)), :, k]
+        axis /= np.linalg.norm(axis, axis=-1)[:, np.newaxis]
+        sign = np.where(np.sum(axis * w[near_pi], axis=-1) < 0, -1.0, 1.0)
+        omega[near_pi] = sign[:, np.newaxis] * axis * theta[near_pi][:, np.newaxis]
+    return omega
+
+
 def project_equirectangular_projection(point_3d, output_width, output_height):
     """
     Project a 3D point according to equirectangular model
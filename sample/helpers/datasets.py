@@ -0,0 +1,238 @@
+import os
+import copy
+
+import numpy as np
+import pandas as pd
+from scipy import io
+
+import sample.helpers.helpers as helpers
+import sample.helpers.coordinate_transforms as coordinate_transforms
+
+
+# Recordings and their sensors.
+# sensor_height/sensor_width : geometry of the DVS
+# contrast_threshold         : contrast threshold of the sensor
+# var_R                      : variance of the measurements per measurement criterion
+# calibration_file           : file in the calibration directory (undistorted pixels, Kint)
+# data_dir                   : directory of the recording, relative to the data directory
+# events_file, events_format : 'sec_nsec' (sec, nsec, x, y, pol) or 'time' (time, x, y, pol)
+# poses_file, pose_source    : 'quaternion' (sec, nsec, position, quaternion) or
+#                              'angular_velocity' (time, position, angular velocity)
+PROFILES = {
+    "synth1": {
+        "sensor_height": 128,
+        "sensor_width": 128,
+        "contrast_threshold": 0.45,
+        "var_R": {"contrast": 0.17 ** 2, "event_rate": 1e2 ** 2},
+        "calibration_file": "DVS_synth_undistorted_pixels.mat",
+        "data_dir": "synth1",
+        "events_file": "events.txt",
+        "events_format": "sec_nsec",
+        "poses_file": "poses.txt",
+        "pose_source": "quaternion",
+    },
+    "RedRoom": {
+        "sensor_height": 260,
+        "sensor_width": 346,
+        "contrast_threshold": 0.202,
+        "var_R": {"contrast": 0.035 ** 2, "event_rate": 1e2 ** 2},
+        "calibration_file": "DVS_synth_undistorted_pixels_rroom.mat",
+        "data_dir": "Datasets/RedRoom/second",
+        "events_file": "events_cropped.txt",
+        "events_format": "time",
+        "poses_file": "imu.txt",
+        "pose_source": "angular_velocity",
+    },
+    "FPU": {
+        "sensor_height": 260,
+        "sensor_width": 346,
+        "contrast_threshold": 0.202,
+        "var_R": {"contrast": 0.035 ** 2, "event_rate": 1e2 ** 2},
+        "calibration_file": "DVS_synth_undistorted_pixels_ours_FPU.mat",
+        "data_dir": "Datasets/FPU/Regal_z",
+        "events_file": "events_cropped.txt",
+        "events_format": "time",
+        "poses_file": "imu.txt",
+        "pose_source": "angular_velocity",
+    },
+    "BigRoom": {
+        "sensor_height": 260,
+        "sensor_width": 346,
+        "contrast_threshold": 0.202,
+        "var_R": {"contrast": 0.035 ** 2, "event_rate": 1e2 ** 2},
+        "calibration_file": "DVS_synth_undistorted_pixels_ours_all.mat",
+        "data_dir": "Datasets/BigRoom/2019-04-29-17-20-59",
+        "events_file": "events_cropped.txt",
+        "events_format": "time",
+        "poses_file": "imu.txt",
+        "pose_source": "angular_velocity",
+    },
+}
+
+# Lookup tables of a sensor, cached in one .npz file per calibration
+TABLE_KEYS = [
+    "undist_pix_calibrated",
+    "bearings",
+    "pinhole_bearings",
+    "Kint",
+    "Kint_inv",
+]
+
+
+def get_profile(name):
+    """
+    :param name: name of the recording, one of PROFILES
+    :return: copy of the profile, with its name
+    """
+    if name not in PROFILES:
+        raise ValueError(
+            "Unknown profile {}, available: {}".format(name, sorted(PROFILES))
+        )
+    profile = copy.deepcopy(PROFILES[name])
+    profile["name"] = name
+    return profile
+
+
+def bearing_table(undist_pix_calibrated, sensor_height, sensor_width):
+    """
+    :param undist_pix_calibrated: calibrated pixel coordinates, in the order of the
+                                  calibration file (index x * sensor_height + y)
+    :param sensor_height: height of the DVS sensor
+    :param sensor_width: width of the DVS sensor
+    :return: bearing (undistorted, calibrated pixel with z = 1) of each pixel, indexed
+             as [y, x], sensor_height x sensor_width x 3
+    """
+    x, y = np.meshgrid(np.arange(sensor_width), np.arange(sensor_height))
+    idx_to_mat = x * sensor_height + y
+    bearings = np.ones((sensor_height, sensor_width, 3))
+    bearings[:, :, :2] = np.asarray(undist_pix_calibrated)[idx_to_mat, :2]
+    return bearings
+
+
+def _build_tables(profile, calibration):
+    """
+    :param profile: dataset profile
+    :param calibration: content of the calibration file
+    :return: dictionary with the TABLE_KEYS
+    """
+    sensor_height = profile["sensor_height"]
+    sensor_width = profile["sensor_width"]
+    undist_pix_calibrated = np.asarray(
+        calibration["undist_pix_calibrated"], dtype=np.float64
+    )
+
+    # Bearing of each pixel through the intrinsics only (without undistortion)
+    Kint = np.asarray(calibration["Kint"], dtype=np.float64)
+    Kint_inv = np.linalg.inv(Kint)
+    y, x = np.mgrid[0:sensor_height, 0:sensor_width]
+    pixels = np.stack((x, y, np.ones_like(x)), axis=-1).astype(np.float64)
+
+    return {
+        "undist_pix_calibrated": undist_pix_calibrated,
+        "bearings": bearing_table(undist_pix_calibrated, sensor_height, sensor_width),
+        "pinhole_bearings": np.dot(pixels, Kint_inv.T),
+        "Kint": Kint,
+        "Kint_inv": Kint_inv,
+    }
+
+
+def sensor_tables(profile, calibration_dir, cache_dir=None):
+    """
+    Sensor-sized lookup tables of a profile. They are built from the calibration file
+    once and cached, later runs (mosaicer and tracker) load them from the cache.
+    :param profile: dataset profile (see get_profile)
+    :param calibration_dir: directory of the calibration files
+    :param cache_dir: directory of the cache, calibration_dir/cache by default
+    :return: dictionary with
+             'undist_pix_calibrated' : calibrated pixel coordinates per table index (N x 2)
+             'bearings'              : undistorted bearing per pixel [y, x] (see
+                                       bearing_table), used by the mosaicer
+             'pinhole_bearings'      : Kint_inv [x, y, 1] per pixel [y, x], used by the
+                                       tracker
+             'Kint', 'Kint_inv'      : camera intrinsic matrix and its inverse
+    """
+    filename_calibration = os.path.join(calibration_dir, profile["calibration_file"])
+    if cache_dir is None:
+        cache_dir = os.path.join(calibration_dir, "cache")
+    filename_cache = os.path.join(
+        cache_dir, os.path.splitext(profile["calibration_file"])[0] + "_tables.npz"
+    )
+
+    if os.path.exists(filename_cache) and os.path.getmtime(
+        filename_cache
+    ) >= os.path.getmtime(filename_calibration):
+        with np.load(filename_cache) as cached:
+            tables = {key: cached[key] for key in TABLE_KEYS if key in cached.files}
+        if len(tables) == len(TABLE_KEYS) and tables["bearings"].shape[:2] == (
+            profile["sensor_height"],
+            profile["sensor_width"],
+        ):
+            return tables
+
+    tables = _build_tables(profile, io.loadmat(filename_calibration))
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    np.savez(filename_cache, **tables)
+    return tables
+
+
+def load_recording(profile, data_root):
+    """
+    Loads the events and the camera orientations of a recording
+    :param profile: dataset profile (see get_profile)
+    :param data_root: data directory containing the recordings
+    :return: events (DataFrame with 't', 'x', 'y', 'pol'), poses (DataFrame with 't'),
+             dictionary of rotation matrices, filename of the events
+    """
+    data_dir = os.path.join(data_root, profile["data_dir"])
+    filename_events = os.path.join(data_dir, profile["events_file"])
+    filename_poses = os.path.join(data_dir, profile["poses_file"])
+
+    if profile["events_format"] == "sec_nsec":
+        # Events have time in whole sec, time in ns, x, y, pol
+        events = pd.read_csv(
+            filename_events,
+            delimiter=" ",
+            header=None,
+            names=["sec", "nsec", "x", "y", "pol"],
+        )
+        first_event_sec = events.loc[0, "sec"]
+        first_event_nsec = events.loc[0, "nsec"]
+        events["t"] = (
+            events["sec"] - first_event_sec + 1e-9 * (events["nsec"] - first_event_nsec)
+        )
+    else:
+        events = pd.read_csv(
+            filename_events,
+            delimiter=" ",
+            header=None,
+            names=["time", "x", "y", "pol"],
+        )
+        first_event = events.loc[0, "time"]
+        events["t"] = events["time"] - first_event
+    events = events[["t", "x", "y", "pol"]]
+    print("Number of events in file: ", len(events))
+
+    if profile["pose_source"] == "quaternion":
+        poses = pd.read_csv(
+            filename_poses,
+            delimiter=" ",
+            header=None,
+            names=["sec", "nsec", "x", "y", "z", "qx", "qy", "qz", "qw"],
+        )
+        poses["t"] = (
+            poses["sec"] - first_event_sec + 1e-9 * (poses["nsec"] - first_event_nsec)
+        )  # time_ctrl in MATLAB
+        poses = poses[["t", "qw", "qx", "qy", "qz"]]  # Quaternions
+        rotmats_dict = coordinate_transforms.q2R_dict(poses)
+    else:
+        poses = helpers.load_poses_angvel(
+            filename_poses=filename_poses,
+            includes_translations=True,
+            t_first_event=first_event,
+        )
+        # Integrate the angular velocities to rotation matrices
+        rotmats_dict = coordinate_transforms.angvel2R_dict(poses)
+    print("Number of poses in file: ", poses.size)
+
+    return events, poses, rotmats_dict, filename_events
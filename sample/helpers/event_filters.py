@@ -0,0 +1,223 @@
+import numpy as np
+
+
+def latest_previous_time(sae, x, y, t, dx=0, dy=0, unset_time=None):
+    """
+    For each event of a batch, gets the time of the latest earlier event at the pixel
+    offset by (dx, dy): events earlier in the same batch if there are any, otherwise
+    the per-pixel timestamp state (SAE, e.g. the event map of the mosaicer).
+    Vectorized over the batch, events are assumed to be sorted by time.
+    :param sae: time of last event per pixel, sensor_height x sensor_width
+    :param x: x coordinates of the events (integer array)
+    :param y: y coordinates of the events (integer array)
+    :param t: timestamps of the events
+    :param dx: offset in x
+    :param dy: offset in y
+    :param unset_time: value of the SAE at pixels that have not fired yet (e.g.
+                       map_state.UNSET_TIME), None: the SAE holds -inf there
+    :return: time of the previous event at the offset pixel, -inf outside of the sensor
+             and at pixels that have not fired yet
+    """
+    height, width = sae.shape
+    n = len(t)
+    idx = np.arange(n)
+    pixel = y * width + x
+
+    # Sort by pixel, then by position in the batch
+    order = np.lexsort((idx, pixel))
+    keys = pixel[order].astype(np.int64) * n + order
+
+    xq = x + dx
+    yq = y + dy
+    inside = (xq >= 0) & (xq < width) & (yq >= 0) & (yq < height)
+    xq = np.clip(xq, 0, width - 1)
+    yq = np.clip(yq, 0, height - 1)
+    pixel_q = yq.astype(np.int64) * width + xq
+
+    # Last event at the queried pixel with a smaller position in the batch
+    pos = np.searchsorted(keys, pixel_q * n + idx) - 1
+    pos_c = np.maximum(pos, 0)
+    found = (pos >= 0) & (keys[pos_c] // n == pixel_q)
+
+    t_sae = sae[yq, xq]
+    if unset_time is not None:
+        t_sae = np.where(t_sae == unset_time, -np.inf, t_sae)
+    t_prev = np.where(found, t[order[pos_c]], t_sae)
+    t_prev[~inside] = -np.inf
+    return t_prev
+
+
+class EventFilter:
+    """
+    Base class of the noise filters. A filter gets the arrays of a batch of events
+    and returns a boolean mask of the events to keep.
+    """
+
+    name = "filter"
+
+    def apply(self, t, x, y, pol):
+        raise NotImplementedError
+
+
+class RefractoryFilter(EventFilter):
+    """
+    Drops events that follow the previous event at the same pixel within a refractory
+    period (bursts of hot pixels, repeated events of one edge).
+    """
+
+    name = "refractory"
+
+    def __init__(self, sae, refractory_period=1e-3, unset_time=None):
+        """
+        :param sae: per-pixel timestamp state shared with the event map (not modified)
+        :param refractory_period: minimum time between two events at one pixel [s]
+        :param unset_time: value of sae at pixels that have not fired yet, None: -inf.
+                           The first event of a pixel always passes.
+        """
+        self.sae = sae
+        self.refractory_period = refractory_period
+        self.unset_time = unset_time
+
+    def apply(self, t, x, y, pol):
+        t_prev = latest_previous_time(self.sae, x, y, t, unset_time=self.unset_time)
+        return t - t_prev >= self.refractory_period
+
+
+class BackgroundActivityFilter(EventFilter):
+    """
+    Background-activity filter: keeps an event only if one of its 8 neighbours fired
+    within dt before it. Real edges produce spatiotemporally correlated events,
+    background-activity noise does not.
+    """
+
+    name = "background_activity"
+
+    def __init__(self, sae, dt=1e-2, unset_time=None):
+        """
+        :param sae: per-pixel timestamp state shared with the event map (not modified)
+        :param dt: support time window [s]
+        :param unset_time: value of sae at pixels that have not fired yet, None: -inf.
+                           Such neighbours do not support an event.
+        """
+        self.sae = sae
+        self.dt = dt
+        self.unset_time = unset_time
+
+    def apply(self, t, x, y, pol):
+        t_support = np.full(len(t), -np.inf)
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                if dx == 0 and dy == 0:
+                    continue
+                t_support = np.maximum(
+                    t_support,
+                    latest_previous_time(
+                        self.sae, x, y, t, dx, dy, unset_time=self.unset_time
+                    ),
+                )
+        return t - t_support <= self.dt
+
+
+class HotPixelFilter(EventFilter):
+    """
+    Drops all events of hot pixels. The hot-pixel mask is learned from the event
+    counts of the first num_learning_events events: pixels firing more than num_std
+    standard deviations above the mean count of the active pixels are hot.
+    Events pass unfiltered while learning.
+    """
+
+    name = "hot_pixel"
+
+    def __init__(
+        self,
+        sensor_height,
+        sensor_width,
+        num_learning_events=100000,
+        num_std=5.0,
+        mask=None,
+    ):
+        """
+        :param sensor_height: height of the sensor
+        :param sensor_width: width of the sensor
+        :param num_learning_events: number of events used to learn the mask
+        :param num_std: threshold above the mean count, in standard deviations
+        :param mask: previously learned mask (e.g. loaded with np.load), skips learning
+        """
+        self.counts = np.zeros((sensor_height, sensor_width), dtype=np.int64)
+        self.num_learning_events = num_learning_events
+        self.num_std = num_std
+        self.num_learned = 0
+        self.mask = mask
+
+    def learn(self, x, y):
+        """
+        Accumulates the event counts and fixes the mask once enough events were seen
+        :param x: x coordinates of the events
+        :param y: y coordinates of the events
+        """
+        np.add.at(self.counts, (y, x), 1)
+        self.num_learned += len(x)
+        if self.num_learned >= self.num_learning_events:
+            active = self.counts[self.counts > 0]
+            threshold = active.mean() + self.num_std * active.std()
+            self.mask = self.counts > threshold
+            print("Hot pixels: {}".format(int(np.sum(self.mask))))
+
+    def apply(self, t, x, y, pol):
+        if self.mask is None:
+            self.learn(x, y)
+            return np.ones(len(t), dtype=bool)
+        return ~self.mask[y, x]
+
+
+class EventFilterChain:
+    """
+    Runs a sequence of noise filters on the arrays of each batch of events,
+    ahead of the expensive steps (projection, EKF, particle likelihood),
+    and counts kept and dropped events per filter.
+    """
+
+    def __init__(self, filters):
+        """
+        :param filters: list of EventFilter, applied in order
+        """
+        self.filters = filters
+        self.num_events_seen = 0
+        self.num_events_kept = 0
+        self.num_dropped = {f.name: 0 for f in filters}
+
+    def apply(self, t, x, y, pol):
+        """
+        :param t: timestamps of the events
+        :param x: x coordinates of the events (integer array)
+        :param y: y coordinates of the events (integer array)
+        :param pol: polarities of the events
+        :return: boolean mask of the events to keep
+        """
+        t = np.asarray(t)
+        x = np.asarray(x)
+        y = np.asarray(y)
+        pol = np.asarray(pol)
+
+        keep = np.ones(len(t), dtype=bool)
+        for f in self.filters:
+            idx = np.nonzero(keep)[0]
+            keep_f = f.apply(t[idx], x[idx], y[idx], pol[idx])
+            keep[idx[~keep_f]] = False
+            self.num_dropped[f.name] += int(len(idx) - np.sum(keep_f))
+
+        self.num_events_seen += len(t)
+        self.num_events_kept += int(np.sum(keep))
+        return keep
+
+    def report(self):
+        """
+        :return: string with the kept rate and the events dropped per filter
+        """
+        rate = self.num_events_kept / max(self.num_events_seen, 1)
+        dropped = ", ".join(
+            "{}: {}".format(name, num) for name, num in self.num_dropped.items()
+        )
+        return "Noise filter kept {}/{} events ({:.1f}%), dropped {}".format(
+            self.num_events_kept, self.num_events_seen, 100.0 * rate, dropped
+        )
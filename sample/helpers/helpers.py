@@ -312,6 +312,19 @@ def quaternions2file(quaternions, directory):
     return datestring
 
 
+def filter_stats2file(filter_stats, datestring, directory):
+    """
+    Saves per-batch statistics of the particle filter next to the quaternions
+    :param filter_stats: data frame with one row per batch (t, ess, ...)
+    :param datestring: datestring of the quaternions file
+    :param directory: path
+    :return: void
+    """
+    filename = "filter_" + datestring + ".txt"
+    filename = os.path.join(directory, filename)
+    filter_stats.to_csv(filename, index=None, sep=" ", mode="a")
+
+
 def write_logfile(datestring, directory, **kwargs):
     """
     Writes logfile from metadata
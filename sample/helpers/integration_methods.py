@@ -1,4 +1,7 @@
+import collections
+
 import numpy as np
+import scipy.fft
 
 
 def frankotchellappa(dzdx, dzdy):
@@ -63,6 +66,293 @@ def frankotchellappa(dzdx, dzdy):
     return z
 
 
+def _frequency_grids(rows, cols):
+    """
+    :return: frequency grids wx, wy of frankotchellappa, zero frequency at index 0
+    """
+    wx, wy = np.meshgrid(
+        np.arange(-np.pi / 2, np.pi / 2, np.pi / (cols)),
+        np.arange(-np.pi / 2, np.pi / 2, np.pi / (rows)),
+    )
+    return np.fft.ifftshift(wx), np.fft.ifftshift(wy)
+
+
+def _mirrored(a):
+    """
+    :return: a at the negative frequencies, a[-k1 % rows, -k2 % cols]
+    """
+    return np.roll(a[::-1, ::-1], 1, axis=(0, 1))
+
+
+class FrankotChellappa:
+    """
+    Same reconstruction as frankotchellappa, for repeated calls on maps of the same
+    shape (previews, periodic reconstructions):
+    - the frequency grids and the denominator are computed once per shape and cached,
+    - the gradients are real, so real-to-complex FFTs (scipy.fft.rfft2) are used,
+      which halves time and memory of the spectra,
+    - scipy.fft runs on several workers,
+    - optionally in single precision.
+
+    frankotchellappa keeps the real part of a complex inverse FFT. The spectrum it
+    inverts is not Hermitian at all frequencies, so its Hermitian part is folded into
+    the cached weights here, which gives the same image from the half spectrum.
+    """
+
+    def __init__(self, workers=-1, dtype=np.float64, max_cached_shapes=4):
+        """
+        :param workers: number of workers of scipy.fft, -1: all cores
+        :param dtype: np.float64, or np.float32 for half the memory and faster FFTs
+        :param max_cached_shapes: number of shapes whose weights are kept
+        """
+        self.workers = workers
+        self.dtype = np.dtype(dtype)
+        self.max_cached_shapes = max_cached_shapes
+        self.cache = collections.OrderedDict()
+
+    def weights(self, shape):
+        """
+        :param shape: shape of the gradient maps
+        :return: weights of the rfft2 spectra of dzdx and dzdy (half spectrum)
+        """
+        if shape in self.cache:
+            self.cache.move_to_end(shape)
+            return self.cache[shape]
+
+        rows, cols = shape
+        wx, wy = _frequency_grids(rows, cols)
+        denominator = np.power(wx, 2) + np.power(wy, 2) + np.finfo(float).eps
+        # Z = -j (wx DZDX + wy DZDY) / denominator, Hermitian part of it
+        weight_x = 0.5 * (wx / denominator - _mirrored(wx / denominator))
+        weight_y = 0.5 * (wy / denominator - _mirrored(wy / denominator))
+        half = cols // 2 + 1
+        weights = (
+            (-1j * weight_x[:, :half]).astype(self.dtype.char.upper()),
+            (-1j * weight_y[:, :half]).astype(self.dtype.char.upper()),
+        )
+
+        self.cache[shape] = weights
+        if len(self.cache) > self.max_cached_shapes:
+            self.cache.popitem(last=False)
+        return weights
+
+    def __call__(self, dzdx, dzdy):
+        """
+        :param dzdx: gradient in x
+        :param dzdy: gradient in y
+        :return: z, as frankotchellappa
+        """
+        dzdx = np.asarray(dzdx, dtype=self.dtype)
+        dzdy = np.asarray(dzdy, dtype=self.dtype)
+        weight_x, weight_y = self.weights(dzdx.shape)
+
+        Z = scipy.fft.rfft2(dzdx, workers=self.workers)
+        Z *= weight_x
+        Z += weight_y * scipy.fft.rfft2(dzdy, workers=self.workers)
+        z = scipy.fft.irfft2(Z, s=dzdx.shape, workers=self.workers)
+        z -= np.min(z)
+        z /= 2
+        return z
+
+
+# Integrators with cached weights, selectable as integration_method
+frankotchellappa_rfft = FrankotChellappa()
+frankotchellappa_rfft32 = FrankotChellappa(dtype=np.float32)
+
+
+def _divergence(g, axis, boundary):
+    """
+    Divergence along one axis of a gradient sampled at the pixels. The difference
+    between two neighbouring pixels is the mean of their gradients.
+    :param g: gradient along the axis
+    :param axis: 0 (rows, latitude) or 1 (columns, azimuth)
+    :param boundary: 'periodic', 'neumann' (no flow across the border) or 'dirichlet'
+                     (the gradient at the border leads to the zero outside)
+    :return: divergence along the axis
+    """
+    if boundary == "periodic":
+        d = 0.5 * (g + np.roll(g, -1, axis=axis))
+        return d - np.roll(d, 1, axis=axis)
+    g = np.moveaxis(g, axis, 0)
+    d = np.zeros((g.shape[0] + 1,) + g.shape[1:])
+    d[1:-1] = 0.5 * (g[:-1] + g[1:])
+    if boundary == "dirichlet":
+        d[0] = g[0]
+        d[-1] = g[-1]
+    return np.moveaxis(d[1:] - d[:-1], 0, axis)
+
+
+def _eigenvalues(n, boundary):
+    """
+    :param n: number of pixels along the axis
+    :param boundary: 'periodic', 'neumann' or 'dirichlet'
+    :return: eigenvalues of the discrete second derivative along the axis, in the
+             order of the transform of that boundary (rfft, DCT-II, DST-I)
+    """
+    if boundary == "periodic":
+        k = np.arange(n // 2 + 1)
+        return 2 * np.cos(2 * np.pi * k / n) - 2
+    if boundary == "neumann":
+        k = np.arange(n)
+        return 2 * np.cos(np.pi * k / n) - 2
+    k = np.arange(1, n + 1)
+    return 2 * np.cos(np.pi * k / (n + 1)) - 2
+
+
+def _forward(f, axis, boundary, workers):
+    if boundary == "periodic":
+        return scipy.fft.rfft(f, axis=axis, workers=workers)
+    if boundary == "neumann":
+        return scipy.fft.dct(f, type=2, axis=axis, norm="ortho", workers=workers)
+    return scipy.fft.dst(f, type=1, axis=axis, norm="ortho", workers=workers)
+
+
+def _inverse(F, n, axis, boundary, workers):
+    if boundary == "periodic":
+        return scipy.fft.irfft(F, n=n, axis=axis, workers=workers)
+    if boundary == "neumann":
+        return scipy.fft.idct(F, type=2, axis=axis, norm="ortho", workers=workers)
+    return scipy.fft.idst(F, type=1, axis=axis, norm="ortho", workers=workers)
+
+
+class PoissonSolver:
+    """
+    Integration of the gradients by solving the Poisson equation laplacian(z) = div(g)
+    on the pixel grid, with a fast transform that diagonalizes the discrete Laplacian
+    for the boundary condition of each axis, O(N log N):
+    - 'neumann'   : zero normal derivative at the border, DCT-II
+    - 'dirichlet' : zero value outside the border, DST-I
+    - 'periodic'  : wraps around, real FFT. Matches the azimuth of an equirectangular
+                    panorama, as long as the whole width is integrated
+    The eigenvalues of the Laplacian are cached per shape.
+    """
+
+    def __init__(self, boundary_rows, boundary_cols, workers=-1, max_cached_shapes=4):
+        """
+        :param boundary_rows: boundary condition along the rows (latitude)
+        :param boundary_cols: boundary condition along the columns (azimuth)
+        :param workers: number of workers of scipy.fft, -1: all cores
+        :param max_cached_shapes: number of shapes whose eigenvalues are kept
+        """
+        self.boundaries = (boundary_rows, boundary_cols)
+        self.workers = workers
+        self.max_cached_shapes = max_cached_shapes
+        self.cache = collections.OrderedDict()
+
+    def inverse_eigenvalues(self, shape):
+        """
+        :param shape: shape of the gradient maps
+        :return: inverse of the eigenvalues of the Laplacian, 0 for the constant
+        """
+        if shape in self.cache:
+            self.cache.move_to_end(shape)
+            return self.cache[shape]
+
+        eigenvalues = (
+            _eigenvalues(shape[0], self.boundaries[0])[:, np.newaxis]
+            + _eigenvalues(shape[1], self.boundaries[1])[np.newaxis, :]
+        )
+        singular = eigenvalues == 0
+        inverse = 1.0 / np.where(singular, 1, eigenvalues)
+        inverse[singular] = 0  # the mean is not determined (neumann, periodic)
+
+        self.cache[shape] = inverse
+        if len(self.cache) > self.max_cached_shapes:
+            self.cache.popitem(last=False)
+        return inverse
+
+    def __call__(self, dzdx, dzdy):
+        """
+        :param dzdx: gradient in x (along the columns)
+        :param dzdy: gradient in y (along the rows)
+        :return: z, shifted to a minimum of 0 as frankotchellappa
+        """
+        dzdx = np.asarray(dzdx, dtype=np.float64)
+        dzdy = np.asarray(dzdy, dtype=np.float64)
+        boundary_rows, boundary_cols = self.boundaries
+        rows, cols = dzdx.shape
+
+        f = _divergence(dzdx, 1, boundary_cols) + _divergence(dzdy, 0, boundary_rows)
+        # Real transform along the rows first, so that an rfft along the columns
+        # only sees real input
+        F = _forward(f, 0, boundary_rows, self.workers)
+        F = _forward(F, 1, boundary_cols, self.workers)
+        F *= self.inverse_eigenvalues((rows, cols))
+        z = _inverse(F, cols, 1, boundary_cols, self.workers)
+        z = _inverse(z, rows, 0, boundary_rows, self.workers)
+        return z - np.min(z)
+
+
+# Poisson solvers, selectable as integration_method
+poisson_neumann = PoissonSolver("neumann", "neumann")
+poisson_dirichlet = PoissonSolver("dirichlet", "dirichlet")
+# Periodic in azimuth, Neumann in latitude: the boundaries of an equirectangular map
+poisson_periodic_azimuth = PoissonSolver("neumann", "periodic")
+
+# Axes along which a method wraps around (0: rows, 1: columns). Cropping along them
+# would join two unrelated edges, so these methods always integrate their whole extent
+PERIODIC_AXES = {
+    "frankotchellappa": (0, 1),
+    "frankotchellappa_rfft": (0, 1),
+    "frankotchellappa_rfft32": (0, 1),
+    "poisson_periodic_azimuth": (1,),
+}
+
+
+def _intersect(region, crop, shape):
+    """
+    :param region: (row slice, column slice)
+    :param crop: (row slice, column slice)
+    :param shape: shape of the map
+    :return: (row slice, column slice) of the intersection, None if empty
+    """
+    intersection = []
+    for region_slice, crop_slice, size in zip(region, crop, shape):
+        start_region, stop_region, _ = region_slice.indices(size)
+        start_crop, stop_crop, _ = crop_slice.indices(size)
+        start, stop = max(start_region, start_crop), min(stop_region, stop_crop)
+        if stop - start < 2:
+            return None
+        intersection.append(slice(start, stop))
+    return tuple(intersection)
+
+
+def integrate_map(
+    grad_x, grad_y, method="frankotchellappa_rfft", regions=None, crop=None
+):
+    """
+    Integrates a gradient map region by region (e.g. the faces of a cube map, see
+    projections.MapProjection.regions)
+    :param grad_x: gradient in x
+    :param grad_y: gradient in y
+    :param method: integration method, function of this module
+    :param regions: list of (row slice, column slice), None: the whole map
+    :param crop: (row slice, column slice) outside of which the gradients are zero
+                 (see mosaicing.coverage), only this part of each region is integrated
+                 and the rest of the image is zero. None: the whole regions. Not
+                 applied along the PERIODIC_AXES of the method
+    :return: reconstructed image, with zero mean in each (cropped) region
+    """
+    integrate = globals()[method]
+    if crop is not None:
+        crop = tuple(
+            slice(None) if axis in PERIODIC_AXES.get(method, ()) else crop_slice
+            for axis, crop_slice in enumerate(crop)
+        )
+    if regions is None:
+        regions = [(slice(None), slice(None))]
+    rec_image = np.zeros(np.shape(grad_x))
+    for rows, cols in regions:
+        if crop is not None:
+            region = _intersect((rows, cols), crop, rec_image.shape)
+            if region is None:
+                continue
+            rows, cols = region
+        rec_region = integrate(grad_x[rows, cols], grad_y[rows, cols])
+        rec_image[rows, cols] = rec_region - np.mean(rec_region)
+    return rec_image
+
+
 if __name__ == "__main__":
     import os
     import pickle
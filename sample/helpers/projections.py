@@ -0,0 +1,220 @@
+import numpy as np
+
+import sample.helpers.coordinate_transforms as coordinate_transforms
+
+
+class MapProjection:
+    """
+    Parameterization of the sphere of viewing directions by the pixels of the map.
+    Mosaicer (EKF, integration) and tracker (map lookups) go through this interface,
+    so the map can be stored in any of the projections below.
+    """
+
+    name = None
+
+    def __init__(self, output_width, output_height):
+        """
+        :param output_width: width of the map
+        :param output_height: height of the map
+        """
+        self.output_width = output_width
+        self.output_height = output_height
+
+    def project(self, point_3d):
+        """
+        :param point_3d: 3D points (directions), 3xN
+        :return: map points (coordinates in the map image), 2xN
+        """
+        raise NotImplementedError
+
+    def unproject(self, pm):
+        """
+        Inverse of project
+        :param pm: map points (coordinates in the map image), 2xN
+        :return: unit directions, 3xN
+        """
+        raise NotImplementedError
+
+    def pixels(self, point_3d):
+        """
+        :param point_3d: 3D points (directions), 3xN
+        :return: row and column indices of the map pixels of the points
+        """
+        pm = self.project(point_3d)
+        return np.floor(pm[1, :]).astype(int), np.floor(pm[0, :]).astype(int)
+
+    def compatible(self, pm, pm_prev):
+        """
+        :param pm: map points, 2xN
+        :param pm_prev: map points of the previous events at the same pixels, 2xN
+        :return: mask of the pairs whose difference is a displacement in the map
+                 (False e.g. across the seam of two cube faces)
+        """
+        return np.ones(pm.shape[1], dtype=bool)
+
+    def regions(self, shape):
+        """
+        :param shape: shape of the map, or of a coarser level of its pyramid
+        :return: list of (row slice, column slice) of the parts of the map that are
+                 continuous and integrated independently
+        """
+        return [(slice(None), slice(None))]
+
+
+class EquirectangularProjection(MapProjection):
+    """
+    Longitude and latitude, linear in both axes. Oversamples the poles, and each point
+    needs an arctan2 and an arcsin.
+    """
+
+    name = "equirectangular"
+
+    def project(self, point_3d):
+        return coordinate_transforms.project_equirectangular_projection(
+            point_3d, self.output_width, self.output_height
+        )
+
+    def unproject(self, pm):
+        phi = (pm[0] / self.output_width - 0.5) * 2.0 * np.pi
+        theta = (0.5 - pm[1] / self.output_height) * np.pi
+        return np.array(
+            [np.cos(theta) * np.sin(phi), -np.sin(theta), np.cos(theta) * np.cos(phi)]
+        )
+
+
+class EqualAreaProjection(MapProjection):
+    """
+    Lambert cylindrical equal-area projection: longitude along x, sine of the latitude
+    along y. All pixels cover the same solid angle, and the rows need no arcsin.
+    """
+
+    name = "equal_area"
+
+    def project(self, point_3d):
+        rho = np.sqrt(sum(np.square(point_3d)))
+        phi = np.arctan2(point_3d[0, :], point_3d[2, :])
+        return np.array(
+            [
+                (phi / (2.0 * np.pi) + 0.5) * self.output_width,
+                (point_3d[1, :] / rho + 1.0) * 0.5 * self.output_height,
+            ]
+        )
+
+    def unproject(self, pm):
+        phi = (pm[0] / self.output_width - 0.5) * 2.0 * np.pi
+        y = 2.0 * pm[1] / self.output_height - 1.0
+        r = np.sqrt(np.maximum(1.0 - y * y, 0.0))
+        return np.array([r * np.sin(phi), y, r * np.cos(phi)])
+
+
+class CubeMapProjection(MapProjection):
+    """
+    Cube map: each direction is projected onto the face of the cube along its major
+    axis, which only needs a face select and a division. The six square faces are laid
+    out in a 2 x 3 atlas:
+        +x  -x  +y
+        -y  +z  -z
+    The map has to be 2 faces high and 3 faces wide.
+    """
+
+    name = "cube_map"
+
+    # Per face (axis of the major component, sign): axes and signs of the face
+    # coordinates (s, t), and row and column of the face in the atlas
+    FACES = [
+        (0, 1, (2, -1), (1, 1), (0, 0)),
+        (0, -1, (2, 1), (1, 1), (0, 1)),
+        (1, 1, (0, 1), (2, -1), (0, 2)),
+        (1, -1, (0, 1), (2, 1), (1, 0)),
+        (2, 1, (0, 1), (1, 1), (1, 1)),
+        (2, -1, (0, -1), (1, 1), (1, 2)),
+    ]
+
+    def __init__(self, output_width, output_height):
+        if output_height % 2 != 0 or output_width * 2 != output_height * 3:
+            raise ValueError(
+                "A cube map is 2 faces high and 3 faces wide, got {}x{}".format(
+                    output_height, output_width
+                )
+            )
+        MapProjection.__init__(self, output_width, output_height)
+        self.face_size = output_height // 2
+
+    def project(self, point_3d):
+        point_3d = np.asarray(point_3d, dtype=np.float64)
+        magnitude = np.abs(point_3d)
+        axis = np.argmax(magnitude, axis=0)
+        major = magnitude[axis, np.arange(point_3d.shape[1])]
+
+        pm = np.full((2, point_3d.shape[1]), np.nan)
+        # Stay inside the face when the point is on its border
+        inner = np.nextafter(float(self.face_size), 0)
+        for face in self.FACES:
+            axis_face, sign, (axis_s, sign_s), (axis_t, sign_t), (row, col) = face
+            on_face = (axis == axis_face) & (np.sign(point_3d[axis_face]) == sign)
+            s = sign_s * point_3d[axis_s, on_face] / major[on_face]
+            t = sign_t * point_3d[axis_t, on_face] / major[on_face]
+            pm[0, on_face] = (
+                np.minimum((s + 1.0) * 0.5 * self.face_size, inner)
+                + col * self.face_size
+            )
+            pm[1, on_face] = (
+                np.minimum((t + 1.0) * 0.5 * self.face_size, inner)
+                + row * self.face_size
+            )
+        return pm
+
+    def unproject(self, pm):
+        pm = np.asarray(pm, dtype=np.float64)
+        face_row = np.floor(pm[1] / self.face_size)
+        face_col = np.floor(pm[0] / self.face_size)
+        point_3d = np.full((3, pm.shape[1]), np.nan)
+        for face in self.FACES:
+            axis_face, sign, (axis_s, sign_s), (axis_t, sign_t), (row, col) = face
+            on_face = (face_row == row) & (face_col == col)
+            s = (pm[0, on_face] / self.face_size - col) * 2.0 - 1.0
+            t = (pm[1, on_face] / self.face_size - row) * 2.0 - 1.0
+            point_3d[axis_face, on_face] = sign
+            point_3d[axis_s, on_face] = sign_s * s
+            point_3d[axis_t, on_face] = sign_t * t
+        return point_3d / np.sqrt(np.sum(np.square(point_3d), axis=0))
+
+    def compatible(self, pm, pm_prev):
+        # Both points on the same face
+        return np.all(
+            np.floor(pm / self.face_size) == np.floor(pm_prev / self.face_size), axis=0
+        )
+
+    def regions(self, shape):
+        face_size = shape[0] // 2
+        return [
+            (
+                slice(row * face_size, (row + 1) * face_size),
+                slice(col * face_size, (col + 1) * face_size),
+            )
+            for _, _, _, _, (row, col) in self.FACES
+        ]
+
+
+PROJECTIONS = {
+    projection.name: projection
+    for projection in [
+        EquirectangularProjection,
+        EqualAreaProjection,
+        CubeMapProjection,
+    ]
+}
+
+
+def get_projection(name, output_width, output_height):
+    """
+    :param name: name of the projection, one of PROJECTIONS
+    :param output_width: width of the map
+    :param output_height: height of the map
+    :return: map projection
+    """
+    if name not in PROJECTIONS:
+        raise ValueError(
+            "Unknown map projection {}, available: {}".format(name, sorted(PROJECTIONS))
+        )
+    return PROJECTIONS[name](output_width, output_height)
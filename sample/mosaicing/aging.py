@@ -0,0 +1,79 @@
+import numpy as np
+
+
+class CovarianceAging:
+    """
+    Process noise of the gradient map: the gradient of each map pixel follows a random
+    walk, so its covariance grows by process_noise * dt between two updates and old
+    observations are slowly forgotten.
+
+    The inflation is applied lazily: the time of the last update is stored per pixel
+    and the covariance is only inflated when the pixel is read again, i.e. right before
+    the EKF update of its next event, or when the map is exported. Aging therefore
+    costs O(events) per batch instead of a pass over the whole map.
+    """
+
+    def __init__(self, map_time, process_noise, max_variance=None):
+        """
+        :param map_time: time of the last update per map pixel, NaN if never updated
+                         (array of the map state, updated in place)
+        :param process_noise: variance added per second to 'xx' and 'yy'
+        :param max_variance: upper bound of the inflated variances, None: no bound
+        """
+        self.map_time = map_time
+        self.process_noise = process_noise
+        self.max_variance = max_variance
+
+    def _inflate(self, covar_xx, covar_yy, dt):
+        # Pixels never updated keep their initial covariance
+        dt = np.where(np.isnan(dt), 0, np.maximum(dt, 0))
+        inflated = []
+        for covar in (covar_xx, covar_yy):
+            covar_new = covar + self.process_noise * dt
+            if self.max_variance is not None:
+                # Inflate up to the bound, never shrink a larger variance
+                covar_new = np.maximum(covar, np.minimum(covar_new, self.max_variance))
+            inflated.append(covar_new)
+        return inflated[0], inflated[1]
+
+    def age(self, grad_map_covar, ir, ic, t_now):
+        """
+        Inflates the covariance of the map points of a batch up to the time of the batch
+        and marks them as updated at that time
+        :param grad_map_covar: dictionary with the covariance maps, updated in place
+        :param ir: row indices of the map points of the batch
+        :param ic: column indices of the map points of the batch
+        :param t_now: time of the batch
+        :return: row and column indices of the aged (unique) pixels
+        """
+        idx = np.unique(ir * self.map_time.shape[1] + ic)
+        ir_unique, ic_unique = np.divmod(idx, self.map_time.shape[1])
+        dt = t_now - self.map_time[ir_unique, ic_unique]
+        (
+            grad_map_covar["xx"][ir_unique, ic_unique],
+            grad_map_covar["yy"][ir_unique, ic_unique],
+        ) = self._inflate(
+            grad_map_covar["xx"][ir_unique, ic_unique],
+            grad_map_covar["yy"][ir_unique, ic_unique],
+            dt,
+        )
+        self.map_time[ir_unique, ic_unique] = t_now
+        return ir_unique, ic_unique
+
+    def aged(self, grad_map_covar, t_now):
+        """
+        Covariance of the whole map as of a given time, for export. The map state is
+        not modified.
+        :param grad_map_covar: dictionary with the covariance maps
+        :param t_now: time of the export
+        :return: dictionary with inflated copies of the covariance maps
+        """
+        covar_xx, covar_yy = self._inflate(
+            grad_map_covar["xx"], grad_map_covar["yy"], t_now - self.map_time
+        )
+        return {
+            "xx": covar_xx,
+            "xy": np.array(grad_map_covar["xy"]),
+            "yx": np.array(grad_map_covar["yx"]),
+            "yy": covar_yy,
+        }
@@ -0,0 +1,139 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def trajectory_angles(poses_t, rotmats_dict):
+    """
+    Cumulative rotation angle along the pose trajectory
+    :param poses_t: timestamps of the poses (pandas Series)
+    :param rotmats_dict: rotation matrices of the poses
+    :return: angle travelled since the first pose at each pose [rad]
+    """
+    rotmats = [rotmats_dict[t] for t in poses_t]
+    # Angle of the relative rotations, the cosine clipped: rounding can push the trace
+    # of a small rotation above 3 (arccos would return NaN)
+    cosines = [
+        (np.trace(rot_0.T.dot(rot_1)) - 1) / 2
+        for rot_0, rot_1 in zip(rotmats[:-1], rotmats[1:])
+    ]
+    increments = np.arccos(np.clip(cosines, -1.0, 1.0))
+    return np.concatenate(([0.0], np.cumsum(increments)))
+
+
+class AdaptiveBatcher:
+    """
+    Chooses the number of events of each batch of the mosaicer.
+    A batch shares a single (interpolated) rotation, so in fast rotations it should
+    span a small angle to keep the map sharp, while in slow segments larger batches
+    reduce the per-batch overhead. The size is chosen so that a batch spans
+    target_angle along the pose trajectory and/or takes at most latency_budget
+    seconds (from the measured time per event), within [min_batch, max_batch].
+    The chosen sizes and timings are kept in history.
+    """
+
+    def __init__(
+        self,
+        t,
+        poses_t,
+        rotmats_dict,
+        num_events_batch,
+        min_batch=500,
+        max_batch=20000,
+        target_angle=None,
+        latency_budget=None,
+        smoothing=0.2,
+    ):
+        """
+        :param t: timestamps of the events
+        :param poses_t: timestamps of the poses (pandas Series)
+        :param rotmats_dict: rotation matrices of the poses
+        :param num_events_batch: batch size used when no criterion applies
+        :param min_batch: minimum number of events per batch
+        :param max_batch: maximum number of events per batch
+        :param target_angle: rotation angle spanned by a batch [rad], None: not used
+        :param latency_budget: processing time per batch [s], None: not used
+        :param smoothing: weight of the last batch in the running time per event
+        """
+        self.t = t
+        self.num_events_batch = num_events_batch
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.target_angle = target_angle
+        self.latency_budget = latency_budget
+        self.smoothing = smoothing
+        self.time_per_event = None
+        self.history = []
+        self.start_time = None
+
+        if target_angle is not None:
+            # Angle travelled at each event, interpolated between the poses
+            self.event_angles = np.interp(
+                t, poses_t.values, trajectory_angles(poses_t, rotmats_dict)
+            )
+
+    def next_size(self, iEv):
+        """
+        :param iEv: index of the first event of the batch
+        :return: number of events of the batch (not beyond the last event), 0 when
+                 all events are processed
+        """
+        if iEv >= len(self.t):
+            return 0
+        size = self.num_events_batch
+        if self.target_angle is not None:
+            stop = np.searchsorted(
+                self.event_angles, self.event_angles[iEv] + self.target_angle
+            )
+            size = stop - iEv
+        if self.latency_budget is not None and self.time_per_event is not None:
+            size = min(size, int(self.latency_budget / self.time_per_event))
+        size = int(np.clip(size, self.min_batch, self.max_batch))
+        self.start_time = time.time()
+        return min(size, len(self.t) - iEv)
+
+    def record(self, iEv, size):
+        """
+        Records the processing time of the batch started by the last call of next_size
+        :param iEv: index of the first event of the batch
+        :param size: number of events of the batch
+        """
+        elapsed = time.time() - self.start_time
+        time_per_event = elapsed / max(size, 1)
+        if self.time_per_event is None:
+            self.time_per_event = time_per_event
+        else:
+            self.time_per_event = (
+                1 - self.smoothing
+            ) * self.time_per_event + self.smoothing * time_per_event
+        angle = np.nan
+        if self.target_angle is not None:
+            angle = self.event_angles[iEv + size - 1] - self.event_angles[iEv]
+        self.history.append(
+            (iEv, size, self.t[iEv + size - 1] - self.t[iEv], angle, elapsed)
+        )
+
+    def dataframe(self):
+        """
+        :return: DataFrame with one row per batch: first event, size, duration, angle, processing time
+        """
+        return pd.DataFrame(
+            self.history, columns=["iEv", "size", "duration", "angle", "elapsed"]
+        )
+
+    def report(self):
+        if not self.history:
+            return "Adaptive batching: no batches"
+        df = self.dataframe()
+        return (
+            "Adaptive batching: {} batches, size min/mean/max {}/{:.0f}/{}, "
+            "{:.2e} s per batch, {:.0f} events/s".format(
+                len(df),
+                df["size"].min(),
+                df["size"].mean(),
+                df["size"].max(),
+                df["elapsed"].mean(),
+                df["size"].sum() / max(df["elapsed"].sum(), 1e-12),
+            )
+        )
@@ -0,0 +1,98 @@
+import os
+import argparse
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+import sample.helpers.datasets as datasets
+
+
+def parse_arguments(description, profile):
+    """
+    Command line arguments shared by the mosaicing scripts
+    :param description: description of the script
+    :param profile: default dataset profile (see helpers.datasets)
+    :return: parsed arguments (profile, resume, extend, state_dir)
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--profile",
+        default=profile,
+        choices=sorted(datasets.PROFILES),
+        help="recording to process",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="continue from the last checkpoint"
+    )
+    parser.add_argument(
+        "--extend",
+        action="store_true",
+        help="extend the persisted map with a new recording",
+    )
+    parser.add_argument(
+        "--state_dir",
+        default=None,
+        help="directory of the map state (default: in memory, <images_dir>/map_state "
+        "with --resume or --extend)",
+    )
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def save_results(
+    engine, images_dir, rec_image, extension="png", dpi=None, masked=("x", "y")
+):
+    """
+    Plots and saves the reconstructed image, the gradient maps (masked as for the
+    integration) and the trace of the covariance, and the batches of the adaptive
+    batching (batches.csv)
+    :param engine: MosaicEngine after processing
+    :param images_dir: output directory of the figures
+    :param rec_image: reconstructed (log) intensity image
+    :param extension: file type of the figures
+    :param dpi: resolution of the figures
+    :param masked: gradient maps zeroed where the covariance is large (see
+                   MosaicEngine.integrate)
+    """
+    grad_map = engine.masked_gradients(masked=masked)
+    trace_map = grad_map["trace"]
+
+    def save(name):
+        plt.savefig(os.path.join(images_dir, name + "." + extension), dpi=dpi)
+        plt.show()
+
+    rec_image_normalized = rec_image / np.max(np.abs(rec_image))
+    plt.figure(1)
+    plt.imshow(rec_image_normalized, cmap=plt.cm.binary)
+    plt.title("Reconstructed image (log)")
+    save("reconstructed_log")
+
+    rec_image_exp = np.exp(0.001 + rec_image)
+    plt.figure(2)
+    plt.imshow(rec_image_exp, cmap=plt.cm.binary)
+    plt.title("Reconstructed image (linear)")
+    save("reconstructed_linear")
+
+    plt.figure(3)
+    plt.imshow(
+        grad_map["x"] / np.std(grad_map["x"]), cmap=plt.cm.binary, vmin=-5, vmax=5
+    )
+    plt.title("Gradient in X")
+    save("gradient_x")
+
+    plt.figure(4)
+    plt.imshow(
+        grad_map["y"] / np.std(grad_map["y"]), cmap=plt.cm.binary, vmin=-5, vmax=5
+    )
+    plt.title("Gradient in Y")
+    save("gradient_y")
+
+    plt.figure(5)
+    plt.imshow(trace_map / np.max(trace_map), cmap=plt.cm.binary, vmin=0, vmax=1)
+    plt.title("Trace of Covariance")
+    save("trace")
+
+    if engine.batcher is not None:
+        engine.batcher.dataframe().to_csv(
+            os.path.join(images_dir, "batches.csv"), index=False
+        )
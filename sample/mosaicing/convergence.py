@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class ConvergenceMask:
+    """
+    Marks map pixels whose covariance trace fell below a threshold as converged (frozen).
+    Events whose current map point lands on a frozen pixel are culled right after
+    projection, saving the projection of the previous map point and the EKF update.
+
+    The mask is maintained incrementally: only the pixels updated by the EKF are
+    re-evaluated after each batch.
+    """
+
+    def __init__(self, grad_map_covar, threshold=0.05):
+        """
+        :param grad_map_covar: dictionary with the covariance maps 'xx', 'xy', 'yx', 'yy'
+        :param threshold: covariance trace below which a pixel is frozen
+                          (same threshold as used for clipping before integration)
+        """
+        self.threshold = threshold
+        # Full pass only once, e.g. for a map state resumed from a checkpoint
+        self.frozen = (grad_map_covar["xx"] + grad_map_covar["yy"]) < threshold
+        self.height, self.width = self.frozen.shape
+
+        # Counters
+        self.num_events_seen = 0
+        self.num_events_culled = 0
+
+    def update(self, grad_map_covar, ir, ic):
+        """
+        Re-evaluates the pixels updated by the EKF
+        :param grad_map_covar: dictionary with the covariance maps
+        :param ir: row indices of the updated map points
+        :param ic: column indices of the updated map points
+        """
+        trace = grad_map_covar["xx"][ir, ic] + grad_map_covar["yy"][ir, ic]
+        self.frozen[ir, ic] = trace < self.threshold
+
+    def cull(self, pm):
+        """
+        Finds the events whose map point hits a frozen pixel
+        :param pm: map points of the events, 2xN (column, row)
+        :return: boolean mask of the events to keep
+        """
+        ir = np.clip(np.floor(pm[1, :]).astype(int), 0, self.height - 1)
+        ic = np.clip(np.floor(pm[0, :]).astype(int), 0, self.width - 1)
+        keep = ~self.frozen[ir, ic]
+
+        self.num_events_seen += len(keep)
+        self.num_events_culled += int(len(keep) - np.sum(keep))
+        return keep
+
+    def num_pixels_frozen(self):
+        return int(np.sum(self.frozen))
+
+    def report(self):
+        """
+        :return: string with the amount of work skipped
+        """
+        fraction = self.num_events_culled / max(self.num_events_seen, 1)
+        return (
+            "Culled events on converged pixels: {}/{} ({:.1f}%), "
+            "frozen pixels: {}".format(
+                self.num_events_culled,
+                self.num_events_seen,
+                100.0 * fraction,
+                self.num_pixels_frozen(),
+            )
+        )
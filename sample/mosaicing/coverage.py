@@ -0,0 +1,74 @@
+import numpy as np
+
+
+class CoverageBounds:
+    """
+    Bounding box of the map pixels that have been updated by the EKF. Outside of it the
+    gradients are masked to zero before integration, so the integration only needs to
+    run on a padded crop of the map, which is much smaller than the panorama for partial
+    sweeps.
+
+    The box is maintained incrementally from the pixels of each batch.
+    """
+
+    def __init__(self, grad_map_covar, grad_initial_variance):
+        """
+        :param grad_map_covar: dictionary with the covariance maps
+        :param grad_initial_variance: initial variance of the gradient map
+        """
+        self.shape = grad_map_covar["xx"].shape
+        self.row_min, self.col_min = self.shape
+        self.row_max, self.col_max = -1, -1
+
+        # Full pass only once, e.g. for a map state resumed from a checkpoint: the
+        # covariance of the updated pixels dropped below the initial one
+        trace = grad_map_covar["xx"] + grad_map_covar["yy"]
+        self.update(*np.nonzero(trace < 2 * grad_initial_variance))
+
+    def update(self, ir, ic):
+        """
+        Extends the box by the pixels updated by the EKF
+        :param ir: row indices of the updated map points
+        :param ic: column indices of the updated map points
+        """
+        if len(ir) == 0:
+            return
+        self.row_min = min(self.row_min, int(np.min(ir)))
+        self.row_max = max(self.row_max, int(np.max(ir)))
+        self.col_min = min(self.col_min, int(np.min(ic)))
+        self.col_max = max(self.col_max, int(np.max(ic)))
+
+    def empty(self):
+        return self.row_max < 0
+
+    def crop(self, level=0, padding=0):
+        """
+        :param level: pyramid level, 0 is the full resolution map
+        :param padding: margin around the box, in pixels of the full resolution map
+        :return: (row slice, column slice) of the padded box at the pyramid level,
+                 None if no pixel has been updated
+        """
+        if self.empty():
+            return None
+        scale = 2 ** level
+        height = -(-self.shape[0] // scale)
+        width = -(-self.shape[1] // scale)
+        return (
+            slice(
+                max(0, (self.row_min - padding) // scale),
+                min(height, -(-(self.row_max + 1 + padding) // scale)),
+            ),
+            slice(
+                max(0, (self.col_min - padding) // scale),
+                min(width, -(-(self.col_max + 1 + padding) // scale)),
+            ),
+        )
+
+    def fraction(self):
+        """
+        :return: fraction of the map covered by the box
+        """
+        if self.empty():
+            return 0.0
+        area = (self.row_max + 1 - self.row_min) * (self.col_max + 1 - self.col_min)
+        return area / float(self.shape[0] * self.shape[1])
@@ -0,0 +1,198 @@
+import numpy as np
+
+from sample.mosaicing.map_state import COVAR_KEYS
+
+
+def keep_last_update(ir, ic, width):
+    """
+    Several events of a batch can hit the same map pixel. All of them are computed from
+    the map before the batch, and the one processed last is written to the map.
+    :param ir: row indices of the map points
+    :param ic: column indices of the map points
+    :param width: width of the map
+    :return: indices of the last event per map pixel
+    """
+    pixel = ir.astype(np.int64) * width + ic
+    _, idx_reversed = np.unique(pixel[::-1], return_index=True)
+    return len(pixel) - 1 - idx_reversed
+
+
+def measurement_jacobian(
+    vel, tc, event_rate, pol, measurement_criterion, contrast_threshold
+):
+    """
+    Linear measurement model z = h . g of the EKF
+    'contrast'   : z is the contrast threshold (Gallego et al. arXiv 2015)
+    'event_rate' : z is the event rate (Kim et al. BMVC 2014)
+    :param vel: velocity of the map points, 2xN
+    :param tc: time since previous event at same pixel
+    :param event_rate: 1 / tc
+    :param pol: polarities of the events (-1, 1)
+    :param measurement_criterion: 'contrast' or 'event_rate'
+    :param contrast_threshold: contrast threshold of the sensor
+    :return: h (Nx2), z (N)
+    """
+    if measurement_criterion == "contrast":
+        h = vel.T * np.array([tc * pol, tc * pol]).T
+        z = np.full(len(tc), float(contrast_threshold))
+    else:
+        h = vel.T / np.array([contrast_threshold * pol, contrast_threshold * pol]).T
+        z = event_rate
+    return h, z
+
+
+def ekf_update(
+    grad_map,
+    grad_map_covar,
+    ir,
+    ic,
+    vel,
+    tc,
+    event_rate,
+    pol,
+    measurement_criterion,
+    contrast_threshold,
+    var_R,
+):
+    """
+    Extended Kalman Filter (EKF) update of the intensity gradient map at the map points
+    of a batch of events. The maps are updated in place.
+    :param grad_map: dictionary with the gradient maps 'x', 'y'
+    :param grad_map_covar: dictionary with the covariance maps 'xx', 'xy', 'yx', 'yy'
+    :param ir: row indices of the current map points
+    :param ic: column indices of the current map points
+    :param vel: velocity of the map points, 2xN
+    :param tc: time since previous event at same pixel
+    :param event_rate: 1 / tc
+    :param pol: polarities of the events (-1, 1)
+    :param measurement_criterion: 'contrast' or 'event_rate'
+    :param contrast_threshold: contrast threshold of the sensor
+    :param var_R: variance of the measurements
+    :return: void
+    """
+    # Get gradient and covariance at current map points pm
+    gm = np.stack((grad_map["x"][ir, ic], grad_map["y"][ir, ic]), axis=1)
+    Pg = np.stack([grad_map_covar[key][ir, ic] for key in COVAR_KEYS], axis=1)
+
+    # EKF update. dhdg: derivative of measurement function
+    dhdg, z = measurement_jacobian(
+        vel, tc, event_rate, pol, measurement_criterion, contrast_threshold
+    )
+    nu_innovation = z - np.sum(dhdg * gm, axis=1)
+
+    Pg_dhdg = np.array(
+        [
+            Pg[:, 0] * dhdg[:, 0] + Pg[:, 1] * dhdg[:, 1],
+            Pg[:, 2] * dhdg[:, 0] + Pg[:, 3] * dhdg[:, 1],
+        ]
+    ).T
+
+    S_covar_innovation = dhdg[:, 0] * Pg_dhdg[:, 0] + dhdg[:, 1] * Pg_dhdg[:, 1] + var_R
+    Kalman_gain = Pg_dhdg / np.array([S_covar_innovation, S_covar_innovation]).T
+
+    # Update gradient and covariance
+    gm = gm + Kalman_gain * np.array([nu_innovation, nu_innovation]).T
+    Pg = (
+        Pg
+        - np.array(
+            [
+                Pg_dhdg[:, 0] * Kalman_gain[:, 0],
+                Pg_dhdg[:, 0] * Kalman_gain[:, 1],
+                Pg_dhdg[:, 1] * Kalman_gain[:, 0],
+                Pg_dhdg[:, 1] * Kalman_gain[:, 1],
+            ]
+        ).T
+    )
+
+    idx = keep_last_update(ir, ic, grad_map["x"].shape[1])
+    ir = ir[idx]
+    ic = ic[idx]
+    grad_map["x"][ir, ic] = gm[idx, 0]
+    grad_map["y"][ir, ic] = gm[idx, 1]
+    for k, key in enumerate(COVAR_KEYS):
+        grad_map_covar[key][ir, ic] = Pg[idx, k]
+
+
+# Keys of the information form: inverse covariance (symmetric) and information vector
+INFO_KEYS = ["xx", "xy", "yy", "x", "y"]
+
+
+def information_update(
+    info,
+    ir,
+    ic,
+    vel,
+    tc,
+    event_rate,
+    pol,
+    measurement_criterion,
+    contrast_threshold,
+    var_R,
+):
+    """
+    EKF update in information form. The measurement model does not depend on the
+    gradient, so the updates are additive and can be accumulated independently
+    (e.g. per time chunk) and fused afterwards with fuse_information.
+    Unlike ekf_update, all events hitting the same map pixel within a batch are fused.
+    :param info: dictionary with the maps 'xx', 'xy', 'yy' (inverse covariance) and
+                 'x', 'y' (information vector), updated in place
+    :param ir: row indices of the current map points
+    :param ic: column indices of the current map points
+    :param vel: velocity of the map points, 2xN
+    :param tc: time since previous event at same pixel
+    :param event_rate: 1 / tc
+    :param pol: polarities of the events (-1, 1)
+    :param measurement_criterion: 'contrast' or 'event_rate'
+    :param contrast_threshold: contrast threshold of the sensor
+    :param var_R: variance of the measurements
+    :return: void
+    """
+    h, z = measurement_jacobian(
+        vel, tc, event_rate, pol, measurement_criterion, contrast_threshold
+    )
+    np.add.at(info["xx"], (ir, ic), h[:, 0] * h[:, 0] / var_R)
+    np.add.at(info["xy"], (ir, ic), h[:, 0] * h[:, 1] / var_R)
+    np.add.at(info["yy"], (ir, ic), h[:, 1] * h[:, 1] / var_R)
+    np.add.at(info["x"], (ir, ic), h[:, 0] * z / var_R)
+    np.add.at(info["y"], (ir, ic), h[:, 1] * z / var_R)
+
+
+def fuse_information(grad_map, grad_map_covar, flat_idx, info_values):
+    """
+    Fuses information accumulated independently into the gradient and covariance maps.
+    Only the given pixels are touched: the map is converted to information form there,
+    the information is added and the result converted back.
+    :param grad_map: dictionary with the gradient maps, updated in place
+    :param grad_map_covar: dictionary with the covariance maps, updated in place
+    :param flat_idx: flat indices of the pixels with information (unique)
+    :param info_values: dictionary with the INFO_KEYS values at these pixels
+    :return: void
+    """
+    width = grad_map["x"].shape[1]
+    ir = flat_idx // width
+    ic = flat_idx % width
+
+    # Prior in information form
+    P_xx = grad_map_covar["xx"][ir, ic]
+    P_xy = grad_map_covar["xy"][ir, ic]
+    P_yy = grad_map_covar["yy"][ir, ic]
+    det = P_xx * P_yy - P_xy * P_xy
+    Y_xx = P_yy / det + info_values["xx"]
+    Y_xy = -P_xy / det + info_values["xy"]
+    Y_yy = P_xx / det + info_values["yy"]
+    g_x = grad_map["x"][ir, ic]
+    g_y = grad_map["y"][ir, ic]
+    y_x = (P_yy * g_x - P_xy * g_y) / det + info_values["x"]
+    y_y = (P_xx * g_y - P_xy * g_x) / det + info_values["y"]
+
+    # Back to covariance and gradient
+    det = Y_xx * Y_yy - Y_xy * Y_xy
+    P_xx = Y_yy / det
+    P_xy = -Y_xy / det
+    P_yy = Y_xx / det
+    grad_map["x"][ir, ic] = P_xx * y_x + P_xy * y_y
+    grad_map["y"][ir, ic] = P_xy * y_x + P_yy * y_y
+    grad_map_covar["xx"][ir, ic] = P_xx
+    grad_map_covar["xy"][ir, ic] = P_xy
+    grad_map_covar["yx"][ir, ic] = P_xy
+    grad_map_covar["yy"][ir, ic] = P_yy
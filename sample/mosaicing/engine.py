@@ -0,0 +1,730 @@
+import numpy as np
+
+import sample.helpers.integration_methods as integration_methods
+import sample.helpers.coordinate_transforms as coordinate_transforms
+import sample.helpers.projections as projections
+import sample.helpers.datasets as datasets
+import sample.mosaicing.map_state as map_state
+import sample.mosaicing.ekf as ekf
+from sample.mosaicing.measurements import batch_measurements
+from sample.mosaicing.parallel import ShardedEKF, mosaic_time_chunks
+from sample.mosaicing.pipeline import MosaicPipeline
+from sample.mosaicing.renderer import BackgroundRenderer
+from sample.mosaicing.batching import AdaptiveBatcher
+from sample.mosaicing.pyramid import MosaicPyramid
+from sample.mosaicing.convergence import ConvergenceMask
+from sample.mosaicing.sweep import ConfigurationSweep
+from sample.mosaicing.aging import CovarianceAging
+from sample.mosaicing.coverage import CoverageBounds
+from sample.mosaicing.live_integration import IncrementalIntegrator
+from sample.helpers.event_filters import (
+    EventFilterChain,
+    HotPixelFilter,
+    RefractoryFilter,
+    BackgroundActivityFilter,
+)
+
+
+# Settings of the mosaicer and their defaults, see MosaicEngine.configure
+DEFAULT_SETTINGS = {
+    # Size of the output reconstructed image mosaic (panorama)
+    "output_height": 1024,
+    "output_width": 2048,
+    # Parameterization of the sphere by the map (see helpers.projections):
+    # 'equirectangular', 'equal_area' or 'cube_map' (2 x 3 faces, e.g. 1024 x 1536)
+    "map_projection": "equirectangular",
+    # Measurement function of the EKF: 'contrast' or 'event_rate'
+    "measurement_criterion": "contrast",
+    # Initial variance of each gradient pixel
+    "grad_initial_variance": 10,
+    # Gradient integration method (function of integration_methods)
+    "integration_method": "frankotchellappa_rfft",
+    # Integrate only the bounding box of the observed pixels, along the axes along which
+    # the integration method is not periodic (see integration_methods.PERIODIC_AXES)
+    "crop_integration": False,
+    "integration_padding": 32,  # margin around that box [pixels]
+    # previews (preview) re-integrate only the changed tiles, not pipelined
+    "live_integration": False,
+    "num_events_batch": 3000,
+    # Persistent map state: directory (None: in memory), recording name, resume / extend
+    "state_dir": None,
+    "recording": None,
+    "resume": False,
+    "extend": False,
+    "checkpoint_every": 50,  # batches between two checkpoints
+    "pyramid_levels": 4,  # levels of the multi-resolution pyramid of the map
+    "freeze_converged": False,  # skip events on map pixels whose covariance has converged
+    "freeze_threshold": 0.05,  # covariance trace below which a map pixel is frozen
+    "process_noise": 0.0,  # variance added per second to map gradients (forgetting), 0: off
+    "max_process_variance": None,  # bound of the variance inflated by the process noise
+    "filter_noise": False,  # drop hot pixel, refractory and background-activity events
+    "refractory_period": 1e-3,  # minimum time between two events at one pixel [s]
+    "background_activity_dt": 1e-2,  # support window of the background-activity filter [s]
+    "num_workers": 1,  # worker processes for the EKF update, 1 runs it serially
+    # >1: offline mode, time chunks mosaicked in parallel and fused in information form
+    # (an approximation of the batch by batch result, see _run_time_chunks)
+    "num_time_chunks": 1,
+    "time_chunk_warmup": 30000,  # events replayed before each time chunk (event map)
+    "pipelined": False,  # run ingest, projection, EKF and integration as overlapping stages
+    "pipeline_integrate_every": 100,  # batches between two integrations in the pipeline
+    "adaptive_batching": False,  # size the batches by rotation angle and/or latency
+    "target_batch_angle": 2e-3,  # rotation angle spanned by a batch [rad], None: not used
+    "batch_latency_budget": None,  # processing time per batch [s], None: not used
+    "min_events_batch": 500,
+    "max_events_batch": 20000,
+    # List of further EKF configurations ('measurement_criterion', 'var_R',
+    # 'grad_initial_variance') mosaicked in the same pass, see ConfigurationSweep
+    "configurations": None,
+    # Animation frames, rendered and written in a background process (batch by batch
+    # only, not pipelined or in time chunks)
+    "animation_dir": None,
+    "plot_events_animation": False,
+    "plot_events_pm_animation": False,
+    "plot_reconstruction_animation": False,
+    "render_every": 1,  # batches between two animation frames
+    "preview_level": 0,  # pyramid level used for the animation previews
+}
+
+
+class MosaicEngine:
+    """
+    Simultaneous mosaicing with a pixel-wise Extended Kalman Filter (EKF) on the
+    intensity gradient map of a panorama, given events and camera orientations.
+
+    The engine holds the map state between calls, so a long-running process can
+    feed it batches of events as they arrive:
+
+        engine = MosaicEngine()
+        engine.configure(sensor_height, sensor_width, undist_pix_calibrated,
+                         contrast_threshold, var_R, poses_t, rotmats_dict)
+        engine.process_batch(t, x, y, pol)   # or engine.run(t, x, y, pol)
+        rec_image = engine.integrate()
+        engine.close()
+    """
+
+    def __init__(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.configured = False
+
+    def configure(
+        self,
+        sensor_height,
+        sensor_width,
+        undist_pix_calibrated,
+        contrast_threshold,
+        var_R,
+        poses_t,
+        rotmats_dict,
+        bearings=None,
+        **settings
+    ):
+        """
+        Sets up the map state and the processing stages
+        :param sensor_height: height of the DVS sensor
+        :param sensor_width: width of the DVS sensor
+        :param undist_pix_calibrated: calibrated bearing per DVS pixel (from the calibration file)
+        :param contrast_threshold: contrast threshold of the sensor
+        :param var_R: variance of the measurements
+        :param poses_t: timestamps of the poses (pandas Series)
+        :param rotmats_dict: rotation matrices of the poses
+        :param bearings: bearing per DVS pixel [y, x] (see datasets.sensor_tables),
+                         None: built from undist_pix_calibrated
+        :param settings: any of DEFAULT_SETTINGS
+        :return: self
+        """
+        unknown = set(settings) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise ValueError("Unknown settings: {}".format(sorted(unknown)))
+        self.settings.update(settings)
+        s = self.settings
+
+        self.sensor_height = sensor_height
+        self.sensor_width = sensor_width
+        if bearings is None:
+            bearings = datasets.bearing_table(
+                undist_pix_calibrated, sensor_height, sensor_width
+            )
+        self.bearings = bearings
+        self.poses_t = poses_t
+        self.rotmats_dict = rotmats_dict
+        self.output_height = s["output_height"]
+        self.output_width = s["output_width"]
+        self.projection = projections.get_projection(
+            s["map_projection"], self.output_width, self.output_height
+        )
+        self.ekf_parameters = {
+            "measurement_criterion": s["measurement_criterion"],
+            "contrast_threshold": contrast_threshold,
+            "var_R": var_R,
+        }
+
+        # Gradient map, covariance map and event map (time and rotation of the last
+        # event per pixel), persisted in the state directory
+        self.state = map_state.MapState(
+            s["state_dir"],
+            self.output_height,
+            self.output_width,
+            sensor_height,
+            sensor_width,
+            s["grad_initial_variance"],
+            recording=s["recording"],
+            resume=s["resume"],
+            extend=s["extend"],
+        )
+        self.grad_map = self.state.grad_map
+        self.grad_map_covar = self.state.grad_map_covar
+        self.event_map_sae = self.state.event_map_sae
+        self.event_map_rotation = self.state.event_map_rotation
+        self.iEv = self.state.cursor["iEv"]  # event counter
+        self.iBatch = self.state.cursor["iBatch"]  # packet-of-events counter
+
+        # Center the map around the first pose
+        rotmats_1stkey = list(rotmats_dict.keys())[0]
+        self.rot0 = self.state.anchor_rotation(rotmats_dict[rotmats_1stkey])
+
+        # Coarse versions of the gradient and covariance maps, built when a coarse
+        # level is first read (see level) and refreshed lazily
+        self.pyramid = None
+
+        # EKF update of the gradient map, serial or sharded by map tiles
+        self.sharded_ekf = None
+        self.ekf_update = ekf.ekf_update
+        if s["num_workers"] > 1:
+            self.sharded_ekf = ShardedEKF(
+                self.grad_map, self.grad_map_covar, s["num_workers"]
+            )
+            self.ekf_update = self.sharded_ekf.update
+
+        # Bounding box of the observed map pixels, to which the integration is cropped
+        self.coverage = None
+        if s["crop_integration"]:
+            self.coverage = CoverageBounds(
+                self.grad_map_covar, s["grad_initial_variance"]
+            )
+
+        # Reconstruction for live previews, re-integrated where the map changed
+        self.live_integrator = None
+        if s["live_integration"]:
+            # The pipeline integrates the map in its own stage (pipeline_integrate_every)
+            if s["pipelined"]:
+                raise ValueError("live_integration is not available pipelined")
+            self.live_integrator = IncrementalIntegrator(
+                self.grad_map,
+                self.grad_map_covar,
+                regions=self.projection.regions(self.grad_map["x"].shape),
+            )
+
+        # Map pixels that have converged and no longer need EKF updates
+        self.convergence = None
+        if s["freeze_converged"]:
+            self.convergence = ConvergenceMask(
+                self.grad_map_covar, threshold=s["freeze_threshold"]
+            )
+
+        # Noise filters, sharing the timestamps of the event map
+        self.noise_filter = None
+        if s["filter_noise"]:
+            self.noise_filter = EventFilterChain(
+                [
+                    HotPixelFilter(sensor_height, sensor_width),
+                    RefractoryFilter(
+                        self.event_map_sae,
+                        s["refractory_period"],
+                        unset_time=map_state.UNSET_TIME,
+                    ),
+                    BackgroundActivityFilter(
+                        self.event_map_sae,
+                        s["background_activity_dt"],
+                        unset_time=map_state.UNSET_TIME,
+                    ),
+                ]
+            )
+
+        self.renderer = None
+        if (
+            s["plot_events_animation"]
+            or s["plot_events_pm_animation"]
+            or s["plot_reconstruction_animation"]
+        ):
+            # Frames are submitted by process_batch only
+            if s["pipelined"] or s["num_time_chunks"] > 1:
+                raise ValueError(
+                    "animations are only rendered batch by batch, "
+                    "not pipelined or in time chunks"
+                )
+            self.renderer = BackgroundRenderer(
+                s["animation_dir"],
+                sensor_width,
+                sensor_height,
+                self.output_width,
+                self.output_height,
+                plot_events=s["plot_events_animation"],
+                plot_events_pm=s["plot_events_pm_animation"],
+                plot_reconstruction=s["plot_reconstruction_animation"],
+                projection=self.projection,
+            )
+
+        # Maps of further EKF configurations, sharing the projections of the events
+        self.sweep = None
+        if s["configurations"]:
+            # Culling follows the convergence of the main map only
+            if s["pipelined"] or s["num_time_chunks"] > 1 or s["freeze_converged"]:
+                raise ValueError(
+                    "configurations are only mosaicked batch by batch, "
+                    "not pipelined, in time chunks or with frozen pixels"
+                )
+            # Their maps live in memory only, they would be lost or restarted from
+            # scratch next to a persistent main map
+            if s["state_dir"] is not None or s["resume"] or s["extend"]:
+                raise ValueError(
+                    "configurations are not persisted, "
+                    "not available with state_dir, resume or extend"
+                )
+            self.sweep = ConfigurationSweep(
+                s["configurations"],
+                self.output_height,
+                self.output_width,
+                contrast_threshold,
+            )
+
+        # Process noise, applied lazily to the map pixels read by the EKF
+        self.aging = None
+        self.t_last = None  # time of the last batch used by the EKF
+        if s["process_noise"] > 0:
+            if s["pipelined"] or s["num_time_chunks"] > 1 or s["freeze_converged"]:
+                raise ValueError(
+                    "process_noise is only applied batch by batch, "
+                    "not pipelined, in time chunks or with frozen pixels"
+                )
+            self.aging = CovarianceAging(
+                self.state.map_time,
+                s["process_noise"],
+                max_variance=s["max_process_variance"],
+            )
+            if not np.all(np.isnan(self.state.map_time)):
+                self.t_last = np.nanmax(self.state.map_time)
+
+        self.batcher = None
+        self.configured = True
+        return self
+
+    def configure_profile(self, profile, tables, poses_t, rotmats_dict, **settings):
+        """
+        Sets up the mosaicer for a dataset profile, see configure
+        :param profile: dataset profile (see helpers.datasets.get_profile)
+        :param tables: lookup tables of the sensor (see helpers.datasets.sensor_tables)
+        :param poses_t: timestamps of the poses (pandas Series)
+        :param rotmats_dict: rotation matrices of the poses
+        :param settings: any of DEFAULT_SETTINGS
+        :return: self
+        """
+        measurement_criterion = settings.get(
+            "measurement_criterion", self.settings["measurement_criterion"]
+        )
+        return self.configure(
+            profile["sensor_height"],
+            profile["sensor_width"],
+            tables["undist_pix_calibrated"],
+            profile["contrast_threshold"],
+            profile["var_R"][measurement_criterion],
+            poses_t,
+            rotmats_dict,
+            bearings=tables["bearings"],
+            **settings
+        )
+
+    def batch_rotation(self, t_first, t_last):
+        """
+        :param t_first: time of the first event of a batch
+        :param t_last: time of the last event of a batch
+        :return: rotation interpolated at the middle of the batch, None if it is
+                 later than the last known pose
+        """
+        t_ev_mean = (t_first + t_last) * 0.5
+        if t_ev_mean > self.poses_t.iloc[-1]:
+            return None
+        return coordinate_transforms.rotation_interpolation(
+            self.poses_t, self.rotmats_dict, t_ev_mean
+        )
+
+    def _checkpoint_due(self):
+        s = self.settings
+        return (
+            self.iEv - self.state.cursor["iEv"]
+            >= s["checkpoint_every"] * s["num_events_batch"]
+        )
+
+    def process_batch(self, t, x, y, pol, Rot=None):
+        """
+        Processes one batch of events: updates the event map and the gradient map
+        :param t: timestamps of the events
+        :param x: x coordinates of the events (integer array)
+        :param y: y coordinates of the events (integer array)
+        :param pol: polarities of the events (0, 1)
+        :param Rot: rotation of the batch, None: interpolated from the poses
+        :return: measurements of the batch (see batch_measurements), None if the batch
+                 did not update the map (initialization phase, all events filtered,
+                 no pose: the events are then not counted in iEv)
+        """
+        if Rot is None:
+            Rot = self.batch_rotation(t[0], t[-1])
+            if Rot is None:
+                return None
+        if self._checkpoint_due():
+            self.state.checkpoint(self.iEv, self.iBatch)
+        num_events = len(t)
+
+        # Drop noise events before projection and EKF
+        if self.noise_filter is not None:
+            mask_keep = self.noise_filter.apply(t, x, y, pol)
+            t, x, y, pol = t[mask_keep], x[mask_keep], y[mask_keep], pol[mask_keep]
+        measurements = None
+        if len(t) > 0:
+            measurements = self._update_maps(t, x, y, pol, Rot)
+        # Events are counted once consumed: filtered out, in the event map or the EKF
+        self.iEv += num_events
+        if measurements is None:
+            return None
+
+        if (
+            self.renderer is not None
+            and self.iBatch % self.settings["render_every"] == 0
+        ):
+            grad_map_preview, grad_map_covar_preview = self.level(
+                self.settings["preview_level"]
+            )
+            self.renderer.submit(
+                self.iEv,
+                x,
+                y,
+                pol,
+                measurements["pm"],
+                measurements["pol"],
+                grad_map_preview,
+                grad_map_covar_preview,
+                crop=self.integration_crop(self.settings["preview_level"]),
+            )
+        return measurements
+
+    def _update_maps(self, t, x, y, pol, Rot):
+        """
+        Updates the event map and the gradient map with the events of a batch
+        :param t: timestamps of the events
+        :param x: x coordinates of the events (integer array)
+        :param y: y coordinates of the events (integer array)
+        :param pol: polarities of the events (0, 1)
+        :param Rot: rotation of the batch
+        :return: measurements of the batch, None if the map was not updated
+        """
+        measurements = batch_measurements(
+            t,
+            x,
+            y,
+            pol,
+            Rot,
+            self.rot0,
+            self.event_map_sae,
+            self.event_map_rotation,
+            self.bearings,
+            self.output_width,
+            self.output_height,
+            self.poses_t.iloc[0],
+            convergence=self.convergence,
+            projection=self.projection,
+        )
+        if measurements is None or len(measurements["ir"]) == 0:
+            return None
+
+        ## Extended Kalman Filter (EKF) for the intensity gradient map.
+        ir = measurements["ir"]
+        ic = measurements["ic"]
+        if self.aging is not None:
+            # Inflate the covariance of the pixels read by this batch since their last update
+            self.t_last = t[-1]
+            ir_aged, ic_aged = self.aging.age(self.grad_map_covar, ir, ic, self.t_last)
+            if self.sharded_ekf is not None:
+                self.sharded_ekf.sync_pixels(self.grad_map_covar, ir_aged, ic_aged)
+        self.ekf_update(
+            self.grad_map,
+            self.grad_map_covar,
+            ir,
+            ic,
+            measurements["vel"],
+            measurements["tc"],
+            measurements["event_rate"],
+            measurements["pol"],
+            **self.ekf_parameters
+        )
+        if self.pyramid is not None:
+            self.pyramid.mark_dirty(ir, ic)
+        if self.coverage is not None:
+            self.coverage.update(ir, ic)
+        if self.live_integrator is not None:
+            self.live_integrator.mark_dirty(ir, ic)
+        if self.convergence is not None:
+            self.convergence.update(self.grad_map_covar, ir, ic)
+        if self.sweep is not None:
+            self.sweep.update(measurements)
+        self.iBatch = self.iBatch + 1
+        return measurements
+
+    def _run_time_chunks(self, t, x, y, pol):
+        """
+        Mosaics the events from the event cursor on in time chunks (see
+        mosaic_time_chunks). The result is not the one of the batch by batch run: at a
+        pixel observed in several chunks the chunk updates are fused in information
+        form, while the serial EKF updates it from the last estimate, event after event.
+        """
+        s = self.settings
+        print("Processing {} time chunks in parallel".format(s["num_time_chunks"]))
+        self.iEv += mosaic_time_chunks(
+            self.grad_map,
+            self.grad_map_covar,
+            t[self.iEv :],
+            x[self.iEv :],
+            y[self.iEv :],
+            pol[self.iEv :],
+            self.poses_t,
+            self.rotmats_dict,
+            self.rot0,
+            self.bearings,
+            s["num_events_batch"],
+            self.ekf_parameters,
+            s["num_time_chunks"],
+            s["time_chunk_warmup"],
+            projection=self.projection,
+        )
+        if self.sharded_ekf is not None:
+            # The workers of the sharded EKF keep their own copy of the maps
+            self.sharded_ekf.sync_maps(self.grad_map, self.grad_map_covar)
+        if self.pyramid is not None:
+            self.pyramid.mark_all_dirty()
+        if self.live_integrator is not None:
+            self.live_integrator.mark_all_dirty()
+        if self.coverage is not None:
+            self.coverage = CoverageBounds(
+                self.grad_map_covar, s["grad_initial_variance"]
+            )
+        if self.convergence is not None:
+            self.convergence = ConvergenceMask(
+                self.grad_map_covar, threshold=s["freeze_threshold"]
+            )
+
+    def _on_pipeline_batch(self, iEv, ir, ic, synced):
+        if len(ir) > 0:
+            if self.pyramid is not None:
+                self.pyramid.mark_dirty(ir, ic)
+            if self.coverage is not None:
+                self.coverage.update(ir, ic)
+            if self.live_integrator is not None:
+                self.live_integrator.mark_dirty(ir, ic)
+            if self.convergence is not None:
+                self.convergence.update(self.grad_map_covar, ir, ic)
+            self.iBatch = self.iBatch + 1
+        if synced:
+            self.state.checkpoint(iEv, self.iBatch)
+
+    def _run_pipelined(self, t, x, y, pol):
+        s = self.settings
+        pipeline = MosaicPipeline(
+            t,
+            x,
+            y,
+            pol,
+            self.poses_t,
+            self.rotmats_dict,
+            self.rot0,
+            self.bearings,
+            self.event_map_sae,
+            self.event_map_rotation,
+            self.grad_map,
+            self.grad_map_covar,
+            s["num_events_batch"],
+            self.ekf_update,
+            self.ekf_parameters,
+            integrate_every=s["pipeline_integrate_every"],
+            sync_every=s["checkpoint_every"],
+            on_batch=self._on_pipeline_batch,
+            noise_filter=self.noise_filter,
+            convergence=self.convergence,
+            projection=self.projection,
+            coverage=self.coverage,
+            integration_padding=s["integration_padding"],
+            integration_method=s["integration_method"],
+        )
+        self.iEv = pipeline.run(self.iEv)
+        print(pipeline.report())
+        return pipeline
+
+    def run(self, t, x, y, pol):
+        """
+        Processes a whole recording, from the event cursor of the map state on
+        (time chunks, pipelined or batch by batch, according to the settings)
+        :param t: timestamps of all events of the recording
+        :param x: x coordinates of the events (integer array)
+        :param y: y coordinates of the events (integer array)
+        :param pol: polarities of the events (0, 1)
+        :return: number of events of the recording processed
+        """
+        s = self.settings
+        num_events = len(t)
+
+        ## Offline mode: time chunks mosaicked in parallel, fused in information form
+        if s["num_time_chunks"] > 1:
+            self._run_time_chunks(t, x, y, pol)
+
+        ## Pipelined mode: ingest, projection, EKF and integration overlap in separate threads
+        if s["pipelined"] and self.iEv + s["num_events_batch"] <= num_events:
+            self._run_pipelined(t, x, y, pol)
+            # Only the events after the last known pose are left
+            num_events = min(num_events, self.iEv)
+
+        # Batch sizes adapted to the rotation speed and/or a latency budget
+        if s["adaptive_batching"]:
+            self.batcher = AdaptiveBatcher(
+                t,
+                self.poses_t,
+                self.rotmats_dict,
+                s["num_events_batch"],
+                min_batch=s["min_events_batch"],
+                max_batch=s["max_events_batch"],
+                target_angle=s["target_batch_angle"],
+                latency_budget=s["batch_latency_budget"],
+            )
+
+        while True:
+            if self.batcher is not None:
+                size_batch = self.batcher.next_size(self.iEv)
+            else:
+                size_batch = s["num_events_batch"]
+            if self.iEv + size_batch > num_events or size_batch == 0:
+                print("No more events")
+                break
+
+            start = self.iEv
+            stop = start + size_batch
+            Rot = self.batch_rotation(t[start], t[stop - 1])
+            if Rot is None:
+                print("Event later than last known pose")
+                break
+            self.process_batch(
+                t[start:stop], x[start:stop], y[start:stop], pol[start:stop], Rot
+            )
+            if self.batcher is not None:
+                self.batcher.record(start, size_batch)
+
+        return self.iEv
+
+    def level(self, level):
+        """
+        :param level: pyramid level, 0 is the full resolution map
+        :return: grad_map, grad_map_covar of the level (the maps of the mosaicer at
+                 level 0, see MosaicPyramid.level)
+        """
+        if level == 0:
+            return self.grad_map, self.grad_map_covar
+        if self.pyramid is None:
+            self.pyramid = MosaicPyramid(
+                self.grad_map,
+                self.grad_map_covar,
+                num_levels=self.settings["pyramid_levels"],
+            )
+        return self.pyramid.level(level)
+
+    def snapshot(self, level=0):
+        """
+        :param level: pyramid level, 0 is the full resolution map
+        :return: dictionary with copies of the gradient map ('grad_map') and the
+                 covariance map ('grad_map_covar') and the counters ('iEv', 'iBatch').
+                 With process noise, the covariance of level 0 is aged up to the last batch.
+        """
+        grad_map, grad_map_covar = self.level(level)
+        if level == 0 and self.aging is not None and self.t_last is not None:
+            grad_map_covar = self.aging.aged(grad_map_covar, self.t_last)
+        return {
+            "iEv": self.iEv,
+            "iBatch": self.iBatch,
+            "grad_map": {key: np.array(value) for key, value in grad_map.items()},
+            "grad_map_covar": {
+                key: np.array(value) for key, value in grad_map_covar.items()
+            },
+        }
+
+    def integration_crop(self, level=0):
+        """
+        :param level: pyramid level, 0 is the full resolution map
+        :return: (row slice, column slice) of the padded bounding box of the observed
+                 pixels at the pyramid level, None: the whole map is integrated
+        """
+        if self.coverage is None:
+            return None
+        return self.coverage.crop(level, padding=self.settings["integration_padding"])
+
+    def masked_gradients(self, level=0, threshold=0.05, masked=("x", "y")):
+        """
+        :param level: pyramid level, 0 is the full resolution map
+        :param threshold: gradients whose covariance trace is above are zeroed
+        :param masked: keys of the gradient maps that are zeroed
+        :return: dictionary with copies of the gradient maps, masked, and the trace of
+                 the covariance ('trace')
+        """
+        snapshot = self.snapshot(level)
+        grad_map = snapshot["grad_map"]
+        grad_map["trace"] = (
+            snapshot["grad_map_covar"]["xx"] + snapshot["grad_map_covar"]["yy"]
+        )
+        mask = grad_map["trace"] > threshold
+        for key in masked:
+            grad_map[key][mask] = 0
+        return grad_map
+
+    def integrate(self, level=0, threshold=0.05, masked=("x", "y")):
+        """
+        Reconstructs the (log) intensity image from the gradient map
+        :param level: pyramid level, 0 is the full resolution map
+        :param threshold: only gradients whose covariance trace is below are integrated
+        :param masked: keys of the gradient maps that are zeroed above threshold
+        :return: reconstructed image with zero mean
+        """
+        # reconstruct only gradients with small covariance
+        grad_map = self.masked_gradients(level, threshold, masked)
+        return integration_methods.integrate_map(
+            grad_map["x"],
+            grad_map["y"],
+            method=self.settings["integration_method"],
+            regions=self.projection.regions(grad_map["x"].shape),
+            crop=self.integration_crop(level),
+        )
+
+    def preview(self, full=False):
+        """
+        Reconstruction for live previews. With live_integration, only the tiles changed
+        since the last preview are re-integrated, warm started from the last one.
+        :param full: integrate the whole map
+        :return: reconstructed image with zero mean
+        """
+        if self.live_integrator is None:
+            return self.integrate()
+        return self.live_integrator.refresh(full=full)
+
+    def checkpoint(self):
+        self.state.checkpoint(self.iEv, self.iBatch)
+
+    def close(self):
+        """
+        Writes a final checkpoint, stops the worker processes and prints the reports
+        """
+        self.checkpoint()
+        if self.sharded_ekf is not None:
+            self.sharded_ekf.close()
+        if self.renderer is not None:
+            self.renderer.close()
+            print(self.renderer.report())
+        if self.convergence is not None:
+            print(self.convergence.report())
+        if self.live_integrator is not None:
+            print(self.live_integrator.report())
+        if self.noise_filter is not None:
+            print(self.noise_filter.report())
+        if self.batcher is not None:
+            print(self.batcher.report())
@@ -0,0 +1,277 @@
+import numpy as np
+import scipy.fft
+from scipy import ndimage
+
+import sample.helpers.integration_methods as integration_methods
+
+
+def _masked_window(grad_map, grad_map_covar, key, rows, cols, threshold):
+    """
+    :return: gradient key in the window, zero where the covariance trace is above
+             the threshold (as before a full integration)
+    """
+    trace = grad_map_covar["xx"][rows, cols] + grad_map_covar["yy"][rows, cols]
+    return np.where(trace > threshold, 0, grad_map[key][rows, cols])
+
+
+def _box_divergence(g, box, bounds, axis):
+    """
+    Divergence along one axis in a box, same discretization as the Neumann Poisson
+    solver of integration_methods on the whole region
+    :param g: function (rows, cols) -> masked gradient along the axis in that window
+    :param box: (row start, row stop, column start, column stop) of the box
+    :param bounds: same for the region, whose border has no flow across it
+    :param axis: 0 (rows) or 1 (columns)
+    :return: divergence in the box
+    """
+    start, stop = box[2 * axis], box[2 * axis + 1]
+    lower, upper = bounds[2 * axis], bounds[2 * axis + 1]
+    # Window with one more pixel on each side along the axis, where inside the region
+    first, last = max(start - 1, lower), min(stop + 1, upper)
+    window = [slice(box[0], box[1]), slice(box[2], box[3])]
+    window[axis] = slice(first, last)
+    w = np.moveaxis(g(*window), axis, 0)
+    if first == start:
+        w = np.concatenate((np.zeros_like(w[:1]), w))
+    if last == stop:
+        w = np.concatenate((w, np.zeros_like(w[:1])))
+
+    # Differences between neighbours, none across the border of the region
+    d = 0.5 * (w[:-1] + w[1:])
+    if start == lower:
+        d[0] = 0
+    if stop == upper:
+        d[-1] = 0
+    return np.moveaxis(d[1:] - d[:-1], 0, axis)
+
+
+class IncrementalIntegrator:
+    """
+    Live reconstruction of the (log) intensity map. After a full solve, only the tiles
+    updated by the EKF since the last refresh are re-integrated: the Poisson equation
+    is solved on a padded neighbourhood of each group of dirty tiles, with the previous
+    solution as boundary values around it and as starting point of conjugate gradients,
+    preconditioned with a DST solve of the box. Since only a few tiles change between
+    two previews, a few iterations are enough.
+
+    The discretization is the one of integration_methods.poisson_neumann, which is used
+    for the full solves. Each region of the map projection (e.g. cube face) is solved
+    on its own.
+    """
+
+    def __init__(
+        self,
+        grad_map,
+        grad_map_covar,
+        regions=None,
+        tile_size=64,
+        padding=16,
+        threshold=0.05,
+        max_iterations=50,
+        tolerance=1e-4,
+        max_fraction=0.5,
+    ):
+        """
+        :param grad_map: dictionary with the gradient maps (live, not copied)
+        :param grad_map_covar: dictionary with the covariance maps (live, not copied)
+        :param regions: parts of the map integrated independently (see
+                        projections.MapProjection.regions), None: the whole map
+        :param tile_size: side of the tiles tracked as dirty, in pixels
+        :param padding: margin re-solved around the dirty tiles, in pixels
+        :param threshold: only gradients whose covariance trace is below are integrated
+        :param max_iterations: maximum number of conjugate gradient iterations
+        :param tolerance: relative residual at which conjugate gradients stop
+        :param max_fraction: fraction of a region above which it is solved in full
+        """
+        self.grad_map = grad_map
+        self.grad_map_covar = grad_map_covar
+        self.shape = grad_map["x"].shape
+        if regions is None:
+            regions = [(slice(None), slice(None))]
+        self.bounds = []
+        for rows, cols in regions:
+            row_start, row_stop, _ = rows.indices(self.shape[0])
+            col_start, col_stop, _ = cols.indices(self.shape[1])
+            self.bounds.append((row_start, row_stop, col_start, col_stop))
+        self.tile_size = tile_size
+        self.padding = padding
+        self.threshold = threshold
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.max_fraction = max_fraction
+
+        self.num_tiles = (
+            -(-self.shape[0] // tile_size),
+            -(-self.shape[1] // tile_size),
+        )
+        self.dirty = np.zeros(self.num_tiles, dtype=bool)
+        self.solution = None
+
+        # Counters
+        self.num_full_solves = 0
+        self.num_box_solves = 0
+        self.num_iterations = 0
+
+    def mark_dirty(self, ir, ic):
+        """
+        Marks the tiles containing the given map points as changed
+        :param ir: row indices of the updated map points
+        :param ic: column indices of the updated map points
+        """
+        self.dirty[
+            np.asarray(ir) // self.tile_size, np.asarray(ic) // self.tile_size
+        ] = True
+
+    def mark_all_dirty(self):
+        self.dirty[:] = True
+
+    def _gradient(self, key):
+        return lambda rows, cols: _masked_window(
+            self.grad_map, self.grad_map_covar, key, rows, cols, self.threshold
+        )
+
+    def full_solve(self):
+        """
+        Integrates the whole map with the Poisson solver
+        :return: reconstructed image with zero mean
+        """
+        rows, cols = slice(None), slice(None)
+        grad_x = self._gradient("x")(rows, cols)
+        grad_y = self._gradient("y")(rows, cols)
+        regions = [(slice(r0, r1), slice(c0, c1)) for r0, r1, c0, c1 in self.bounds]
+        self.solution = integration_methods.integrate_map(
+            grad_x, grad_y, method="poisson_neumann", regions=regions
+        )
+        self.dirty[:] = False
+        self.num_full_solves += 1
+        return self.image()
+
+    def _solve_box(self, box, bounds):
+        """
+        Conjugate gradients on the Poisson equation in a box, the pixels around it
+        fixed to the current solution
+        :param box: (row start, row stop, column start, column stop) of the box
+        :param bounds: same for the region containing the box
+        """
+        r0, r1, c0, c1 = box
+        divergence = _box_divergence(
+            self._gradient("x"), box, bounds, 1
+        ) + _box_divergence(self._gradient("y"), box, bounds, 0)
+
+        # Neighbours of the box pixels: inside the box (unknowns), outside the box
+        # (fixed) or outside the region (no neighbour, Neumann)
+        b = -divergence
+        degree = np.zeros((r1 - r0, c1 - c0))
+        sides = [
+            (r0 > bounds[0], (slice(0, 1), slice(None)), (r0 - 1, slice(c0, c1))),
+            (r1 < bounds[1], (slice(-1, None), slice(None)), (r1, slice(c0, c1))),
+            (c0 > bounds[2], (slice(None), slice(0, 1)), (slice(r0, r1), c0 - 1)),
+            (c1 < bounds[3], (slice(None), slice(-1, None)), (slice(r0, r1), c1)),
+        ]
+        degree[1:, :] += 1
+        degree[:-1, :] += 1
+        degree[:, 1:] += 1
+        degree[:, :-1] += 1
+        for inside_region, edge, outside in sides:
+            if inside_region:
+                degree[edge] += 1
+                b[edge] += self.solution[outside].reshape(b[edge].shape)
+
+        def apply(x):
+            # degree * x - sum of the neighbours inside the box
+            y = degree * x
+            y[1:, :] -= x[:-1, :]
+            y[:-1, :] -= x[1:, :]
+            y[:, 1:] -= x[:, :-1]
+            y[:, :-1] -= x[:, 1:]
+            return y
+
+        # Preconditioner: the same Laplacian with fixed values all around the box,
+        # which a DST solves exactly (it only differs at the border of the region)
+        eigenvalues = (
+            4
+            - 2
+            * np.cos(np.pi * np.arange(1, r1 - r0 + 1) / (r1 - r0 + 1))[:, np.newaxis]
+            - 2
+            * np.cos(np.pi * np.arange(1, c1 - c0 + 1) / (c1 - c0 + 1))[np.newaxis, :]
+        )
+
+        def precondition(r):
+            R = scipy.fft.dstn(r, type=1, norm="ortho")
+            return scipy.fft.idstn(R / eigenvalues, type=1, norm="ortho")
+
+        # Preconditioned conjugate gradients, warm started from the previous solution
+        x = np.array(self.solution[r0:r1, c0:c1])
+        r = b - apply(x)
+        z = precondition(r)
+        p = z.copy()
+        rz = np.sum(r * z)
+        stop = (self.tolerance * np.linalg.norm(b)) ** 2
+        for _ in range(self.max_iterations):
+            if np.sum(r * r) <= stop:
+                break
+            Ap = apply(p)
+            alpha = rz / np.sum(p * Ap)
+            x += alpha * p
+            r -= alpha * Ap
+            z = precondition(r)
+            rz_new = np.sum(r * z)
+            p = z + (rz_new / rz) * p
+            rz = rz_new
+            self.num_iterations += 1
+        self.solution[r0:r1, c0:c1] = x
+        self.num_box_solves += 1
+
+    def refresh(self, full=False):
+        """
+        Brings the reconstruction up to date with the gradient map
+        :param full: solve the whole map instead of the dirty tiles
+        :return: reconstructed image with zero mean
+        """
+        if full or self.solution is None:
+            return self.full_solve()
+
+        # Groups of neighbouring dirty tiles, each solved in one padded box
+        labels, num_groups = ndimage.label(self.dirty, structure=np.ones((3, 3)))
+        for group in ndimage.find_objects(labels):
+            tile_rows, tile_cols = group
+            box = (
+                tile_rows.start * self.tile_size - self.padding,
+                tile_rows.stop * self.tile_size + self.padding,
+                tile_cols.start * self.tile_size - self.padding,
+                tile_cols.stop * self.tile_size + self.padding,
+            )
+            for bounds in self.bounds:
+                box_region = (
+                    max(box[0], bounds[0]),
+                    min(box[1], bounds[1]),
+                    max(box[2], bounds[2]),
+                    min(box[3], bounds[3]),
+                )
+                if box_region[0] >= box_region[1] or box_region[2] >= box_region[3]:
+                    continue
+                area = (box_region[1] - box_region[0]) * (box_region[3] - box_region[2])
+                area_region = (bounds[1] - bounds[0]) * (bounds[3] - bounds[2])
+                if area > self.max_fraction * area_region:
+                    # Most of the region changed, a full solve is cheaper
+                    return self.full_solve()
+                self._solve_box(box_region, bounds)
+        self.dirty[:] = False
+        return self.image()
+
+    def image(self):
+        """
+        :return: current reconstruction with zero mean in each region
+        """
+        rec_image = np.array(self.solution)
+        for r0, r1, c0, c1 in self.bounds:
+            rec_image[r0:r1, c0:c1] -= np.mean(rec_image[r0:r1, c0:c1])
+        return rec_image
+
+    def report(self):
+        return (
+            "Live integration: {} full solves, {} box solves, "
+            "{} conjugate gradient iterations".format(
+                self.num_full_solves, self.num_box_solves, self.num_iterations
+            )
+        )
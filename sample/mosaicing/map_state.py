@@ -0,0 +1,271 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+# Arrays making up the state of the mosaicing EKF, stored as one .npy file each
+GRAD_KEYS = ["x", "y"]
+COVAR_KEYS = ["xx", "xy", "yx", "yy"]
+
+# Time of last event (SAE) of the pixels that have not fired yet
+UNSET_TIME = -1e-6
+
+
+def _array_shapes(output_height, output_width, sensor_height, sensor_width):
+    """
+    Shapes of all arrays making up the map state
+    :param output_height: height of the panorama
+    :param output_width: width of the panorama
+    :param sensor_height: height of the DVS sensor
+    :param sensor_width: width of the DVS sensor
+    :return: dictionary with file names (without extension) as keys and shapes as values
+    """
+    shapes = {}
+    for key in GRAD_KEYS:
+        shapes["grad_" + key] = (output_height, output_width)
+    for key in COVAR_KEYS:
+        shapes["covar_" + key] = (output_height, output_width)
+    # Time of the last EKF update per map pixel, for the process noise (aging.py)
+    shapes["map_time"] = (output_height, output_width)
+    shapes["event_map_sae"] = (sensor_height, sensor_width)
+    shapes["event_map_rotation"] = (sensor_height, sensor_width, 3, 3)
+    return shapes
+
+
+def update_event_map(event_map_sae, event_map_rotation, x, y, t, Rot):
+    """
+    Reads the time and rotation of the previous event at the pixels of a batch of events
+    and updates the event map (time and rotation of last event) with the batch.
+    Equivalent to updating the pixels one event after the other: if a pixel fires
+    several times within a batch, the later events see the rotation of the current batch.
+    :param event_map_sae: time of last event per pixel, sensor_height x sensor_width
+    :param event_map_rotation: rotation of last event per pixel, sensor_height x sensor_width x 3 x 3
+    :param x: x coordinates of the events (integer array)
+    :param y: y coordinates of the events (integer array)
+    :param t: timestamps of the events
+    :param Rot: rotation of the current batch
+    :return: t_prev (N), rot_prev (N x 3 x 3)
+    """
+    t_prev = event_map_sae[y, x]
+    rot_prev = event_map_rotation[y, x]
+
+    # Events whose pixel already fired earlier in this batch
+    _, idx_first = np.unique(y * event_map_sae.shape[1] + x, return_index=True)
+    repeated = np.ones(len(x), dtype=bool)
+    repeated[idx_first] = False
+    rot_prev[repeated] = Rot
+
+    # Update last rotation and time of event (SAE). For repeated pixels the last event wins.
+    event_map_sae[y, x] = t
+    event_map_rotation[y, x] = Rot
+    return t_prev, rot_prev
+
+
+class MapState:
+    """
+    Gradient map, covariance map and event map of the mosaicing EKF,
+    backed by memory-mapped files in a state directory.
+
+    The live arrays in state_dir/live are modified in place while processing.
+    A checkpoint copies them to state_dir/checkpoint_<n> together with the event cursor
+    and then atomically points state_dir/checkpoint.json to it, so that the
+    latest checkpoint is always consistent, even if the process dies while writing.
+    Without a state directory the arrays are kept in memory and checkpoints only
+    advance the event cursor.
+    """
+
+    def __init__(
+        self,
+        state_dir,
+        output_height,
+        output_width,
+        sensor_height,
+        sensor_width,
+        grad_initial_variance,
+        recording,
+        resume=False,
+        extend=False,
+    ):
+        """
+        Opens (or creates) the persistent map state
+        :param state_dir: directory holding the live arrays and the checkpoints,
+                          None: in-memory state without checkpoints
+        :param output_height: height of the panorama
+        :param output_width: width of the panorama
+        :param sensor_height: height of the DVS sensor
+        :param sensor_width: width of the DVS sensor
+        :param grad_initial_variance: initial variance of the gradient map
+        :param recording: name of the recording (events file) that is processed
+        :param resume: continue the same recording from the last checkpoint
+        :param extend: keep the map of the last checkpoint, but process a new recording
+                       from its first event (fresh event map and event cursor)
+        """
+        self.state_dir = state_dir
+        self.live_dir = None
+        if state_dir is not None:
+            self.live_dir = os.path.join(state_dir, "live")
+        self.grad_initial_variance = grad_initial_variance
+        self.shapes = _array_shapes(
+            output_height, output_width, sensor_height, sensor_width
+        )
+        if self.live_dir is not None and not os.path.exists(self.live_dir):
+            os.makedirs(self.live_dir)
+
+        checkpoint = self.latest_checkpoint()
+        if (resume or extend) and checkpoint is not None:
+            self._restore(checkpoint)
+            self.cursor = checkpoint
+            if extend or checkpoint["recording"] != recording:
+                print("Extending persisted map with recording {}".format(recording))
+                self._reset_event_map()
+                # Times of the new recording have another origin
+                self.arrays["map_time"][:] = np.nan
+                self.cursor["recording"] = recording
+                self.cursor["iEv"] = 0
+                self.cursor["iBatch"] = 1
+            else:
+                print("Resuming from event # {}".format(checkpoint["iEv"]))
+        else:
+            if resume or extend:
+                print("No checkpoint in {}, starting from scratch".format(state_dir))
+            self._create()
+            self.cursor = {
+                "recording": recording,
+                "iEv": 0,
+                "iBatch": 1,
+                "checkpoint": 0,
+                "rot0": None,
+            }
+
+        self.grad_map = {key: self.arrays["grad_" + key] for key in GRAD_KEYS}
+        self.grad_map_covar = {key: self.arrays["covar_" + key] for key in COVAR_KEYS}
+        self.map_time = self.arrays["map_time"]
+        self.event_map_sae = self.arrays["event_map_sae"]
+        self.event_map_rotation = self.arrays["event_map_rotation"]
+
+    def _path(self, directory, name):
+        return os.path.join(directory, name + ".npy")
+
+    def _open(self, mode):
+        self.arrays = {}
+        for name, shape in self.shapes.items():
+            if self.live_dir is None:
+                self.arrays[name] = np.empty(shape)
+                continue
+            self.arrays[name] = np.lib.format.open_memmap(
+                self._path(self.live_dir, name),
+                mode=mode,
+                dtype=np.float64,
+                shape=shape,
+            )
+
+    def _create(self):
+        """
+        Creates the live arrays with the EKF initialization
+        """
+        self._open("w+")
+        for key in GRAD_KEYS:
+            self.arrays["grad_" + key][:] = 0.0
+        self.arrays["covar_xx"][:] = self.grad_initial_variance
+        self.arrays["covar_xy"][:] = 0.0
+        self.arrays["covar_yx"][:] = 0.0
+        self.arrays["covar_yy"][:] = self.grad_initial_variance
+        self.arrays["map_time"][:] = np.nan
+        self._reset_event_map()
+
+    def _reset_event_map(self):
+        self.arrays["event_map_sae"][:] = UNSET_TIME
+        self.arrays["event_map_rotation"][:] = np.nan
+
+    def _restore(self, checkpoint):
+        """
+        Copies the arrays of a checkpoint to the live directory and maps them
+        :param checkpoint: cursor of the checkpoint
+        """
+        checkpoint_dir = os.path.join(self.state_dir, checkpoint["directory"])
+        for name, shape in self.shapes.items():
+            if os.path.exists(self._path(checkpoint_dir, name)):
+                shutil.copyfile(
+                    self._path(checkpoint_dir, name), self._path(self.live_dir, name)
+                )
+            else:
+                # Array added after the checkpoint was written: never updated
+                array = np.lib.format.open_memmap(
+                    self._path(self.live_dir, name),
+                    mode="w+",
+                    dtype=np.float64,
+                    shape=shape,
+                )
+                array[:] = np.nan
+                array.flush()
+                del array
+        self._open("r+")
+
+    def latest_checkpoint(self):
+        """
+        :return: cursor of the latest consistent checkpoint, None if there is none
+        """
+        if self.state_dir is None:
+            return None
+        filename = os.path.join(self.state_dir, "checkpoint.json")
+        if not os.path.exists(filename):
+            return None
+        with open(filename, "r") as f:
+            return json.load(f)
+
+    def anchor_rotation(self, rot0):
+        """
+        The map is centered around the first pose of the first recording.
+        Later recordings extending the map reuse that rotation.
+        :param rot0: first rotation of the current recording
+        :return: rotation the map is centered around
+        """
+        if self.cursor["rot0"] is None:
+            self.cursor["rot0"] = np.asarray(rot0).tolist()
+        return np.array(self.cursor["rot0"])
+
+    def flush(self):
+        if self.live_dir is None:
+            return
+        for array in self.arrays.values():
+            array.flush()
+
+    def checkpoint(self, iEv, iBatch):
+        """
+        Writes a consistent checkpoint of the live arrays and the event cursor
+        :param iEv: number of events of the recording that are fully processed
+        :param iBatch: batch counter
+        """
+        self.flush()
+        previous = self.latest_checkpoint()
+
+        self.cursor["iEv"] = int(iEv)
+        self.cursor["iBatch"] = int(iBatch)
+        if self.state_dir is None:
+            return
+        self.cursor["checkpoint"] += 1
+        self.cursor["directory"] = "checkpoint_{}".format(self.cursor["checkpoint"])
+
+        checkpoint_dir = os.path.join(self.state_dir, self.cursor["directory"])
+        if os.path.exists(checkpoint_dir):
+            shutil.rmtree(checkpoint_dir)
+        os.makedirs(checkpoint_dir)
+        for name in self.shapes.keys():
+            shutil.copyfile(
+                self._path(self.live_dir, name), self._path(checkpoint_dir, name)
+            )
+
+        # Atomically switch to the new checkpoint, then remove the old one
+        filename = os.path.join(self.state_dir, "checkpoint.json")
+        with open(filename + ".tmp", "w") as f:
+            json.dump(self.cursor, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filename + ".tmp", filename)
+
+        if previous is not None and previous["directory"] != self.cursor["directory"]:
+            shutil.rmtree(
+                os.path.join(self.state_dir, previous["directory"]), ignore_errors=True
+            )
@@ -0,0 +1,93 @@
+import numpy as np
+
+import sample.helpers.projections as projections
+from sample.mosaicing.map_state import update_event_map
+
+
+def batch_measurements(
+    t,
+    x,
+    y,
+    pol,
+    Rot,
+    rot0,
+    event_map_sae,
+    event_map_rotation,
+    bearings,
+    output_width,
+    output_height,
+    t_first_pose,
+    convergence=None,
+    projection=None,
+):
+    """
+    Gets the two map points corresponding to each event of a batch, updates the event map
+    (time and rotation of last event) and computes the inputs of the EKF update.
+    Same steps as the loop of the mosaicing scripts, on plain arrays.
+    :param t: timestamps of the events
+    :param x: x coordinates of the events (integer array)
+    :param y: y coordinates of the events (integer array)
+    :param pol: polarities of the events (0, 1)
+    :param Rot: (interpolated) rotation of the batch
+    :param rot0: rotation the map is centered around
+    :param event_map_sae: time of last event per pixel
+    :param event_map_rotation: rotation of last event per pixel
+    :param bearings: bearing per DVS pixel, indexed as [y, x] (see
+                     datasets.bearing_table)
+    :param output_width: width of the panorama
+    :param output_height: height of the panorama
+    :param t_first_pose: time of the first pose
+    :param convergence: optional ConvergenceMask, events on frozen map pixels are culled
+    :param projection: map projection (see helpers.projections), None: equirectangular
+    :return: None in the initialization phase, otherwise dictionary with
+             'pm' (2xN), 'ir', 'ic', 'vel' (2xN), 'tc', 'event_rate', 'pol' (-1, 1)
+    """
+    if projection is None:
+        projection = projections.EquirectangularProjection(output_width, output_height)
+
+    # Get map point corresponding to current event
+    bearing_vec = bearings[y, x].T  # 3xN
+    rotated_vec = rot0.T.dot(Rot).dot(bearing_vec)
+    pm = projection.project(rotated_vec)
+
+    # Get time and rotation of previous event at same pixel, update the event map
+    t_prev, Rot_prev = update_event_map(event_map_sae, event_map_rotation, x, y, t, Rot)
+    if (t_prev[-1] < 0) or (t_prev[-1] < t_first_pose):
+        # initialization phase. Fill in event_map
+        return None
+
+    # Cull events whose current map point lies on a converged (frozen) map pixel
+    if convergence is not None:
+        mask_keep = convergence.cull(pm)
+        t = t[mask_keep]
+        t_prev = t_prev[mask_keep]
+        pol = pol[mask_keep]
+        pm = pm[:, mask_keep]
+        bearing_vec = bearing_vec[:, mask_keep]
+        Rot_prev = Rot_prev[mask_keep]
+
+    # Get map point corresponding to previous event at same pixel
+    rotated_vec_prev = np.einsum("ij,njk,kn->in", rot0.T, Rot_prev, bearing_vec)
+    pm_prev = projection.project(rotated_vec_prev)
+
+    # Discard uninitialized events, and pairs of map points that are not neighbours
+    # in the map (e.g. on two faces of a cube map)
+    mask = ~(np.isnan(pm_prev[0, :]) | np.isnan(pm_prev[1, :]))
+    mask[mask] = projection.compatible(pm[:, mask], pm_prev[:, mask])
+    pm = pm[:, mask]
+    pm_prev = pm_prev[:, mask]
+
+    # Get time since previous event at same pixel, and velocity
+    tc = t[mask] - t_prev[mask]
+    event_rate = 1.0 / (tc + 1e-12)
+    vel = (pm - pm_prev) * event_rate
+
+    return {
+        "pm": pm,
+        "ir": np.floor(pm[1, :]).astype(int),
+        "ic": np.floor(pm[0, :]).astype(int),
+        "vel": vel,
+        "tc": tc,
+        "event_rate": event_rate,
+        "pol": 2 * (pol[mask] - 0.5),
+    }
@@ -0,0 +1,322 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from sample.mosaicing.map_state import GRAD_KEYS, COVAR_KEYS, UNSET_TIME
+from sample.mosaicing.ekf import (
+    ekf_update,
+    information_update,
+    fuse_information,
+    INFO_KEYS,
+)
+from sample.mosaicing.measurements import batch_measurements
+import sample.helpers.coordinate_transforms as coordinate_transforms
+
+# Map arrays attached in each worker process
+_worker_maps = {}
+
+
+def pool_context():
+    """
+    Fork where available: the mosaicing scripts do their work at import time,
+    and forked workers inherit the loaded data
+    :return: multiprocessing context
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def _attach_maps(names, shape):
+    """
+    Pool initializer: attaches the shared map arrays in a worker process
+    :param names: dictionary with map keys and shared memory names
+    :param shape: shape of the maps
+    """
+    for key, name in names.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _worker_maps[key] = (shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+
+
+def _update_shard(args):
+    """
+    Runs the EKF update for the map points of a group of tiles, in a worker process
+    :param args: tuple (ir, ic, vel, tc, event_rate, pol, ekf_parameters)
+    :return: number of updated map points
+    """
+    ir, ic, vel, tc, event_rate, pol, ekf_parameters = args
+    grad_map = {key: _worker_maps[key][1] for key in GRAD_KEYS}
+    grad_map_covar = {key: _worker_maps[key][1] for key in COVAR_KEYS}
+    ekf_update(
+        grad_map, grad_map_covar, ir, ic, vel, tc, event_rate, pol, **ekf_parameters
+    )
+    return len(ir)
+
+
+class ShardedEKF:
+    """
+    Parallel EKF update of the gradient map. The workers keep a copy of the maps in
+    multiprocessing.shared_memory. The panorama is divided into tiles, and the
+    map points of each batch are partitioned by tile and dispatched to a pool
+    of worker processes. Tiles are disjoint, so workers never write the same pixel,
+    and the events of one tile keep their order, which gives the same result as the
+    serial update. Afterwards only the updated pixels are copied to the maps of the
+    mosaicer, so both copies stay in sync at O(events) cost.
+    """
+
+    def __init__(self, grad_map, grad_map_covar, num_workers, num_tiles=(4, 8)):
+        """
+        :param grad_map: dictionary with the gradient maps, copied to shared memory
+        :param grad_map_covar: dictionary with the covariance maps, copied to shared memory
+                               (the maps the mosaicer will pass to update)
+        :param num_workers: number of worker processes
+        :param num_tiles: number of tiles along rows and columns of the panorama
+        """
+        self.shape = grad_map["x"].shape
+        self.num_workers = num_workers
+        self.tile_height = -(-self.shape[0] // num_tiles[0])
+        self.tile_width = -(-self.shape[1] // num_tiles[1])
+        self.num_tiles = num_tiles
+
+        maps = dict(grad_map, **grad_map_covar)
+        self.shm = {}
+        self.maps = {}
+        for key, array in maps.items():
+            shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+            self.shm[key] = shm
+            self.maps[key] = np.ndarray(self.shape, dtype=np.float64, buffer=shm.buf)
+            self.maps[key][:] = array
+
+        self.pool = pool_context().Pool(
+            num_workers,
+            initializer=_attach_maps,
+            initargs=({key: shm.name for key, shm in self.shm.items()}, self.shape),
+        )
+
+    def update(
+        self,
+        grad_map,
+        grad_map_covar,
+        ir,
+        ic,
+        vel,
+        tc,
+        event_rate,
+        pol,
+        **ekf_parameters
+    ):
+        """
+        Same as ekf.ekf_update, run in parallel over the tiles of the panorama
+        :param grad_map: dictionary with the gradient maps of the mosaicer
+        :param grad_map_covar: dictionary with the covariance maps of the mosaicer
+        :param ir: row indices of the current map points
+        :param ic: column indices of the current map points
+        :param vel: velocity of the map points, 2xN
+        :param tc: time since previous event at same pixel
+        :param event_rate: 1 / tc
+        :param pol: polarities of the events
+        :param ekf_parameters: measurement_criterion, contrast_threshold, var_R
+        :return: void
+        """
+        if len(ir) == 0:
+            return
+        tile = (ir // self.tile_height) * self.num_tiles[1] + ic // self.tile_width
+        order = np.argsort(tile, kind="stable")
+
+        # Cut the events sorted by tile into one shard per worker, at tile boundaries
+        tile_sorted = tile[order]
+        targets = np.arange(1, self.num_workers) * len(order) / self.num_workers
+        cuts = np.searchsorted(tile_sorted, tile_sorted[targets.astype(int)])
+        bounds = np.unique(np.concatenate(([0], cuts, [len(order)])))
+
+        tasks = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            idx = order[start:stop]
+            tasks.append(
+                (
+                    ir[idx],
+                    ic[idx],
+                    vel[:, idx],
+                    tc[idx],
+                    event_rate[idx],
+                    pol[idx],
+                    ekf_parameters,
+                )
+            )
+        self.pool.map(_update_shard, tasks)
+
+        # Copy the updated pixels to the maps of the mosaicer
+        for key in GRAD_KEYS:
+            grad_map[key][ir, ic] = self.maps[key][ir, ic]
+        for key in COVAR_KEYS:
+            grad_map_covar[key][ir, ic] = self.maps[key][ir, ic]
+
+    def sync_pixels(self, grad_map_covar, ir, ic):
+        """
+        Copies pixels of the covariance maps changed by the mosaicer (e.g. aged by the
+        process noise) to the shared memory of the workers
+        :param grad_map_covar: dictionary with the covariance maps of the mosaicer
+        :param ir: row indices of the changed pixels
+        :param ic: column indices of the changed pixels
+        """
+        for key in COVAR_KEYS:
+            self.maps[key][ir, ic] = grad_map_covar[key][ir, ic]
+
+    def sync_maps(self, grad_map, grad_map_covar):
+        """
+        Copies the whole maps of the mosaicer (e.g. after fusing time chunks) to the
+        shared memory of the workers
+        :param grad_map: dictionary with the gradient maps of the mosaicer
+        :param grad_map_covar: dictionary with the covariance maps of the mosaicer
+        """
+        for key in GRAD_KEYS:
+            self.maps[key][:] = grad_map[key]
+        for key in COVAR_KEYS:
+            self.maps[key][:] = grad_map_covar[key]
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory
+        """
+        self.pool.close()
+        self.pool.join()
+        self.maps = {}
+        for shm in self.shm.values():
+            shm.close()
+            shm.unlink()
+
+
+def _mosaic_time_chunk(chunk):
+    """
+    Mosaics one time chunk of the event stream in information form, in a worker process.
+    The first num_warmup events only fill in the event map.
+    :param chunk: dictionary with the arguments, see mosaic_time_chunks
+    :return: flat indices of the pixels with information, dictionary with INFO_KEYS values
+    """
+    t = chunk["t"]
+    num_events_batch = chunk["num_events_batch"]
+    poses_t = chunk["poses_t"]
+    shape = (chunk["output_height"], chunk["output_width"])
+
+    sensor_shape = chunk["bearings"].shape[:2]
+    event_map_sae = np.full(sensor_shape, UNSET_TIME)
+    event_map_rotation = np.full(sensor_shape + (3, 3), np.nan)
+    info = {key: np.zeros(shape) for key in INFO_KEYS}
+
+    for start in range(0, len(t) - num_events_batch + 1, num_events_batch):
+        stop = start + num_events_batch
+        t_ev_mean = (t[start] + t[stop - 1]) * 0.5
+        if t_ev_mean > poses_t.iloc[-1]:
+            break  # event later than last known pose
+        Rot = coordinate_transforms.rotation_interpolation(
+            poses_t, chunk["rotmats_dict"], t_ev_mean
+        )
+        measurements = batch_measurements(
+            t[start:stop],
+            chunk["x"][start:stop],
+            chunk["y"][start:stop],
+            chunk["pol"][start:stop],
+            Rot,
+            chunk["rot0"],
+            event_map_sae,
+            event_map_rotation,
+            chunk["bearings"],
+            chunk["output_width"],
+            chunk["output_height"],
+            poses_t.iloc[0],
+            projection=chunk["projection"],
+        )
+        if measurements is None or start < chunk["num_warmup"]:
+            continue
+        information_update(
+            info,
+            measurements["ir"],
+            measurements["ic"],
+            measurements["vel"],
+            measurements["tc"],
+            measurements["event_rate"],
+            measurements["pol"],
+            **chunk["ekf_parameters"]
+        )
+
+    flat_idx = np.flatnonzero((info["xx"] != 0) | (info["yy"] != 0))
+    return flat_idx, {key: info[key].ravel()[flat_idx] for key in INFO_KEYS}
+
+
+def mosaic_time_chunks(
+    grad_map,
+    grad_map_covar,
+    t,
+    x,
+    y,
+    pol,
+    poses_t,
+    rotmats_dict,
+    rot0,
+    bearings,
+    num_events_batch,
+    ekf_parameters,
+    num_chunks,
+    num_warmup_events,
+    num_workers=None,
+    projection=None,
+):
+    """
+    Offline mosaicing of a whole recording, split into time chunks that are processed
+    in parallel, each in its own process. Every chunk replays num_warmup_events events
+    before it to initialize its event map, accumulates the EKF updates in information
+    form (inverse covariance and information vector) and the partial maps are fused
+    into the gradient and covariance maps afterwards.
+    :param grad_map: dictionary with the gradient maps (prior), updated in place
+    :param grad_map_covar: dictionary with the covariance maps (prior), updated in place
+    :param t: timestamps of the events
+    :param x: x coordinates of the events (integer array)
+    :param y: y coordinates of the events (integer array)
+    :param pol: polarities of the events (0, 1)
+    :param poses_t: timestamps of the poses (pandas Series)
+    :param rotmats_dict: rotation matrices of the poses
+    :param rot0: rotation the map is centered around
+    :param bearings: bearing per DVS pixel, indexed as [y, x]
+    :param num_events_batch: events per batch, chunks are aligned to batches
+    :param ekf_parameters: measurement_criterion, contrast_threshold, var_R
+    :param num_chunks: number of time chunks
+    :param num_warmup_events: events replayed before each chunk
+    :param num_workers: number of worker processes, one per chunk by default
+    :param projection: map projection (see helpers.projections), None: equirectangular
+    :return: number of events processed
+    """
+    output_height, output_width = grad_map["x"].shape
+    num_batches = len(t) // num_events_batch
+    bounds = np.linspace(0, num_batches, num_chunks + 1).astype(int) * num_events_batch
+    num_warmup = -(-num_warmup_events // num_events_batch) * num_events_batch
+
+    chunks = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        begin = max(0, start - num_warmup)
+        chunks.append(
+            {
+                "t": t[begin:stop],
+                "x": x[begin:stop],
+                "y": y[begin:stop],
+                "pol": pol[begin:stop],
+                "num_warmup": start - begin,
+                "poses_t": poses_t,
+                "rotmats_dict": rotmats_dict,
+                "rot0": rot0,
+                "bearings": bearings,
+                "output_height": output_height,
+                "output_width": output_width,
+                "num_events_batch": num_events_batch,
+                "ekf_parameters": ekf_parameters,
+                "projection": projection,
+            }
+        )
+
+    if num_workers is None:
+        num_workers = num_chunks
+    with pool_context().Pool(num_workers) as pool:
+        for flat_idx, info_values in pool.imap(_mosaic_time_chunk, chunks):
+            fuse_information(grad_map, grad_map_covar, flat_idx, info_values)
+
+    return int(bounds[-1])
@@ -0,0 +1,406 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+import sample.helpers.coordinate_transforms as coordinate_transforms
+import sample.helpers.integration_methods as integration_methods
+from sample.mosaicing.measurements import batch_measurements
+
+
+# Marks the end of the stream in the queues
+_END = None
+
+
+class StageTimer:
+    """
+    Measures how a pipeline stage spends its time: working, waiting for input
+    (starved) and waiting for space in the output queue (blocked)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.num_items = 0
+
+    def get(self, q):
+        start = time.time()
+        item = q.get()
+        self.starved += time.time() - start
+        return item
+
+    def put(self, q, item):
+        start = time.time()
+        q.put(item)
+        self.blocked += time.time() - start
+
+    def report(self, wall_time):
+        return "{:<12} items: {:>6}  busy: {:5.1f}%  starved: {:5.1f}%  blocked: {:5.1f}%".format(
+            self.name,
+            self.num_items,
+            100.0 * self.busy / wall_time,
+            100.0 * self.starved / wall_time,
+            100.0 * self.blocked / wall_time,
+        )
+
+
+class MosaicPipeline:
+    """
+    Runs the mosaicing loop as a pipeline of stages in separate threads:
+
+    ingest      : slices the next batch into a preallocated buffer, interpolates its rotation
+    projection  : projects the map points and updates the event map (batch_measurements)
+    ekf         : EKF update of the gradient map
+    integration : every integrate_every batches, integrates a snapshot of the gradient map
+
+    The stages are connected by bounded queues, so that ingest and projection of
+    batch k+1 overlap with the EKF of batch k and with the periodic integration.
+    Buffers for event batches and map snapshots are preallocated and recycled.
+    An exception in a stage stops the pipeline and is raised again by run.
+    """
+
+    def __init__(
+        self,
+        t,
+        x,
+        y,
+        pol,
+        poses_t,
+        rotmats_dict,
+        rot0,
+        bearings,
+        event_map_sae,
+        event_map_rotation,
+        grad_map,
+        grad_map_covar,
+        num_events_batch,
+        ekf_update,
+        ekf_parameters,
+        queue_size=4,
+        integrate_every=0,
+        sync_every=0,
+        on_batch=None,
+        noise_filter=None,
+        convergence=None,
+        projection=None,
+        coverage=None,
+        integration_padding=0,
+        integration_method="frankotchellappa_rfft",
+    ):
+        """
+        :param t: timestamps of the events
+        :param x: x coordinates of the events (integer array)
+        :param y: y coordinates of the events (integer array)
+        :param pol: polarities of the events (0, 1)
+        :param poses_t: timestamps of the poses (pandas Series)
+        :param rotmats_dict: rotation matrices of the poses
+        :param rot0: rotation the map is centered around
+        :param bearings: bearing per DVS pixel, indexed as [y, x]
+        :param event_map_sae: time of last event per pixel
+        :param event_map_rotation: rotation of last event per pixel
+        :param grad_map: dictionary with the gradient maps
+        :param grad_map_covar: dictionary with the covariance maps
+        :param num_events_batch: events per batch
+        :param ekf_update: EKF update function (ekf.ekf_update or ShardedEKF.update)
+        :param ekf_parameters: measurement_criterion, contrast_threshold, var_R
+        :param queue_size: capacity of the queues between the stages
+        :param integrate_every: batches between two integrations, 0 disables integration
+        :param sync_every: batches between two points where the pipeline is drained, so that
+                           map and event map are consistent (e.g. for checkpoints), 0: never
+        :param on_batch: called by the EKF stage after each batch with
+                         (iEv, ir, ic, synced), synced is True if the pipeline is drained
+        :param noise_filter: optional EventFilterChain, run in the projection stage
+        :param convergence: optional ConvergenceMask for culling, run in the projection stage
+        :param projection: map projection (see helpers.projections), None: equirectangular
+        :param coverage: optional CoverageBounds, maintained by on_batch; only its padded
+                         box is integrated
+        :param integration_padding: margin around the box of the coverage, in pixels
+        :param integration_method: gradient integration method (see integration_methods)
+        """
+        self.t = t
+        self.x = x
+        self.y = y
+        self.pol = pol
+        self.poses_t = poses_t
+        self.rotmats_dict = rotmats_dict
+        self.rot0 = rot0
+        self.bearings = bearings
+        self.event_map_sae = event_map_sae
+        self.event_map_rotation = event_map_rotation
+        self.grad_map = grad_map
+        self.grad_map_covar = grad_map_covar
+        self.num_events_batch = num_events_batch
+        self.ekf_update = ekf_update
+        self.ekf_parameters = ekf_parameters
+        self.integrate_every = integrate_every
+        self.sync_every = sync_every
+        self.on_batch = on_batch
+        self.noise_filter = noise_filter
+        self.convergence = convergence
+        self.projection = projection
+        self.coverage = coverage
+        self.integration_padding = integration_padding
+        self.integration_method = integration_method
+
+        self.queues = {
+            "projection": queue.Queue(queue_size),
+            "ekf": queue.Queue(queue_size),
+            "integration": queue.Queue(1),
+        }
+        self.free_batches = queue.Queue()
+        for i in range(queue_size + 2):
+            self.free_batches.put(
+                {
+                    "t": np.zeros(num_events_batch),
+                    "x": np.zeros(num_events_batch, dtype=int),
+                    "y": np.zeros(num_events_batch, dtype=int),
+                    "pol": np.zeros(num_events_batch),
+                }
+            )
+        shape = grad_map["x"].shape
+        self.free_snapshots = queue.Queue()
+        for i in range(2):
+            self.free_snapshots.put(
+                {key: np.zeros(shape) for key in ["x", "y", "trace"]}
+            )
+
+        self.timers = {
+            name: StageTimer(name)
+            for name in ["ingest", "projection", "ekf", "integration"]
+        }
+        self.drained = threading.Event()
+        self.drained.set()
+        self.failed = threading.Event()
+        self.errors = []
+        self.latest_reconstruction = None
+        self.num_events_processed = 0
+        self.wall_time = 0.0
+
+    def _ingest(self, start):
+        timer = self.timers["ingest"]
+        iEv = start
+        num_batch = 0
+        while iEv + self.num_events_batch <= len(self.t):
+            if self.failed.is_set():
+                break
+            buffer = timer.get(self.free_batches)
+            work_start = time.time()
+            stop = iEv + self.num_events_batch
+            t_ev_mean = (self.t[iEv] + self.t[stop - 1]) * 0.5
+            if t_ev_mean > self.poses_t.iloc[-1]:
+                print("Event later than last known pose")
+                break
+            buffer["t"][:] = self.t[iEv:stop]
+            buffer["x"][:] = self.x[iEv:stop]
+            buffer["y"][:] = self.y[iEv:stop]
+            buffer["pol"][:] = self.pol[iEv:stop]
+            Rot = coordinate_transforms.rotation_interpolation(
+                self.poses_t, self.rotmats_dict, t_ev_mean
+            )
+            iEv = stop
+            num_batch += 1
+            synced = self.sync_every > 0 and num_batch % self.sync_every == 0
+            timer.busy += time.time() - work_start
+            timer.num_items += 1
+
+            if synced:
+                # Next batches wait until the EKF stage has processed this one
+                self.drained.clear()
+            timer.put(self.queues["projection"], (buffer, Rot, iEv, synced))
+            if synced:
+                wait_start = time.time()
+                self.drained.wait()
+                timer.blocked += time.time() - wait_start
+        timer.put(self.queues["projection"], _END)
+
+    def _projection(self):
+        timer = self.timers["projection"]
+        while True:
+            item = timer.get(self.queues["projection"])
+            if item is _END:
+                break
+            buffer, Rot, iEv, synced = item
+            work_start = time.time()
+            t, x, y, pol = buffer["t"], buffer["x"], buffer["y"], buffer["pol"]
+            if self.noise_filter is not None:
+                mask_keep = self.noise_filter.apply(t, x, y, pol)
+                t, x, y, pol = t[mask_keep], x[mask_keep], y[mask_keep], pol[mask_keep]
+            measurements = None
+            if len(t) > 0:
+                measurements = batch_measurements(
+                    t,
+                    x,
+                    y,
+                    pol,
+                    Rot,
+                    self.rot0,
+                    self.event_map_sae,
+                    self.event_map_rotation,
+                    self.bearings,
+                    self.grad_map["x"].shape[1],
+                    self.grad_map["x"].shape[0],
+                    self.poses_t.iloc[0],
+                    convergence=self.convergence,
+                    projection=self.projection,
+                )
+            self.free_batches.put(buffer)
+            timer.busy += time.time() - work_start
+            timer.num_items += 1
+            timer.put(self.queues["ekf"], (measurements, iEv, synced))
+        timer.put(self.queues["ekf"], _END)
+
+    def _ekf(self):
+        timer = self.timers["ekf"]
+        num_batch = 0
+        while True:
+            item = timer.get(self.queues["ekf"])
+            if item is _END:
+                break
+            measurements, iEv, synced = item
+            work_start = time.time()
+            ir = ic = np.zeros(0, dtype=int)
+            if measurements is not None:
+                ir = measurements["ir"]
+                ic = measurements["ic"]
+                self.ekf_update(
+                    self.grad_map,
+                    self.grad_map_covar,
+                    ir,
+                    ic,
+                    measurements["vel"],
+                    measurements["tc"],
+                    measurements["event_rate"],
+                    measurements["pol"],
+                    **self.ekf_parameters
+                )
+            self.num_events_processed = iEv
+            num_batch += 1
+
+            if self.integrate_every > 0 and num_batch % self.integrate_every == 0:
+                # Snapshot of the map, integrated while the EKF continues
+                snapshot = self.free_snapshots.get()
+                snapshot["x"][:] = self.grad_map["x"]
+                snapshot["y"][:] = self.grad_map["y"]
+                np.add(
+                    self.grad_map_covar["xx"],
+                    self.grad_map_covar["yy"],
+                    out=snapshot["trace"],
+                )
+                timer.put(self.queues["integration"], snapshot)
+
+            if self.on_batch is not None:
+                self.on_batch(iEv, ir, ic, synced)
+            timer.busy += time.time() - work_start
+            timer.num_items += 1
+            if synced:
+                self.drained.set()
+        self.drained.set()
+        timer.put(self.queues["integration"], _END)
+
+    def _integration(self):
+        timer = self.timers["integration"]
+        while True:
+            snapshot = timer.get(self.queues["integration"])
+            if snapshot is _END:
+                break
+            work_start = time.time()
+            mask = (
+                snapshot["trace"] > 0.05
+            )  # reconstruct only gradients with small covariance
+            snapshot["x"][mask] = 0
+            snapshot["y"][mask] = 0
+            regions = None
+            if self.projection is not None:
+                regions = self.projection.regions(snapshot["x"].shape)
+            crop = None
+            if self.coverage is not None:
+                crop = self.coverage.crop(padding=self.integration_padding)
+            self.latest_reconstruction = integration_methods.integrate_map(
+                snapshot["x"],
+                snapshot["y"],
+                method=self.integration_method,
+                regions=regions,
+                crop=crop,
+            )
+            self.free_snapshots.put(snapshot)
+            timer.busy += time.time() - work_start
+            timer.num_items += 1
+
+    def _guarded(self, stage, args=(), inbox=None, outbox=None, recycle=None):
+        """
+        Runs a stage. If it raises, the exception is kept for run and the pipeline is
+        stopped: the end of the stream is sent downstream, and the input of the stage is
+        drained, its buffers recycled, so that the upstream stages are not blocked
+        :param stage: loop of the stage
+        :param args: arguments of the stage
+        :param inbox: name of the input queue, None: first stage
+        :param outbox: name of the output queue, None: last stage
+        :param recycle: called with each drained item, to return its buffer
+        """
+        try:
+            stage(*args)
+        except Exception as error:
+            self.errors.append(error)
+            self.failed.set()
+            self.drained.set()
+            if outbox is not None:
+                self.queues[outbox].put(_END)
+            if inbox is not None:
+                while True:
+                    item = self.queues[inbox].get()
+                    if item is _END:
+                        break
+                    if recycle is not None:
+                        recycle(item)
+
+    def run(self, start=0):
+        """
+        Processes all events from start on
+        :param start: index of the first event
+        :return: index of the first event not processed
+        """
+        self.num_events_processed = start
+        start_time = time.time()
+        threads = [
+            threading.Thread(
+                target=self._guarded,
+                args=(self._ingest, (start,)),
+                kwargs={"outbox": "projection"},
+            ),
+            threading.Thread(
+                target=self._guarded,
+                args=(self._projection,),
+                kwargs={
+                    "inbox": "projection",
+                    "outbox": "ekf",
+                    "recycle": lambda item: self.free_batches.put(item[0]),
+                },
+            ),
+            threading.Thread(
+                target=self._guarded,
+                args=(self._integration,),
+                kwargs={"inbox": "integration", "recycle": self.free_snapshots.put},
+            ),
+        ]
+        for thread in threads:
+            thread.start()
+        self._guarded(self._ekf, inbox="ekf", outbox="integration")
+        for thread in threads:
+            thread.join()
+        self.wall_time = time.time() - start_time
+        if self.errors:
+            raise self.errors[0]
+        return self.num_events_processed
+
+    def report(self):
+        """
+        :return: string with the occupancy of each stage, the busiest stage is the bottleneck
+        """
+        wall_time = max(self.wall_time, 1e-12)
+        lines = [timer.report(wall_time) for timer in self.timers.values()]
+        bottleneck = max(self.timers.values(), key=lambda timer: timer.busy)
+        lines.append("Bottleneck stage: {}".format(bottleneck.name))
+        return "\n".join(lines)
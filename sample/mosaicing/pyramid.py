@@ -0,0 +1,136 @@
+import numpy as np
+
+from sample.mosaicing.map_state import GRAD_KEYS, COVAR_KEYS
+
+
+class MosaicPyramid:
+    """
+    Multi-resolution pyramid of the gradient and covariance maps.
+
+    Level 0 are the maps of the mosaicer themselves, level k has 2^k times fewer rows
+    and columns. Coarse levels are refreshed lazily: the mosaicer marks the map points
+    it updated, and reading a level only recomputes the tiles touched since that level
+    was last read.
+
+    Each coarse pixel holds the 2x2 mean of the finer level. Gradients are scaled by 2,
+    so that they stay gradients per pixel of their own level (and can be integrated
+    directly), and the averaged covariance is then exactly the covariance of the
+    scaled gradient if the fine pixels are independent.
+
+    Maps of any size are supported: level k has ceil(height / 2^k) rows (and columns),
+    the tiles at the bottom and right borders may be partial, and a missing last row
+    or column of the finer level is padded by repeating the border pixels.
+    """
+
+    def __init__(self, grad_map, grad_map_covar, num_levels=4, tile_size=64):
+        """
+        :param grad_map: dictionary with the gradient maps 'x', 'y' (level 0)
+        :param grad_map_covar: dictionary with the covariance maps 'xx', 'xy', 'yx', 'yy' (level 0)
+        :param num_levels: number of levels, including level 0
+        :param tile_size: side of a tile in level 0 pixels, multiple of 2^(num_levels-1)
+        """
+        height, width = grad_map["x"].shape
+        assert tile_size % 2 ** (num_levels - 1) == 0, "Tiles too small for levels"
+
+        self.num_levels = num_levels
+        self.tile_size = tile_size
+        self.num_tiles = (-(-height // tile_size), -(-width // tile_size))
+
+        self.levels = [dict(grad_map, **grad_map_covar)]
+        for k in range(1, num_levels):
+            shape = (-(-height // 2 ** k), -(-width // 2 ** k))
+            self.levels.append({key: np.zeros(shape) for key in self.levels[0]})
+
+        # Per coarse level, tiles (in level 0 tile coordinates) that are out of date
+        self.dirty = [None] + [
+            np.ones(self.num_tiles, dtype=bool) for k in range(1, num_levels)
+        ]
+
+        # Counters: tiles refreshed and tiles skipped because they were clean
+        self.num_tiles_refreshed = 0
+        self.num_tiles_skipped = 0
+
+    def mark_dirty(self, ir, ic):
+        """
+        Marks the tiles containing the given map points as changed
+        :param ir: row indices of the updated map points
+        :param ic: column indices of the updated map points
+        """
+        tiles = np.zeros(self.num_tiles, dtype=bool)
+        tiles[np.asarray(ir) // self.tile_size, np.asarray(ic) // self.tile_size] = True
+        for k in range(1, self.num_levels):
+            self.dirty[k] |= tiles
+
+    def mark_all_dirty(self):
+        """
+        Marks the whole map as changed, e.g. after the maps were modified externally
+        """
+        for k in range(1, self.num_levels):
+            self.dirty[k][:] = True
+
+    def _refresh_tile(self, k, ti, tj):
+        """
+        Recomputes one tile of level k from level k-1
+        :param k: level
+        :param ti: tile row
+        :param tj: tile column
+        """
+        side = self.tile_size // 2 ** k
+        fine = self.levels[k - 1]
+        coarse = self.levels[k]
+        height, width = coarse["x"].shape
+        r0 = ti * side
+        c0 = tj * side
+        r1 = min(r0 + side, height)  # partial tiles at the borders
+        c1 = min(c0 + side, width)
+        for key in fine:
+            block = fine[key][2 * r0 : 2 * r1, 2 * c0 : 2 * c1]
+            block = np.pad(
+                block,
+                (
+                    (0, 2 * (r1 - r0) - block.shape[0]),
+                    (0, 2 * (c1 - c0) - block.shape[1]),
+                ),
+                mode="edge",
+            )
+            mean = block.reshape(r1 - r0, 2, c1 - c0, 2).mean(axis=(1, 3))
+            if key in GRAD_KEYS:
+                mean *= 2.0
+            coarse[key][r0:r1, c0:c1] = mean
+
+    def _refresh(self, k, tiles):
+        """
+        Brings the given tiles of level k up to date, refreshing finer levels first
+        :param k: level
+        :param tiles: boolean mask of the tiles that are needed
+        """
+        if k == 0:
+            return
+        stale = self.dirty[k] & tiles
+        self._refresh(k - 1, stale)
+        for ti, tj in zip(*np.nonzero(stale)):
+            self._refresh_tile(k, ti, tj)
+        self.num_tiles_refreshed += int(stale.sum())
+        self.num_tiles_skipped += int(tiles.sum() - stale.sum())
+        self.dirty[k] &= ~stale
+
+    def level(self, k):
+        """
+        Gets the gradient and covariance maps of a level, up to date
+        :param k: level, 0 is full resolution
+        :return: grad_map, grad_map_covar (dictionaries like the ones of the mosaicer)
+        """
+        self._refresh(k, np.ones(self.num_tiles, dtype=bool))
+        maps = self.levels[k]
+        return (
+            {key: maps[key] for key in GRAD_KEYS},
+            {key: maps[key] for key in COVAR_KEYS},
+        )
+
+    def trace(self, k):
+        """
+        :param k: level
+        :return: trace of the covariance at level k, up to date
+        """
+        _, covar = self.level(k)
+        return covar["xx"] + covar["yy"]
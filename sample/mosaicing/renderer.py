@@ -0,0 +1,220 @@
+import os
+import queue
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import sample.helpers.integration_methods as integration_methods
+from sample.mosaicing.parallel import pool_context
+
+
+def _subsample(points, max_points):
+    """
+    :param points: 2xN array
+    :param max_points: maximum number of points kept
+    :return: every k-th point, at most max_points
+    """
+    step = max(1, -(-points.shape[1] // max_points))
+    return points[:, ::step]
+
+
+def _render_frames(
+    frames, animation_dir, sensor_size, output_size, panels, projection=None
+):
+    """
+    Renderer process: draws the frames received through the queue and writes them to disk,
+    until None is received
+    :param frames: multiprocessing queue with the frames (dictionaries, see submit)
+    :param animation_dir: directory of the frame sequences
+    :param sensor_size: (width, height) of the DVS sensor
+    :param output_size: (width, height) of the panorama
+    :param panels: names of the frame sequences to write
+    :param projection: map projection, whose regions are integrated independently
+    """
+    for panel in panels:
+        if not os.path.exists(os.path.join(animation_dir, panel)):
+            os.makedirs(os.path.join(animation_dir, panel))
+
+    figures = {}
+    for panel in panels:
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        figures[panel] = (figure, figure.add_subplot(111))
+
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
+        filename = "fig_events_{}.png".format(str(frame["iEv"]).zfill(10))
+
+        if "events_raw" in figures:
+            figure, ax = figures["events_raw"]
+            ax.clear()
+            ax.plot(frame["events_pos"][0], frame["events_pos"][1], ",b")
+            ax.plot(frame["events_neg"][0], frame["events_neg"][1], ",r")
+            ax.set_xlim([0, sensor_size[0]])
+            ax.set_ylim([0, sensor_size[1]])
+            ax.set_title("Events on Sensor")
+            figure.savefig(os.path.join(animation_dir, "events_raw", filename))
+
+        if "events_pm" in figures:
+            figure, ax = figures["events_pm"]
+            ax.clear()
+            ax.plot(frame["pm_pos"][0], frame["pm_pos"][1], ",b")
+            ax.plot(frame["pm_neg"][0], frame["pm_neg"][1], ",r")
+            ax.set_xlim([0, output_size[0]])
+            ax.set_ylim([0, output_size[1]])
+            ax.set_title("Map points from events")
+            figure.savefig(os.path.join(animation_dir, "events_pm", filename))
+
+        if "reconstruction" in figures:
+            # Reconstruct only gradients with small covariance
+            mask = frame["trace"] > 0.05
+            frame["grad_x"][mask] = 0
+            frame["grad_y"][mask] = 0
+            regions = None
+            if projection is not None:
+                regions = projection.regions(frame["grad_x"].shape)
+            rec_image = integration_methods.integrate_map(
+                frame["grad_x"], frame["grad_y"], regions=regions, crop=frame["crop"]
+            )
+            maximum = max(np.max(np.abs(rec_image)), 1e-12)
+            figure, ax = figures["reconstruction"]
+            ax.clear()
+            ax.imshow(rec_image / maximum, cmap="binary", vmin=-1, vmax=1)
+            ax.set_title("Reconstructed image (log)")
+            figure.savefig(os.path.join(animation_dir, "reconstruction", filename))
+
+
+class BackgroundRenderer:
+    """
+    Produces the animation frames of the mosaicer in a separate process.
+    The mosaicer submits decimated snapshots (events, map points and a coarse level
+    of the gradient map) through a bounded queue. If the renderer falls behind,
+    frames are dropped instead of stalling the EKF loop.
+    """
+
+    def __init__(
+        self,
+        animation_dir,
+        sensor_width,
+        sensor_height,
+        output_width,
+        output_height,
+        plot_events=True,
+        plot_events_pm=True,
+        plot_reconstruction=True,
+        max_points=20000,
+        queue_size=2,
+        projection=None,
+    ):
+        """
+        Starts the renderer process
+        :param animation_dir: directory of the frame sequences (events_raw, events_pm, reconstruction)
+        :param sensor_width: width of the DVS sensor
+        :param sensor_height: height of the DVS sensor
+        :param output_width: width of the panorama
+        :param output_height: height of the panorama
+        :param plot_events: write the events on the sensor
+        :param plot_events_pm: write the map points of the events
+        :param plot_reconstruction: integrate the gradient map and write the reconstruction
+        :param max_points: maximum number of events and map points per frame
+        :param queue_size: number of frames waiting to be rendered before frames are dropped
+        :param projection: map projection (see helpers.projections), None: equirectangular
+        """
+        panels = []
+        if plot_events:
+            panels.append("events_raw")
+        if plot_events_pm:
+            panels.append("events_pm")
+        if plot_reconstruction:
+            panels.append("reconstruction")
+        self.panels = panels
+        self.max_points = max_points
+        self.num_frames_submitted = 0
+        self.num_frames_dropped = 0
+
+        context = pool_context()
+        self.frames = context.Queue(queue_size)
+        self.process = context.Process(
+            target=_render_frames,
+            args=(
+                self.frames,
+                animation_dir,
+                (sensor_width, sensor_height),
+                (output_width, output_height),
+                panels,
+                projection,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+
+    def submit(
+        self,
+        iEv,
+        x,
+        y,
+        pol,
+        pm,
+        pol_pm,
+        grad_map=None,
+        grad_map_covar=None,
+        crop=None,
+    ):
+        """
+        Hands a snapshot of the current batch and map to the renderer, never blocks
+        :param iEv: event counter, used to name the frame
+        :param x: x coordinates of the events of the batch
+        :param y: y coordinates of the events of the batch
+        :param pol: polarities of the events (> 0: positive)
+        :param pm: map points of the events, 2xN, None if unknown
+        :param pol_pm: polarities of the map points (> 0: positive)
+        :param grad_map: dictionary with the (coarse) gradient maps, copied
+        :param grad_map_covar: dictionary with the (coarse) covariance maps
+        :param crop: part of the (coarse) map that is integrated, None: the whole map
+        :return: True if the frame was queued, False if it was dropped
+        """
+        if self.frames.full():
+            self.num_frames_dropped += 1
+            return False
+
+        pos = np.asarray(pol) > 0
+        events = np.vstack((x, y))
+        frame = {
+            "iEv": iEv,
+            "events_pos": _subsample(events[:, pos], self.max_points),
+            "events_neg": _subsample(events[:, ~pos], self.max_points),
+        }
+        if pm is None:
+            pm = np.zeros((2, 0))
+            pol_pm = np.zeros(0)
+        pos = np.asarray(pol_pm) > 0
+        frame["pm_pos"] = _subsample(pm[:, pos], self.max_points)
+        frame["pm_neg"] = _subsample(pm[:, ~pos], self.max_points)
+        if "reconstruction" in self.panels:
+            frame["grad_x"] = np.array(grad_map["x"])
+            frame["grad_y"] = np.array(grad_map["y"])
+            frame["trace"] = grad_map_covar["xx"] + grad_map_covar["yy"]
+            frame["crop"] = crop
+
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            self.num_frames_dropped += 1
+            return False
+        self.num_frames_submitted += 1
+        return True
+
+    def close(self):
+        """
+        Waits until the queued frames are written and stops the renderer process
+        """
+        self.frames.put(None)
+        self.process.join()
+
+    def report(self):
+        return "Animation frames: {} rendered, {} dropped".format(
+            self.num_frames_submitted, self.num_frames_dropped
+        )
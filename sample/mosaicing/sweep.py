@@ -0,0 +1,100 @@
+import numpy as np
+
+import sample.helpers.integration_methods as integration_methods
+import sample.mosaicing.ekf as ekf
+from sample.mosaicing.map_state import GRAD_KEYS
+
+
+class ConfigurationSweep:
+    """
+    Independent gradient and covariance maps for a list of EKF configurations,
+    updated in the same pass over the events. The projection of the events, the
+    event map and tc / event rate do not depend on the EKF configuration, so they are
+    computed once per batch by the mosaicer and handed to all configurations.
+    """
+
+    def __init__(self, configurations, output_height, output_width, contrast_threshold):
+        """
+        :param configurations: list of dictionaries with 'measurement_criterion', 'var_R',
+                               'grad_initial_variance' and optionally a 'name'
+        :param output_height: height of the panorama
+        :param output_width: width of the panorama
+        :param contrast_threshold: contrast threshold of the sensor
+        """
+        self.configurations = []
+        self.grad_maps = []
+        self.grad_map_covars = []
+        for configuration in configurations:
+            configuration = dict(configuration)
+            configuration.setdefault(
+                "name",
+                "{}_varR{:g}_var0{:g}".format(
+                    configuration["measurement_criterion"],
+                    configuration["var_R"],
+                    configuration["grad_initial_variance"],
+                ),
+            )
+            self.configurations.append(configuration)
+
+            shape = (output_height, output_width)
+            self.grad_maps.append({key: np.zeros(shape) for key in GRAD_KEYS})
+            variance = configuration["grad_initial_variance"]
+            self.grad_map_covars.append(
+                {
+                    "xx": np.full(shape, float(variance)),
+                    "xy": np.zeros(shape),
+                    "yx": np.zeros(shape),
+                    "yy": np.full(shape, float(variance)),
+                }
+            )
+        self.contrast_threshold = contrast_threshold
+
+    def names(self):
+        return [configuration["name"] for configuration in self.configurations]
+
+    def update(self, measurements):
+        """
+        EKF update of the maps of all configurations with the measurements of a batch
+        :param measurements: measurements of the batch (see batch_measurements)
+        """
+        for configuration, grad_map, grad_map_covar in zip(
+            self.configurations, self.grad_maps, self.grad_map_covars
+        ):
+            ekf.ekf_update(
+                grad_map,
+                grad_map_covar,
+                measurements["ir"],
+                measurements["ic"],
+                measurements["vel"],
+                measurements["tc"],
+                measurements["event_rate"],
+                measurements["pol"],
+                configuration["measurement_criterion"],
+                self.contrast_threshold,
+                configuration["var_R"],
+            )
+
+    def integrate(
+        self,
+        k,
+        integration_method="frankotchellappa_rfft",
+        threshold=0.05,
+        regions=None,
+        crop=None,
+    ):
+        """
+        Reconstructs the (log) intensity image of one configuration
+        :param k: index of the configuration
+        :param integration_method: function of integration_methods
+        :param threshold: only gradients whose covariance trace is below are integrated
+        :param regions: parts of the map integrated independently, None: the whole map
+        :param crop: part of the map with observations, None: the whole map
+        :return: reconstructed image with zero mean
+        """
+        grad_map_covar = self.grad_map_covars[k]
+        mask = grad_map_covar["xx"] + grad_map_covar["yy"] > threshold
+        grad_x = np.where(mask, 0, self.grad_maps[k]["x"])
+        grad_y = np.where(mask, 0, self.grad_maps[k]["y"])
+        return integration_methods.integrate_map(
+            grad_x, grad_y, method=integration_method, regions=regions, crop=crop
+        )
@@ -0,0 +1,156 @@
+import numpy as np
+
+import sample.helpers.coordinate_transforms as coordinate_transforms
+from sample.tracking.intensity_map import LOOKUPS
+
+
+def shard_bounds(num_particles, num_shards):
+    """
+    :param num_particles: number of particles
+    :param num_shards: number of shards
+    :return: list of (start, stop) of the contiguous shards of the particles
+    """
+    bounds = np.linspace(0, num_particles, num_shards + 1).astype(int)
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def shard_rng(entropy, step, shard):
+    """
+    Independent random stream of one shard of the particles at one motion update, the
+    same in whichever process the shard is evaluated
+    :param entropy: entropy of the seed of the tracker (np.random.SeedSequence)
+    :param step: number of the motion update
+    :param shard: number of the shard
+    :return: np.random.Generator
+    """
+    return np.random.default_rng(
+        np.random.SeedSequence(entropy, spawn_key=(step, shard))
+    )
+
+
+def perturb_rotations(rotations, sigmas, rng):
+    """
+    Motion update of the rotations, in place: random rotation with normal angles
+    around x, y and z (generators G1, G2, G3)
+    :param rotations: rotation matrices of the particles, Nx3x3
+    :param sigmas: standard deviations of the angles around x, y and z
+    :param rng: np.random.Generator
+    """
+    omega = np.column_stack(
+        [rng.normal(0.0, sigma, len(rotations)) for sigma in sigmas]
+    )
+    rotations[:] = np.matmul(rotations, coordinate_transforms.rotvecs2rotmats(omega))
+
+
+def event_likelihood(z, pol, mu, sigma, k_e, flipped):
+    """
+    Likelihood of the events given the log intensity changes z: a Gaussian on |z|
+    around mu where the signs of z and of the polarity agree, plus noise k_e
+    :param z: log intensity differences
+    :param pol: polarities of the events (broadcast against z)
+    :param mu: mean
+    :param sigma: standard deviation
+    :param k_e: minimum constant / noise
+    :param flipped: the signs agree when they differ (sign convention of the map)
+    :return: event-likelihoods, same shape as z
+    """
+    if flipped:
+        match = np.sign(z) != np.sign(pol)
+    else:
+        match = np.sign(z) == np.sign(pol)
+    gaussian = (
+        1
+        / (sigma * np.sqrt(2 * np.pi))
+        * np.exp(-((np.abs(z) - mu) ** 2) / (2 * sigma) ** 2)
+    )
+    return k_e + np.where(match, gaussian, 0.0)
+
+
+def lookup_map_points(intensity_map, pm, interpolation="nearest", out=None):
+    """
+    Log intensities at map points, one pixel up and left of the map points as in the
+    original tracker
+    :param intensity_map: log intensity map (array or memmap)
+    :param pm: map points (coordinates in the map image), 2xN
+    :param interpolation: lookup in the map, one of intensity_map.LOOKUPS
+    :param out: output array, N, None: new array
+    :return: log intensities, N
+    """
+    return LOOKUPS[interpolation](intensity_map, pm[1] - 1, pm[0] - 1, out=out)
+
+
+def swap_cached_intensities(intensity_cache, x, y, logintensity):
+    """
+    Reads the log intensities seen by the previous event at the pixel of each event
+    (at t-t_c) from the per-pixel cache, and stores the intensities seen by the events
+    in their place. An earlier event of the batch at the same pixel saw the same
+    intensity as the event itself (same bearing and pose).
+    :param intensity_cache: log intensity seen by the last event of each sensor pixel,
+                            sensor_height x sensor_width, updated in place
+    :param x: x coordinates of the events (integer array)
+    :param y: y coordinates of the events (integer array)
+    :param logintensity: log intensities seen by the events, B
+    :return: log intensities seen at t-t_c, B
+    """
+    logintensity_ttc = intensity_cache[y, x]
+
+    pixel = y * intensity_cache.shape[1] + x
+    repeated = np.ones(len(pixel), dtype=bool)
+    repeated[np.unique(pixel, return_index=True)[1]] = False
+    logintensity_ttc[repeated] = logintensity[repeated]
+
+    intensity_cache[y, x] = logintensity
+    return logintensity_ttc
+
+
+def accumulate_likelihoods(
+    particles,
+    rotation_world,
+    bearings,
+    pol,
+    logintensity_ttc,
+    intensity_map,
+    projection,
+    chunk,
+    likelihood_parameters,
+    interpolation="nearest",
+):
+    """
+    Sum over the events of the likelihood of each particle, into
+    particles.likelihood_sum. All events and particles are evaluated at once as BxN
+    arrays, in chunks of events.
+    :param particles: ParticleSet
+    :param rotation_world: rotation from the reference frame of the particles to the
+                           world reference frame of the map
+    :param bearings: bearings of the events in the camera frame, Bx3
+    :param pol: polarities of the events, B
+    :param logintensity_ttc: log intensities seen by the events at t-t_c, B
+    :param intensity_map: log intensity map (array or memmap)
+    :param projection: map projection of intensity_map
+    :param chunk: number of events evaluated at once
+    :param likelihood_parameters: mu, sigma, k_e, flipped of event_likelihood
+    :param interpolation: lookup in the map, one of intensity_map.LOOKUPS
+    """
+    # rotations from the camera frame to the world reference frame of the map
+    rotations_world = np.matmul(rotation_world, particles.rotations)
+
+    particles.likelihood_sum[:] = 0.0
+    for start in range(0, len(bearings), chunk):
+        stop = min(start + chunk, len(bearings))
+        world, logintensity_t, z = particles.buffers(stop - start)
+        # bearings of the events in the world frame for each particle, BxNx3
+        np.einsum("nij,bj->bni", rotations_world, bearings[start:stop], out=world)
+        # find the intensity of the map points at t
+        lookup_map_points(
+            intensity_map,
+            projection.project(world.reshape(-1, 3).T),
+            interpolation,
+            out=logintensity_t.reshape(-1),
+        )
+        # calculate log intensity change
+        np.subtract(logintensity_t, logintensity_ttc[start:stop, np.newaxis], out=z)
+        # get likelihood for respective intensity changes
+        particles.likelihood_sum += np.sum(
+            event_likelihood(z, pol[start:stop, np.newaxis], **likelihood_parameters),
+            axis=0,
+        )
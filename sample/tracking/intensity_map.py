@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+
+
+def nearest_lookup(image, rows, cols, out=None):
+    """
+    Values of the map pixels containing the map points. The map covers the full sphere:
+    columns (azimuth) wrap around, rows are clamped at the poles.
+    :param image: map, HxW (array or memmap)
+    :param rows: row coordinates of the map points (continuous, pixel i is [i, i + 1))
+    :param cols: column coordinates of the map points
+    :param out: output array of the shape of rows, None: new array
+    :return: values at the map points
+    """
+    height, width = image.shape
+    ir = np.clip(np.floor(rows), 0, height - 1).astype(np.intp)
+    ic = np.mod(np.floor(cols).astype(np.intp), width)
+    if out is None:
+        return np.asarray(image[ir, ic], dtype=np.float64)
+    out[...] = image[ir, ic]
+    return out
+
+
+def bilinear_lookup(image, rows, cols, out=None):
+    """
+    Values of the map at the map points, bilinearly interpolated between the centers of
+    the four nearest pixels. Columns (azimuth) wrap around, rows are clamped at the
+    poles.
+    :param image: map, HxW (array or memmap)
+    :param rows: row coordinates of the map points (continuous, pixel i is [i, i + 1))
+    :param cols: column coordinates of the map points
+    :param out: output array of the shape of rows, None: new array
+    :return: values at the map points
+    """
+    height, width = image.shape
+    y = np.asarray(rows, dtype=np.float64) - 0.5
+    x = np.asarray(cols, dtype=np.float64) - 0.5
+    y0 = np.floor(y)
+    x0 = np.floor(x)
+    fy = y - y0
+    fx = x - x0
+    r0 = np.clip(y0, 0, height - 1).astype(np.intp)
+    r1 = np.clip(y0 + 1, 0, height - 1).astype(np.intp)
+    c0 = np.mod(x0.astype(np.intp), width)
+    c1 = np.mod(c0 + 1, width)
+    top = (1 - fx) * image[r0, c0] + fx * image[r0, c1]
+    bottom = (1 - fx) * image[r1, c0] + fx * image[r1, c1]
+    if out is None:
+        out = np.empty(y.shape)
+    np.add((1 - fy) * top, fy * bottom, out=out)
+    return out
+
+
+LOOKUPS = {"nearest": nearest_lookup, "bilinear": bilinear_lookup}
+
+
+class LazyIntensityMap:
+    """
+    Log intensity map of the mosaicer (.npy file), memory-mapped on first use instead of
+    loaded at import. Only the pages of the map that are looked up are read.
+    With dtype float32, a float32 copy of the map is written next to the file once (in
+    blocks of rows) and mapped instead, which halves the memory and the cache footprint.
+    """
+
+    def __init__(self, filename, dtype=np.float64):
+        """
+        :param filename: .npy file of the map
+        :param dtype: dtype of the mapped values, np.float64 or np.float32
+        """
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self._image = None
+
+    def _cache_filename(self):
+        root, ext = os.path.splitext(self.filename)
+        return root + "." + self.dtype.name + ext
+
+    def _open(self):
+        image = np.load(self.filename, mmap_mode="r")
+        if image.dtype == self.dtype:
+            return image
+
+        # Converted copy, written again when older than the map
+        filename = self._cache_filename()
+        if not os.path.exists(filename) or os.path.getmtime(
+            filename
+        ) < os.path.getmtime(self.filename):
+            converted = np.lib.format.open_memmap(
+                filename, mode="w+", dtype=self.dtype, shape=image.shape
+            )
+            rows = max(1, (1 << 24) // max(1, image.shape[1] * image.itemsize))
+            for start in range(0, image.shape[0], rows):
+                converted[start : start + rows] = image[start : start + rows]
+            converted.flush()
+            del converted
+        return np.load(filename, mmap_mode="r")
+
+    @property
+    def image(self):
+        """
+        :return: the map as a read-only np.memmap, opened on first access
+        """
+        if self._image is None:
+            self._image = self._open()
+        return self._image
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def lookup(self, rows, cols, interpolation="nearest", out=None):
+        """
+        :param rows: row coordinates of the map points
+        :param cols: column coordinates of the map points
+        :param interpolation: one of LOOKUPS
+        :param out: output array of the shape of rows, None: new array
+        :return: values at the map points, see nearest_lookup and bilinear_lookup
+        """
+        return LOOKUPS[interpolation](self.image, rows, cols, out=out)
@@ -0,0 +1,209 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from sample.mosaicing.parallel import pool_context
+from sample.tracking.particles import ParticleSet
+import sample.tracking.evaluation as evaluation
+
+# State attached in each worker process
+_worker_state = {}
+
+# Columns of the event batch in shared memory: bearing (3), polarity, log intensity at
+# t-t_c
+EVENT_COLUMNS = 5
+
+
+def _attach(
+    names,
+    shapes,
+    dtypes,
+    rotation_world,
+    projection,
+    likelihood_parameters,
+    interpolation,
+):
+    """
+    Pool initializer: attaches the shared arrays in a worker process
+    :param names: dictionary with array keys and shared memory names
+    :param shapes: dictionary with array keys and shapes
+    :param dtypes: dictionary with array keys and dtypes
+    :param rotation_world: rotation to the world reference frame of the map
+    :param projection: map projection of the intensity map
+    :param likelihood_parameters: parameters of evaluation.event_likelihood
+    :param interpolation: lookup in the intensity map, one of intensity_map.LOOKUPS
+    """
+    for key, name in names.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _worker_state[key] = (
+            shm,
+            np.ndarray(shapes[key], dtype=dtypes[key], buffer=shm.buf),
+        )
+    _worker_state["rotation_world"] = rotation_world
+    _worker_state["projection"] = projection
+    _worker_state["likelihood_parameters"] = likelihood_parameters
+    _worker_state["interpolation"] = interpolation
+    # All the shards of this worker share the scratch storage
+    _worker_state["particles"] = ParticleSet(_worker_state["rotations"][1])
+
+
+def _motion_shard(args):
+    """
+    Motion update of a shard of the particles, in a worker process
+    :param args: tuple (start, stop, sigmas, entropy, step, shard)
+    :return: void
+    """
+    start, stop, sigmas, entropy, step, shard = args
+    evaluation.perturb_rotations(
+        _worker_state["rotations"][1][start:stop],
+        sigmas,
+        evaluation.shard_rng(entropy, step, shard),
+    )
+
+
+def _measurement_shard(args):
+    """
+    Likelihoods of a shard of the particles, in a worker process
+    :param args: tuple (start, stop, num_events, chunk)
+    :return: sum over the events of the likelihood of each particle of the shard
+    """
+    start, stop, num_events, chunk = args
+    events = _worker_state["events"][1][:num_events]
+    particles = _worker_state["particles"].view(start, stop)
+    evaluation.accumulate_likelihoods(
+        particles,
+        _worker_state["rotation_world"],
+        events[:, :3],
+        events[:, 3],
+        events[:, 4],
+        _worker_state["intensity_map"][1],
+        _worker_state["projection"],
+        chunk,
+        _worker_state["likelihood_parameters"],
+        _worker_state["interpolation"],
+    )
+    return particles.likelihood_sum
+
+
+class ParallelEvaluator:
+    """
+    Evaluation of the particles of the tracker in a persistent pool of worker processes.
+    The intensity map, the rotations of the particles and the event batch are kept in
+    multiprocessing.shared_memory. The particles are cut into contiguous shards, which
+    are dispatched to the workers: for the motion update each shard draws its noise
+    from its own np.random.Generator stream (see evaluation.shard_rng) and updates its
+    rotations in shared memory, for the measurement update only the likelihood sums of
+    the shard are sent back. Shards and streams do not depend on the number of workers,
+    and the serial tracker uses the same ones, so both give the same particles.
+    """
+
+    def __init__(
+        self,
+        intensity_map,
+        projection,
+        rotation_world,
+        likelihood_parameters,
+        interpolation,
+        max_particles,
+        max_events,
+        num_workers,
+        num_shards,
+    ):
+        """
+        :param intensity_map: log intensity map (array or memmap), copied to shared
+                              memory with its dtype
+        :param projection: map projection of the intensity map
+        :param rotation_world: rotation to the world reference frame of the map
+        :param likelihood_parameters: parameters of evaluation.event_likelihood
+        :param interpolation: lookup in the intensity map, one of intensity_map.LOOKUPS
+        :param max_particles: maximum number of particles
+        :param max_events: maximum number of events per batch
+        :param num_workers: number of worker processes
+        :param num_shards: number of shards of the particles
+        """
+        self.num_shards = num_shards
+        shapes = {
+            "intensity_map": intensity_map.shape,
+            "rotations": (max_particles, 3, 3),
+            "events": (max_events, EVENT_COLUMNS),
+        }
+        dtypes = {
+            "intensity_map": intensity_map.dtype,
+            "rotations": np.float64,
+            "events": np.float64,
+        }
+        self.shm = {}
+        self.arrays = {}
+        for key, shape in shapes.items():
+            shm = shared_memory.SharedMemory(
+                create=True, size=int(np.prod(shape)) * np.dtype(dtypes[key]).itemsize
+            )
+            self.shm[key] = shm
+            self.arrays[key] = np.ndarray(shape, dtype=dtypes[key], buffer=shm.buf)
+        self.arrays["intensity_map"][:] = intensity_map
+
+        self.pool = pool_context().Pool(
+            num_workers,
+            initializer=_attach,
+            initargs=(
+                {key: shm.name for key, shm in self.shm.items()},
+                shapes,
+                dtypes,
+                rotation_world,
+                projection,
+                likelihood_parameters,
+                interpolation,
+            ),
+        )
+
+    def motion_update(self, particles, sigmas, entropy, step):
+        """
+        Same as evaluation.perturb_rotations on each shard, in parallel
+        :param particles: ParticleSet, rotations updated
+        :param sigmas: standard deviations of the angles around x, y and z
+        :param entropy: entropy of the seed of the tracker
+        :param step: number of the motion update
+        """
+        rotations = self.arrays["rotations"][: len(particles)]
+        rotations[:] = particles.rotations
+        tasks = [
+            (start, stop, sigmas, entropy, step, shard)
+            for shard, (start, stop) in enumerate(
+                evaluation.shard_bounds(len(particles), self.num_shards)
+            )
+        ]
+        self.pool.map(_motion_shard, tasks)
+        particles.rotations[:] = rotations
+
+    def accumulate_likelihoods(self, particles, bearings, pol, logintensity_ttc, chunk):
+        """
+        Same as evaluation.accumulate_likelihoods, in parallel over the shards
+        :param particles: ParticleSet, likelihood_sum updated
+        :param bearings: bearings of the events in the camera frame, Bx3
+        :param pol: polarities of the events, B
+        :param logintensity_ttc: log intensities seen by the events at t-t_c, B
+        :param chunk: number of events evaluated at once
+        """
+        self.arrays["rotations"][: len(particles)] = particles.rotations
+        events = self.arrays["events"][: len(bearings)]
+        events[:, :3] = bearings
+        events[:, 3] = pol
+        events[:, 4] = logintensity_ttc
+        tasks = [
+            (start, stop, len(bearings), chunk)
+            for start, stop in evaluation.shard_bounds(len(particles), self.num_shards)
+        ]
+        particles.likelihood_sum[:] = np.concatenate(
+            self.pool.map(_measurement_shard, tasks)
+        )
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory
+        """
+        self.pool.close()
+        self.pool.join()
+        self.arrays = {}
+        for shm in self.shm.values():
+            shm.close()
+            shm.unlink()
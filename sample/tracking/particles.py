@@ -0,0 +1,85 @@
+import numpy as np
+
+# Memory used per event and particle by the batched measurement update: the scratch
+# buffers below plus the temporaries of the map projection and of the likelihood
+BYTES_PER_EVENT_PARTICLE = 160
+
+
+class ParticleSet:
+    """
+    State of the particle filter of the tracker: one rotation matrix and one weight per
+    particle, stored as arrays, plus scratch buffers for the per-event quantities
+    (bearings in the world frame, intensities), which hold a chunk of
+    events by all particles. They are allocated once and reused for every chunk.
+    """
+
+    def __init__(self, rotations, weights=None):
+        """
+        :param rotations: rotation matrices of the particles, Nx3x3
+        :param weights: weights of the particles, N, None: uniform
+        """
+        self.rotations = np.ascontiguousarray(rotations, dtype=np.float64)
+        num_particles = len(self.rotations)
+        if weights is None:
+            weights = np.full(num_particles, 1.0 / num_particles)
+        self.weights = np.array(weights, dtype=np.float64)
+        self.likelihood_sum = np.zeros(num_particles)
+        # Scratch storage, in a list so that it can be shared between particle sets
+        self._storage = [None]
+
+    def __len__(self):
+        return len(self.rotations)
+
+    def events_per_chunk(self, memory_budget):
+        """
+        :param memory_budget: memory available to the measurement update, in bytes
+        :return: number of events evaluated at once for all particles
+        """
+        return max(1, int(memory_budget // (BYTES_PER_EVENT_PARTICLE * len(self))))
+
+    def buffers(self, num_events):
+        """
+        Scratch buffers for a chunk of events, grown when needed. The storage is shared
+        with the particle sets made by select and view, whatever their number of
+        particles.
+        :param num_events: number of events in the chunk
+        :return: bearings in the world frame (BxNx3), log intensities and log
+                 intensity changes (BxN)
+        """
+        size = num_events * len(self)
+        if self._storage[0] is None or len(self._storage[0][1]) < size:
+            self._storage[0] = (
+                np.empty(3 * size),
+                np.empty(size),
+                np.empty(size),
+            )
+        shape = (num_events, len(self))
+        world = self._storage[0][0][: 3 * size].reshape(shape + (3,))
+        return (world,) + tuple(
+            buffer[:size].reshape(shape) for buffer in self._storage[0][1:]
+        )
+
+    def select(self, idx):
+        """
+        :param idx: indices of the particles to keep, repetitions allowed
+        :return: new ParticleSet with these particles and uniform weights
+        """
+        particles = ParticleSet(self.rotations[idx])
+        particles._storage = self._storage
+        return particles
+
+    def view(self, start, stop):
+        """
+        :param start: first particle
+        :param stop: end of the particles
+        :return: ParticleSet of the particles start:stop, whose rotations, weights and
+                 likelihoods are views of the ones of this set
+        """
+        particles = ParticleSet(self.rotations[start:stop])
+        particles.weights = self.weights[start:stop]
+        particles.likelihood_sum = self.likelihood_sum[start:stop]
+        particles._storage = self._storage
+        return particles
+
+    def copy(self):
+        return ParticleSet(self.rotations.copy(), self.weights.copy())
@@ -0,0 +1,177 @@
+import numpy as np
+from scipy import stats
+
+
+def effective_sample_size(weights):
+    """
+    :param weights: normalized weights of the particles
+    :return: effective sample size 1 / sum(w^2), between 1 and the number of particles
+    """
+    return 1.0 / np.sum(np.square(weights))
+
+
+def degenerate(weights, threshold):
+    """
+    Gate of the resampling on the effective sample size
+    :param weights: normalized weights of the particles
+    :param threshold: fraction of the number of particles
+    :return: effective sample size, whether it is below threshold times the number of
+             particles (the particles need resampling)
+    """
+    ess = effective_sample_size(weights)
+    return ess, ess < threshold * len(weights)
+
+
+def _cumulative_weights(weights, num):
+    """
+    :param weights: normalized weights of the particles
+    :param num: number of particles drawn
+    :return: num times the cumulative weights, ending exactly at num
+    """
+    cumulative = np.cumsum(weights) * (num / np.sum(weights))
+    cumulative[-1] = num
+    return cumulative
+
+
+def _repeat(counts):
+    """
+    :param counts: number of copies of each particle
+    :return: indices of the drawn particles
+    """
+    return np.repeat(np.arange(len(counts)), counts)
+
+
+def systematic_resampling(weights, rng, num=None):
+    """
+    Systematic resampling: the positions (k + u) / num, k = 0 ... num - 1, with one
+    uniform offset u, select the particles whose cumulative weight interval contains
+    them. The number of positions below each cumulative weight is a floor, so the
+    copies of all particles are counted in one O(N) pass.
+    :param weights: normalized weights of the particles
+    :param rng: np.random.Generator
+    :param num: number of particles drawn, None: as many as weights
+    :return: indices of the drawn particles, sorted
+    """
+    if num is None:
+        num = len(weights)
+    u = 1.0 - rng.random()  # in (0, 1]
+    cumulative = _cumulative_weights(weights, num)
+    below = np.clip(np.floor(cumulative - u).astype(int) + 1, 0, num)
+    return _repeat(np.diff(below, prepend=0))
+
+
+def stratified_resampling(weights, rng, num=None):
+    """
+    Stratified resampling: as systematic_resampling, with an independent uniform
+    offset in each of the num strata. Below a cumulative weight x, the strata before
+    floor(x) are complete and the stratum floor(x) counts if its offset is below the
+    fractional part of x.
+    :param weights: normalized weights of the particles
+    :param rng: np.random.Generator
+    :param num: number of particles drawn, None: as many as weights
+    :return: indices of the drawn particles, sorted
+    """
+    if num is None:
+        num = len(weights)
+    u = 1.0 - rng.random(num + 1)  # in (0, 1], one spare for x = num
+    cumulative = _cumulative_weights(weights, num)
+    complete = np.floor(cumulative).astype(int)
+    below = complete + (u[complete] <= cumulative - complete)
+    return _repeat(np.diff(np.minimum(below, num), prepend=0))
+
+
+def residual_resampling(weights, rng, num=None):
+    """
+    Residual resampling: each particle is first copied floor(num * w) times, the
+    remaining particles are drawn systematically from the residual weights
+    :param weights: normalized weights of the particles
+    :param rng: np.random.Generator
+    :param num: number of particles drawn, None: as many as weights
+    :return: indices of the drawn particles, sorted
+    """
+    if num is None:
+        num = len(weights)
+    expected = num * np.asarray(weights) / np.sum(weights)
+    counts = np.floor(expected).astype(int)
+    num_residual = num - np.sum(counts)
+    if num_residual > 0:
+        residual = expected - counts
+        counts += np.bincount(
+            systematic_resampling(residual / np.sum(residual), rng, num_residual),
+            minlength=len(counts),
+        )
+    return _repeat(counts)
+
+
+def multinomial_resampling(weights, rng, num=None):
+    """
+    Multinomial resampling: num independent draws, O(N log N)
+    :param weights: normalized weights of the particles
+    :param rng: np.random.Generator
+    :param num: number of particles drawn, None: as many as weights
+    :return: indices of the drawn particles
+    """
+    if num is None:
+        num = len(weights)
+    return rng.choice(len(weights), size=num, p=weights)
+
+
+def kld_num_particles(num_bins, error=0.05, confidence=0.99):
+    """
+    Number of particles needed so that, with probability confidence, the K-L divergence
+    between the particle approximation and the posterior is below error, when the
+    posterior occupies num_bins bins of the histogram (Fox, KLD-sampling)
+    :param num_bins: number of occupied bins (scalar or array)
+    :param error: bound on the K-L divergence
+    :param confidence: probability of the bound, 1 - delta
+    :return: number of particles (same shape as num_bins)
+    """
+    k = np.maximum(np.asarray(num_bins, dtype=np.float64) - 1.0, 1.0)
+    a = 2.0 / (9.0 * k)
+    z = stats.norm.ppf(confidence)
+    return np.ceil(k / (2.0 * error) * (1.0 - a + np.sqrt(a) * z) ** 3).astype(int)
+
+
+def kld_resampling(
+    weights,
+    rng,
+    bins,
+    min_particles,
+    max_particles,
+    method=systematic_resampling,
+    error=0.05,
+    confidence=0.99,
+):
+    """
+    Resampling with an adaptive number of particles (KLD-sampling): max_particles are
+    drawn with method, in random order, and the first n are kept, n being the first
+    count that reaches kld_num_particles of the histogram bins occupied by the first n
+    :param weights: normalized weights of the particles
+    :param rng: np.random.Generator
+    :param bins: histogram bin of each particle, N or NxD integer array
+    :param min_particles: lower bound on the number of particles
+    :param max_particles: upper bound on the number of particles
+    :param method: resampling function, one of RESAMPLING_METHODS
+    :param error: bound on the K-L divergence, see kld_num_particles
+    :param confidence: probability of the bound, see kld_num_particles
+    :return: indices of the drawn particles
+    """
+    idx = rng.permutation(method(weights, rng, max_particles))
+    _, bin_ids = np.unique(bins, axis=0, return_inverse=True)
+    _, first = np.unique(bin_ids.reshape(-1)[idx], return_index=True)
+    occupied = np.zeros(len(idx), dtype=int)
+    occupied[first] = 1
+    needed = np.maximum(
+        kld_num_particles(np.cumsum(occupied), error, confidence), min_particles
+    )
+    enough = np.flatnonzero(np.arange(1, len(idx) + 1) >= needed)
+    num = enough[0] + 1 if len(enough) > 0 else len(idx)
+    return idx[:num]
+
+
+RESAMPLING_METHODS = {
+    "systematic": systematic_resampling,
+    "stratified": stratified_resampling,
+    "residual": residual_resampling,
+    "multinomial": multinomial_resampling,
+}
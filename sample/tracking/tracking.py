@@ -15,11 +15,31 @@ import matplotlib
 matplotlib.use("TkAgg")
 import matplotlib.pyplot as plt
 import sample.helpers.helpers as helpers
+import sample.helpers.datasets as datasets
+import sample.helpers.projections as projections
+import sample.helpers.coordinate_transforms as coordinate_transforms
+from sample.tracking.particles import ParticleSet
+import sample.tracking.resampling as resampling
+import sample.tracking.evaluation as evaluation
+from sample.tracking.parallel import ParallelEvaluator
+from sample.tracking.intensity_map import LazyIntensityMap
+from sample.helpers.event_filters import (
+    EventFilterChain,
+    HotPixelFilter,
+    RefractoryFilter,
+    BackgroundActivityFilter,
+)
 
 
 # Folder paths
-data_dir = "../../data/synth1"
-intensity_map = np.load("../../output/intensity_map.npy")
+profile = datasets.get_profile("synth1")
+calibration_dir = "../../data/calibration"
+data_dir = os.path.join("../../data", profile["data_dir"])
+intensity_map_dtype = np.float64  # np.float32 halves the memory of the map
+intensity_map = LazyIntensityMap(  # memory-mapped on first lookup
+    "../../output/intensity_map.npy", dtype=intensity_map_dtype
+)
+intensity_interpolation = "nearest"  # or "bilinear", see intensity_map.LOOKUPS
 event_file = os.path.join(data_dir, "events.txt")
 filename_poses = os.path.join(data_dir, "poses.txt")
 outputdir_poses = "../output/poses/"
@@ -27,15 +47,15 @@ outputdir_poses = "../output/poses/"
 # Constants
 degrees_rot = 180
 eventlikelihood_comparison_flipped = True
-num_particles = 2000
+num_particles = 2000  # initial, kept throughout without adaptive_particles
 num_events_batch = 100
 sigma_init1 = 0.0  # 0.0001
 sigma_init2 = 0.0  # 0.0001
 sigma_init3 = 0.0  # 0.0001
 factor = 4 / 300 * num_events_batch
 # sigma_likelihood = 8.0*1e-2
-contrast_threshold = 0.45
-sigma_likelihood = 0.17
+contrast_threshold = profile["contrast_threshold"]
+sigma_likelihood = np.sqrt(profile["var_R"]["contrast"])
 minimum_constant = 1e-3
 sigma_1 = factor * 0.0004  # sigma1 for motion update
 sigma_2 = factor * 0.0004  # sigma2 for motion update
@@ -48,11 +68,29 @@ all_rotations_test = []
 # tau=7000
 # tau_c=2000                                      #time between events in same pixel
 # contrast_threshold = 0.22
-sensor_height = 128
-sensor_width = 128
+sensor_height = profile["sensor_height"]
+sensor_width = profile["sensor_width"]
 image_height = 1024
 image_width = 2 * image_height
+map_projection = projections.get_projection(
+    "equirectangular", image_width, image_height
+)  # same projection as the mosaicer that made intensity_map
 randomseed = None
+resampling_method = "systematic"  # one of resampling.RESAMPLING_METHODS
+resampling_threshold = 0.5  # resample when the ESS is below this fraction of particles
+# KLD-sampling: particle count chosen when the ESS triggers a resampling, kept in between
+adaptive_particles = False
+min_particles = 200  # bounds on the adaptive particle count
+max_particles = 5000
+kld_error = 0.05  # bound on the K-L divergence of the particle approximation
+kld_confidence = 0.99  # probability of the K-L divergence bound
+kld_bin_size = 2 * np.pi / image_width  # SO3 histogram bin, about a map pixel [rad]
+measurement_memory = 64 * 2 ** 20  # memory budget of the measurement update [bytes]
+num_workers = 1  # > 1: particles evaluated in a pool of worker processes
+particle_shards = 16  # shards of the particles, each with its own random stream
+filter_noise = False  # drop hot pixel, refractory and background-activity events
+refractory_period = 1e-3  # minimum time between two events at one pixel [s]
+background_activity_dt = 1e-2  # support window of the background-activity filter [s]
 
 #####################################################
 #
@@ -63,9 +101,24 @@ randomseed = None
 
 class Tracker:
     def __init__(self):
+        # cached lookup tables of the sensor (see datasets.sensor_tables)
+        self.tables = datasets.sensor_tables(profile, calibration_dir)
         self.calibration = self.camera_intrinsics()
-
-        pass
+        # one seed for the tracker: its own stream, and the streams of the shards of
+        # the particles for the motion updates (see evaluation.shard_rng)
+        self.entropy = np.random.SeedSequence(randomseed).entropy
+        self.rng = np.random.default_rng(np.random.SeedSequence(self.entropy))
+        self.motion_step = 0
+        self.likelihood_parameters = {
+            "mu": 0.45,
+            "sigma": sigma_likelihood,
+            "k_e": 1.0 * 1e-3,
+            "flipped": eventlikelihood_comparison_flipped,
+        }
+        # parallel evaluation of the particles, started by run when num_workers > 1
+        self.evaluator = None
+        # log intensity seen by the last event of each sensor pixel
+        self.intensity_cache = None
 
     def camera_intrinsics(self):
         """
@@ -73,10 +126,8 @@ class Tracker:
         :return: Camera intrinsic Matrix K
         """
 
-        # data set specific parameters:
-        K = np.array(
-            [[91.4014729896821, 0.0, 64.0], [0.0, 91.4014729896821, 64.0], [0, 0, 1]]
-        )
+        # data set specific parameters, from the calibration of the profile
+        K = self.tables["Kint"]
 
         return K
 
@@ -88,53 +139,22 @@ class Tracker:
         :param bound1: lower and upper bound for uniform distribution in direction of G1
         :param bound2: lower and upper bound for uniform distribution in direction of G2
         :param bound3: lower and upper bound for uniform distribution in direction of G3
-        :param seed: random seed
-        :return: DataFrame with ['Rotation', 'Weight', 'theta', 'phi', 'v', 'u', 'pol', 'r_w1', 'r_w2', 'r_w3', 'z', 'pol']
-        """
-
-        # initialize data frame for particles
-
-        df = pd.DataFrame(
-            columns=[
-                "Rotation",
-                "Weight",
-                "theta",
-                "phi",
-                "v",
-                "u",
-                "pol",
-                "p_w1",
-                "p_w2",
-                "p_w3",
-                "z",
-                "logintensity_ttc",
-                "logintensity_t",
-            ]
+        :param seed: random seed, None: random generator of the tracker
+        :return: ParticleSet with N particles of weight 1 / N
+        """
+        rng = self.rng if seed is None else np.random.default_rng(seed)
+
+        # initialize particle Rotations within the respective bounds, along the
+        # generators G1, G2, G3 of SO3 (rotations around x, y, z)
+        n = np.column_stack(
+            (
+                rng.uniform(-bound1, bound1, N),
+                rng.uniform(-bound2, bound2, N),
+                rng.uniform(-bound3, bound3, N),
+            )
         )
-        df["Rotation"] = df["Rotation"].astype(object)
-
-        # initialize weights
-        w0 = 1 / N
-
-        # generators of SO3 group
-        G1 = np.array([[0, 0, 0], [0, 0, -1], [0, 1, 0]])
-        G2 = np.array([[0, 0, 1], [0, 0, 0], [-1, 0, 0]])
-        G3 = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 0]])
-
-        # initialize particle Rotations within the respective bounds
-
-        for i in range(N):
-            n1 = np.random.uniform(-bound1, bound1)
-            n2 = np.random.uniform(-bound2, bound2)
-            n3 = np.random.uniform(-bound3, bound3)
-            df.at[i, ["Rotation"]] = [
-                np.dot(
-                    init_rotmat,
-                    sp.expm(np.dot(n1, G1) + np.dot(n2, G2) + np.dot(n3, G3)),
-                )
-            ]
-            df.at[i, ["Weight"]] = float(w0)
-        return df
+        rotations = np.matmul(init_rotmat, coordinate_transforms.rotvecs2rotmats(n))
+        return ParticleSet(rotations)
 
     def initialize_sensortensor(self, sensor_height=128, sensor_width=128):
         """
@@ -152,312 +172,273 @@ class Tracker:
             (sensor_height, sensor_width), dtype=[("time", "f8"), ("polarity", "i4")]
         )
         sensortensor = np.array([sensortensor_t, sensortensor_tc])
+        # pixels that have not fired yet: the first event passes the noise filters
+        sensortensor["time"] = -np.inf
         return sensortensor
 
-    def update_sensortensor(self, sensortensor, event):
+    def update_sensortensor_batch(self, sensortensor, t, x, y, pol):
         """
-        Updates sensortensor for each event. Saves event at t and t-t_c
-        Runtime: ~200seconds for all events
+        Updates sensortensor for all events of a batch at once, in their order. Saves
+        the last two events at each pixel, at t and t-t_c (the later of two events at
+        the same pixel sees the earlier one at t-t_c)
         :param sensortensor: tensor sensorwidth*sensorheight*2, with tuple (t,pol) as entries
-        :param event: Pandas Series with ['t', 'x', 'y', 'pol']
-        :return: void
-        """
-        x = int(event["x"])
-        y = int(event["y"])
-        sensortensor[1][y, x] = sensortensor[0][y, x]
-        sensortensor[0][y, x] = (event["t"], event["pol"])
-        return
-
-    def event_and_particles_to_angles(self, event, particles, calibration_inv):
-        """
-        For a given event, generates dataframe
-        with particles as rows and angles as columns.
-        :param event: Event in camera frame
-        :param df_rotationmatrices: DataFrame with rotation matrices
-        :param calibration_inv: inverted camera calibration
-        :return: DataFrame with particles as rows and angles as columns.
-        """
-
-        # from camera frame (u,v) to world reference frame
-        k_inv_times_event = np.dot(
-            calibration_inv, np.array([[event["x"]], [event["y"]], [1]])
-        )
-
-        coordinates = ["p_w1", "p_w2", "p_w3"]
-
-        particles[coordinates] = pd.DataFrame.from_records(
-            particles["Rotation"].apply(
-                lambda x: np.dot(np.dot(first_matrix.T, x), k_inv_times_event)
-            )
-        )
-
-        particles["p_w1"] = particles["p_w1"].str.get(
-            0
-        )  # str.get(0) just removes brackets
-        particles["p_w2"] = particles["p_w2"].str.get(0)
-        particles["p_w3"] = particles["p_w3"].str.get(0)
-
-        # from world reference frame to rotational frame (theta, phi) so we can plot it on a 2D map
-
-        particles["theta"] = np.arctan2(particles["p_w1"], particles["p_w3"])
-        particles["phi"] = np.arctan2(
-            particles["p_w2"],
-            np.sqrt(np.power(particles["p_w1"], 2) + np.power(particles["p_w3"], 2)),
-        )
-
-        return particles
-
-    def event_and_oneparticle_to_angles(self, event, particle, calibration_inv):
-        """
-        For a given event, generates dataframe
-        with particles as rows and angles as columns.
-        :param event: Event in camera frame
-        :param df_rotationmatrices: DataFrame with rotation matrices
-        :param calibration: camera calibration
-        :return: DataFrame with particles as rows and angles as columns.
-        """
-
-        # Similarly as event_and_particles_to_angles for just one particle
-        k_inv_times_event = np.dot(
-            calibration_inv, np.array([[event["x"]], [event["y"]], [1]])
-        )  # from camera frame (u,v) to world reference frame
-        r_w1, r_w2, r_w3 = np.dot(
-            np.dot(first_matrix.T, particle["Rotation"]), k_inv_times_event
-        )
-        r_w1 = r_w1[0]
-        r_w2 = r_w2[0]
-        r_w3 = r_w3[0]
-
-        theta = np.arctan2(r_w1, r_w3)
-        phi = np.arctan2(r_w2, np.sqrt(r_w1 ** 2 + r_w3 ** 2))
-
-        return theta, phi
-
-    def angles2map(self, theta, phi, height=1024, width=2048):
-        """
-        Converts angles (theta in [-pi, pi], phi in [-pi/2, pi/2])
-        to integer map points (pixel coordinates)
-        :param theta:
-        :param phi:
-        :param height: height of image in pixels
-        :param width: width of image in pixels
-        :return: tuple with integer map points (pixel coordinates)
-        """
-        v = np.floor(-1 * (np.pi / 2 - phi) / np.pi * height + height)  # jb's version
-        u = np.floor((theta + np.pi) / (2 * np.pi) * width)
-        return v, u
-
-    def angles2map_df(self, particles, height=1024, width=2048):
-        """
-        USED FOR COLLECTION OF PARTICLES, same principle as angles2map
-        For DataFrame particles, converts angles (theta in [-pi, pi], phi in [-pi/2, pi/2])
-        to integer map points (pixel coordinates)
-        :param particles: DataFrame
-        :param height: height of image in pixels
-        :param width: width of image in pixels
-        :return: particles
-        """
-        particles["v"] = particles["phi"].apply(
-            lambda angle: np.floor(-1 * (np.pi / 2 - angle) / np.pi * height + height)
-        )
-        particles["u"] = particles["theta"].apply(
-            lambda angle: np.floor((angle + np.pi) / (2 * np.pi) * width)
-        )
-        return particles
-
-    def particles_per_event2map(self, event, particles, calibration_inv):
-        """
-        For each event, gets map angles and coordinates (for on panoramic image)
-        :param event: one event
-        :param particles: dataframe with particles
-        :param calibration: calibration matrix
-        """
-        self.event_and_particles_to_angles(event, particles, calibration_inv)
-        self.angles2map_df(particles)
-        particles["pol"] = event["pol"]
-        return
-
-    def oneparticle_per_event2map(self, event, particle, calibration_inv):
-        """
-        For each event, gets map angles and coordinates (for on panoramic image)
-        :param event: one event
-        :param particle: dataframe with particle
-        :param calibration_inv:
-        :return:  DataFrame with particles as rows and as columns theta, phi, v, u (coordinates)
-        """
-        theta, phi = self.event_and_oneparticle_to_angles(
-            event, particle, calibration_inv
-        )
-        v, u = self.angles2map(theta, phi)
-        particle["v"] = v
-        particle["u"] = u
-        particle["pol"] = event["pol"]
-        return
+        :param t: timestamps of the events
+        :param x: x coordinates of the events (integer array)
+        :param y: y coordinates of the events (integer array)
+        :param pol: polarities of the events
+        :return: time of the previous event at the pixel of each event (t-t_c)
+        """
+        pixel = y * sensortensor.shape[2] + x
+        order = np.argsort(pixel, kind="stable")
+        pixel_sorted = pixel[order]
+        first = np.ones(len(pixel), dtype=bool)
+        first[1:] = pixel_sorted[1:] != pixel_sorted[:-1]
+        last = np.ones(len(pixel), dtype=bool)
+        last[:-1] = first[1:]
+
+        events_sorted = np.empty(len(pixel), dtype=sensortensor.dtype)
+        events_sorted["time"] = t[order]
+        events_sorted["polarity"] = pol[order]
+
+        # previous event: the one before in the batch, or the one in the tensor
+        sensortensor_t = sensortensor[0].reshape(-1)
+        sensortensor_tc = sensortensor[1].reshape(-1)
+        previous_sorted = np.empty_like(events_sorted)
+        previous_sorted[1:] = events_sorted[:-1]
+        previous_sorted[first] = sensortensor_t[pixel_sorted[first]]
+
+        # the tensor keeps the last two events at each pixel
+        sensortensor_tc[pixel_sorted[last]] = previous_sorted[last]
+        sensortensor_t[pixel_sorted[last]] = events_sorted[last]
+
+        tminustc = np.empty(len(pixel))
+        tminustc[order] = previous_sorted["time"]
+        return tminustc
+
+    def events_to_bearings(self, x, y):
+        """
+        :param x: x coordinates of the events
+        :param y: y coordinates of the events
+        :return: bearings of the events in the camera frame, Bx3
+        """
+        return self.tables["pinhole_bearings"][y, x]
 
     def motion_update(self, particles, velocity=1.0):
         """
         Randomly (normal) perturbs particles.
-        :param particles: DataFrame with particles
+        :param particles: ParticleSet
         :param velocity: timestep
-        :return: DataFrame with updated particles
+        :return: ParticleSet with updated particles
         """
         # check working mechanism with fixed velocity, used for variance of motion update
         if np.isinf(velocity):
             print("is inf!")
             velocity = 1.0
 
-        G1 = np.array([[0, 0, 0], [0, 0, -1], [0, 1, 0]])  # rotation around x
-        G2 = np.array([[0, 0, 1], [0, 0, 0], [-1, 0, 0]])  # rotation around y
-        G3 = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 0]])  # rotation around z
-
-        # motion update for the rotation matrices
-        particles["Rotation"] = particles["Rotation"].apply(
-            lambda x: np.dot(
-                x,
-                sp.expm(
-                    np.random.normal(0.0, abs(velocity * sigma_1)) * G3
-                    + np.random.normal(0.0, abs(velocity * sigma_2)) * G1
-                    + np.random.normal(0.0, abs(velocity * sigma_3)) * G2
-                ),
-            )
+        # motion update for the rotation matrices: rotation around x (G1) with sigma_2,
+        # around y (G2) with sigma_3 and around z (G3) with sigma_1, with the noise of
+        # each shard of the particles from its own stream
+        sigmas = (
+            abs(velocity * sigma_2),
+            abs(velocity * sigma_3),
+            abs(velocity * sigma_1),
         )
-        np.random.normal()
+        step = self.motion_step
+        self.motion_step += 1
+        if self.evaluator is not None:
+            self.evaluator.motion_update(particles, sigmas, self.entropy, step)
+            return particles
+        for shard, (start, stop) in enumerate(
+            evaluation.shard_bounds(len(particles), particle_shards)
+        ):
+            evaluation.perturb_rotations(
+                particles.rotations[start:stop],
+                sigmas,
+                evaluation.shard_rng(self.entropy, step, shard),
+            )
 
         return particles
 
-    def get_latest_particles(self, t_asked, particles_all_time):
-        """
-        From list of particles over all times
-        (one per timestep/batch, already resampled),
-        get set of particles that was just before asked t_asked
-        :param t_asked: t_asked of interest (e.g. t_asked of current event)
-        :param particles_all_time:
-        :return: the particle that came before a time-of-interest.
+    def event_likelihood(self, z, pol, mu=0.45, sigma=sigma_likelihood, k_e=1.0 * 1e-3):
         """
-        # dt_pos = 1e-4
-        # dt_pos_inv = 1. / dt_pos
-        # t_particles = math.floor(t_asked * dt_pos_inv) / dt_pos
-        return particles_all_time[particles_all_time["t"] <= t_asked].iloc[-1]
-
-    def event_likelihood(
-        self, z, event, mu=0.45, sigma=sigma_likelihood, k_e=1.0 * 1e-3
-    ):
-        """
-        For a given absolute log intensity difference z,
+        For given absolute log intensity differences z,
         returns the likelihood of an event following a Gaussian curve with the indicated mu and sigma.
         likelihood = gaussian distribution + noise
-        :param z: log intensity difference
+        :param z: log intensity difference (scalar or array, e.g. one per particle)
+        :param pol: polarity of the event
         :param mu: mean
         :param sigma: standard deviation
         :param k_e: minimum constant / noise
-        :return: event-likelihood (scalar)
+        :return: event-likelihood, same shape as z
         """
         # TODO: Test if == or != works better. -> Seems as != looks better, see slack!
-        if eventlikelihood_comparison_flipped:
-            if np.sign(z) != np.sign(event["pol"]):
-                return k_e + 1 / (sigma * np.sqrt(2 * np.pi)) * np.exp(
-                    -(np.abs(z) - mu) ** 2 / (2 * sigma) ** 2
-                )
-            else:
-                return k_e
-        else:
-            if np.sign(z) == np.sign(event["pol"]):
-                return k_e + 1 / (sigma * np.sqrt(2 * np.pi)) * np.exp(
-                    -(np.abs(z) - mu) ** 2 / (2 * sigma) ** 2
-                )
-            else:
-                return k_e
+        return evaluation.event_likelihood(
+            z, pol, mu, sigma, k_e, eventlikelihood_comparison_flipped
+        )
+
+    def initialize_intensity_cache(self, rotation, sensor_height=128, sensor_width=128):
+        """
+        Initializes the cache of the log intensities seen by the last event of each
+        sensor pixel, for pixels that have not fired yet: the intensities seen with the
+        initial pose (the t-t_c of their first event is the start of the recording).
+        The map is fixed during tracking, so the intensity is cached rather than the
+        map point.
+        :param rotation: initial pose
+        :param sensor_height:
+        :param sensor_width:
+        :return: log intensities, sensor_height x sensor_width
+        """
+        y, x = np.mgrid[0:sensor_height, 0:sensor_width]
+        bearings = self.events_to_bearings(x.ravel(), y.ravel())
+        return self.logintensity_seen(rotation, bearings).reshape(
+            sensor_height, sensor_width
+        )
+
+    def logintensity_seen(self, rotation, bearings):
+        """
+        :param rotation: pose of the camera
+        :param bearings: bearings of the events in the camera frame, Bx3
+        :return: log intensities of the map seen by the events with the pose, B
+        """
+        world = np.dot(bearings, np.dot(first_matrix.T, rotation).T)
+        return evaluation.lookup_map_points(
+            intensity_map.image,
+            map_projection.project(world.T),
+            intensity_interpolation,
+        )
 
-    def measurement_update(
-        self, events_batch, particles, all_rotations, sensortensor, calibration_inv
-    ):
+    def logintensity_ttc(self, x, y, bearings, rotation):
+        """
+        Log intensities seen by the events at t-t_c, from the cache of the intensities
+        seen by the last event of each pixel (one gather), and updates the cache with
+        the intensities seen by the events with the current pose. The pose used for an
+        event is the last one estimated before it.
+        :param x: x coordinates of the events (integer array)
+        :param y: y coordinates of the events (integer array)
+        :param bearings: bearings of the events in the camera frame, Bx3
+        :param rotation: current pose, estimated before the events of the batch
+        :return: log intensities, B
         """
+        return evaluation.swap_cached_intensities(
+            self.intensity_cache, x, y, self.logintensity_seen(rotation, bearings)
+        )
 
+    def measurement_update(self, events_batch, particles, all_rotations, sensortensor):
+        """
+        Multiplies the weight of each particle by the mean likelihood of the events of
+        the batch. All events and particles are evaluated at once as BxN arrays, in
+        chunks of events that fit in measurement_memory, and in parallel over the shards
+        of the particles with num_workers > 1. The intensities at t-t_c come from the
+        per-pixel intensity_cache, initialized with the first pose of all_rotations if
+        run has not done it.
         :param events_batch: events of a batch
-        :param particles: particles
+        :param particles: ParticleSet
         :param all_rotations: DataFrame containing one time and one rotation per batch.
         :param sensortensor: sensortensor
-        :param calibration_inv: inverted calibration matrix
         :return: particles
         """
-        particles["Weight"] = np.empty((len(particles), 0)).tolist()
-
-        for idx, event in events_batch.iterrows():
-
-            # for each event, update the sensor tensor
-            self.update_sensortensor(sensortensor, event)
-            # for each event, convert rotation matrix to pixels on the map
-            self.particles_per_event2map(event, particles, calibration_inv)
-            # calculate the contrast change between the previous and current intensity on the respective pixel
-            tminustc = sensortensor[1][int(event["y"]), int(event["x"])][0]
-            # todo was macht das?
-            particle_ttc = self.get_latest_particles(
-                tminustc, particles_all_time=all_rotations
-            )  # single rotationmatrix before ttc
-            self.oneparticle_per_event2map(event, particle_ttc, calibration_inv)
-            # find the intensity of the pixel at t-t_c
-            particles["logintensity_ttc"] = intensity_map[
-                int(particle_ttc["v"] - 1), int(particle_ttc["u"] - 1)
-            ]
-            # find the intensity of the pixel at t
-            particles["logintensity_t"] = particles.apply(
-                lambda row: intensity_map[int(row.v - 1), int(row.u - 1)], axis=1
+        t = events_batch["t"].values
+        x = events_batch["x"].values.astype(int)
+        y = events_batch["y"].values.astype(int)
+        pol = events_batch["pol"].values
+
+        # update the sensor tensor, and find the intensity of the pixels at t-t_c
+        self.update_sensortensor_batch(sensortensor, t, x, y, pol)
+        bearings = self.events_to_bearings(x, y)
+        if self.intensity_cache is None:
+            self.intensity_cache = self.initialize_intensity_cache(
+                all_rotations["Rotation"].iloc[0],
+                sensortensor.shape[1],
+                sensortensor.shape[2],
+            )
+        logintensity_ttc = self.logintensity_ttc(
+            x, y, bearings, all_rotations["Rotation"].iloc[-1]
+        )
+
+        # likelihoods of the events for each particle
+        chunk = particles.events_per_chunk(measurement_memory)
+        if self.evaluator is not None:
+            self.evaluator.accumulate_likelihoods(
+                particles, bearings, pol, logintensity_ttc, chunk
             )
-            # calculate log intensity change
-            particles["z"] = particles["logintensity_t"] - particles["logintensity_ttc"]
-            # get likelihood for respective intensity changes
-            particles["Weight"] = particles.apply(
-                lambda x: x.Weight + [self.event_likelihood(x.z, event)], axis=1
+        else:
+            evaluation.accumulate_likelihoods(
+                particles,
+                first_matrix.T,
+                bearings,
+                pol,
+                logintensity_ttc,
+                intensity_map.image,
+                map_projection,
+                chunk,
+                self.likelihood_parameters,
+                intensity_interpolation,
             )
+
         # update weights
-        particles["Weight"] = particles["Weight"].apply(lambda x: np.mean(x))  # Tested
+        particles.weights *= particles.likelihood_sum / len(t)
 
-        return
+        return particles
 
     def normalize_particle_weights(self, particles):
         """
         normalizes particle weights
-        :param particles: particles
+        :param particles: ParticleSet
         :return: particles with normalized weight (sum of weights = 1)
         """
-        particles["Weight"] = particles["Weight"] / particles["Weight"].sum()
-        return
+        particles.weights /= np.sum(particles.weights)
+        return particles
 
     def resampling(self, particles):
         """
-        resamples particles
-        :param particles:
-        :return: resampled particles, weighted average
+        resamples particles with resampling_method, if the effective sample size of the
+        normalized weights is below resampling_threshold times the number of particles
+        With adaptive_particles, the number of resampled particles is chosen by
+        KLD-sampling, from the occupancy of a histogram of the rotations around their
+        mean with bins of kld_bin_size, between min_particles and max_particles. The
+        number of particles thus only changes when the ESS triggers a resampling.
+        :param particles: ParticleSet
+        :return: particles (resampled, with uniform weights, or unchanged),
+                 effective sample size before resampling, whether it resampled
         """
-
-        # initialize empty df
-
-        resampled_particles = pd.DataFrame(columns=["Rotation", "Weight"])
+        ess, needed = resampling.degenerate(particles.weights, resampling_threshold)
+        if not needed:
+            return particles, ess, False
 
         # choose with replacement of the particles weighted according to weights after measurement update
-        resampled_particles["Rotation"] = particles["Rotation"].sample(
-            n=len(particles), replace=True, weights=particles["Weight"], random_state=1
-        )
-        # reset weights
-        resampled_particles["Weight"] = float(1 / len(particles))
-        # reset index
-        resampled_particles = resampled_particles.reset_index(drop=True)
-
-        return resampled_particles
+        method = resampling.RESAMPLING_METHODS[resampling_method]
+        if adaptive_particles:
+            mean = self.mean_of_resampled_particles(particles)
+            offsets = coordinate_transforms.rotmats2rotvecs(
+                np.matmul(mean.T, particles.rotations)
+            )
+            idx = resampling.kld_resampling(
+                particles.weights,
+                self.rng,
+                np.floor(offsets / kld_bin_size).astype(int),
+                min_particles,
+                max_particles,
+                method=method,
+                error=kld_error,
+                confidence=kld_confidence,
+            )
+        else:
+            idx = method(particles.weights, self.rng)
+        return particles.select(idx), ess, True
 
     def mean_of_resampled_particles(self, particles):
         """
-        calculate the mean of the resampled particles per event_batch for further use
-        :param particles: pandas df of resampled particles (all with the same weight)
+        calculate the mean of the particles per event_batch for further use
+        :param particles: ParticleSet (resampled or weighted)
         :return: mean of rotation matrix
         """
-        rotmats = np.zeros((len(particles), 3, 3))
-        for i in range(len(particles)):
-            # take the logarithm of the matrix
-            rotmats[i] = sp.logm(particles["Rotation"].as_matrix()[i])
-        liemean = sum(rotmats) / len(particles)
-        # exponent of matrix
-        mean = sp.expm(liemean)
+        # weighted mean of the logarithms of the matrices, mapped back with the exponent
+        liemean = np.average(
+            coordinate_transforms.rotmats2rotvecs(particles.rotations),
+            axis=0,
+            weights=particles.weights,
+        )
+        mean = coordinate_transforms.rotvecs2rotmats(liemean[np.newaxis])[0]
 
         return mean
 
@@ -468,8 +449,6 @@ class Tracker:
         """
         print("Events per batch: ", num_events_batch)
         print("Initialized particles: ", num_particles)
-        calibration = self.camera_intrinsics()
-        calibration_inv = np.linalg.inv(calibration)
 
         # load events
         events, num_events = helpers.load_events(
@@ -495,7 +474,38 @@ class Tracker:
             seed=None,
         )
         # initialize sensor tensor
-        sensortensor = self.initialize_sensortensor(128, 128)
+        sensortensor = self.initialize_sensortensor(sensor_height, sensor_width)
+
+        # initialize the intensities seen at t-t_c, before the first events
+        self.intensity_cache = self.initialize_intensity_cache(
+            first_matrix, sensor_height, sensor_width
+        )
+
+        # start the worker processes that evaluate the particles
+        if num_workers > 1:
+            self.evaluator = ParallelEvaluator(
+                intensity_map.image,
+                map_projection,
+                first_matrix.T,
+                self.likelihood_parameters,
+                intensity_interpolation,
+                max(num_particles, max_particles if adaptive_particles else 0),
+                num_events_batch,
+                num_workers,
+                particle_shards,
+            )
+
+        # initialize noise filters, sharing the event times of the sensor tensor
+        if filter_noise:
+            noise_filter = EventFilterChain(
+                [
+                    HotPixelFilter(sensor_height, sensor_width),
+                    RefractoryFilter(sensortensor[0]["time"], refractory_period),
+                    BackgroundActivityFilter(
+                        sensortensor[0]["time"], background_activity_dt
+                    ),
+                ]
+            )
 
         batch_nr = 0
         event_nr = 0
@@ -511,6 +521,9 @@ class Tracker:
         mean_of_rotations = pd.DataFrame(columns=["Rotation"])
         mean_of_rotations["Rotation"].astype(object)
 
+        # effective sample size and resampling decision per batch
+        filter_stats = pd.DataFrame(columns=["t", "ess", "resampled", "num_particles"])
+
         # append first matrix to file with poses
         all_rotations_test.append(first_matrix)
         starttime = time.time()
@@ -524,17 +537,35 @@ class Tracker:
             # calculate velocity in order to adapt motion update
             velocity = dt_mean / dt_batch
 
+            # drop noise events before the measurement update
+            if filter_noise:
+                events_batch = events_batch[
+                    noise_filter.apply(
+                        events_batch["t"].values,
+                        events_batch["x"].values,
+                        events_batch["y"].values,
+                        events_batch["pol"].values,
+                    )
+                ]
+
             # motion update for particles
             particles = self.motion_update(particles, velocity=velocity)
 
-            # measurement update for particles
-            self.measurement_update(
-                events_batch, particles, all_rotations, sensortensor, calibration_inv
-            )
-            self.normalize_particle_weights(particles)
+            if len(events_batch) > 0:
+                # measurement update for particles
+                self.measurement_update(
+                    events_batch,
+                    particles,
+                    all_rotations,
+                    sensortensor,
+                )
+                self.normalize_particle_weights(particles)
 
-            # resampling particles
-            particles = self.resampling(particles)
+                # resampling particles, when their weights have degenerated
+                particles, ess, resampled = self.resampling(particles)
+            else:
+                ess = resampling.effective_sample_size(particles.weights)
+                resampled = False
 
             event_nr += num_events_batch
             batch_nr += 1
@@ -544,25 +575,43 @@ class Tracker:
             all_rotations_test.append(new_rotation)
 
             all_rotations.loc[batch_nr] = {"t": t_batch, "Rotation": new_rotation}
+            filter_stats.loc[batch_nr] = {
+                "t": t_batch,
+                "ess": ess,
+                "resampled": int(resampled),
+                "num_particles": len(particles),
+            }
             # print("time: ", t_batch, "Rotations: ", helpers.rotmat2quaternion(new_rotation))
             dtime = time.time() - starttime
             print(
-                "batch: {}/{}\t time: {}s/{}s".format(
+                "batch: {}/{}\t time: {}s/{}s\t ESS: {:.1f}{}\t particles: {}".format(
                     batch_nr,
                     num_batches,
                     int(dtime),
                     int(dtime / batch_nr * num_batches),
+                    ess,
+                    " (resampled)" if resampled else "",
+                    len(particles),
                 )
             )
 
             mean_of_rotations.loc[batch_nr] = [new_rotation]
 
+        if self.evaluator is not None:
+            self.evaluator.close()
+            self.evaluator = None
+
         print(batch_nr)
         print(event_nr)
+        if filter_noise:
+            print(noise_filter.report())
 
         # convert rotation matrices to quaternions
         quaternions = helpers.rot2quaternions(all_rotations)
         datestring = helpers.quaternions2file(quaternions, directory="../output/poses/")
+        helpers.filter_stats2file(
+            filter_stats, datestring, directory="../output/poses/"
+        )
 
         # write quaternions to file, additional log file
         time_passed = round(time.time() - starttime)
@@ -582,6 +631,18 @@ class Tracker:
             sigma_init2=sigma_init2,
             sigma_init3=sigma_init3,
             sigma_likelihood=sigma_likelihood,
+            resampling_method=resampling_method,
+            resampling_threshold=resampling_threshold,
+            adaptive_particles=adaptive_particles,
+            min_particles=min_particles,
+            max_particles=max_particles,
+            kld_error=kld_error,
+            kld_confidence=kld_confidence,
+            kld_bin_size=kld_bin_size,
+            num_workers=num_workers,
+            particle_shards=particle_shards,
+            intensity_map_dtype=np.dtype(intensity_map_dtype).name,
+            intensity_interpolation=intensity_interpolation,
             contrast_threshold=contrast_threshold,
             seconds_passed=time_passed,
         )
@@ -16,6 +16,35 @@ import matplotlib
 matplotlib.use("TkAgg")
 
 
+def event_to_angles(event, rotations, calibration_inv):
+    """
+    Direction of an event in the world reference frame for each pose, as angles and as
+    map points of the tracker's map projection
+    :param event: event (Series with 'x' and 'y')
+    :param rotations: rotation matrices of the poses (Series)
+    :param calibration_inv: inverted camera calibration
+    :return: DataFrame with poses as rows and theta, phi, v, u as columns
+    """
+    bearing = np.dot(calibration_inv, np.array([event["x"], event["y"], 1.0]))
+    directions = np.array(
+        [
+            np.dot(np.dot(track.first_matrix.T, rotation), bearing)
+            for rotation in rotations
+        ]
+    ).T
+    v, u = track.map_projection.pixels(directions)
+    return pd.DataFrame(
+        {
+            "theta": np.arctan2(directions[0], directions[2]),
+            "phi": np.arctan2(
+                directions[1], np.sqrt(directions[0] ** 2 + directions[2] ** 2)
+            ),
+            "v": v,
+            "u": u,
+        }
+    )
+
+
 def compare_trajectories(df_groundtruth, **kwargs):
     """
     Generate a plot where the trajectory of the ground truth and the estimated poses is visible in different colours in 3D
@@ -126,12 +155,11 @@ def compare_trajectories_2d(fourevents, poses_ours, poses_gt, intensity_map):
     angles = []
     mappoints = []
     for i in range(5):
-        angle = tracker.event_and_particles_to_angles(
-            fourevents.loc[i], poses_converted, calibration_inv
+        angle = event_to_angles(
+            fourevents.loc[i], poses_converted["Rotation"], calibration_inv
         )
-        angles.append(angle.copy())
-        mappoint = tracker.angles2map_df(angle)
-        mappoints.append(mappoint.copy())
+        angles.append(angle)
+        mappoints.append(angle)
 
     plt.figure(1)
     plt.plot(angles[0]["theta"], angles[0]["phi"], "b.", label="0")
@@ -156,12 +184,11 @@ def compare_trajectories_2d(fourevents, poses_ours, poses_gt, intensity_map):
     angles = []
     mappoints = []
     for i in range(5):
-        angle = tracker.event_and_particles_to_angles(
-            fourevents.loc[i], poses_converted_ours, calibration_inv
+        angle = event_to_angles(
+            fourevents.loc[i], poses_converted_ours["Rotation"], calibration_inv
         )
-        angles.append(angle.copy())
-        mappoint = tracker.angles2map_df(angle)
-        mappoints.append(mappoint.copy())
+        angles.append(angle)
+        mappoints.append(angle)
 
     plt.scatter(mappoints[4]["u"], mappoints[4]["v"], color="y", s=2, label="tracker")
 
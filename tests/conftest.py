@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.linalg as sp
+
+import sample.helpers.datasets as datasets
+from sample.mosaicing.engine import MosaicEngine
+
+SENSOR_HEIGHT = 16
+SENSOR_WIDTH = 16
+OUTPUT_HEIGHT = 64
+OUTPUT_WIDTH = 128
+NUM_EVENTS = 20000
+NUM_EVENTS_BATCH = 1000
+CONTRAST_THRESHOLD = 0.45
+VAR_R = 0.17 ** 2
+
+
+class Recording:
+    """
+    Random events of a small sensor rotating about its y axis, with the calibration
+    and poses in the layout of the datasets
+    """
+
+    def __init__(self, seed=0):
+        rng = np.random.default_rng(seed)
+        self.t = np.sort(rng.random(NUM_EVENTS))
+        self.x = rng.integers(0, SENSOR_WIDTH, NUM_EVENTS)
+        self.y = rng.integers(0, SENSOR_HEIGHT, NUM_EVENTS)
+        self.pol = rng.integers(0, 2, NUM_EVENTS).astype(float)
+
+        generator = np.array([[0.0, 0.0, 1.0], [0.0, 0.0, 0.0], [-1.0, 0.0, 0.0]])
+        self.poses_t = pd.Series(np.linspace(0.0, 1.01, 50))
+        self.rotmats_dict = {
+            pose_t: sp.expm(0.5 * pose_t * generator) for pose_t in self.poses_t
+        }
+
+        # calibration file order: index x * sensor_height + y
+        x, y = np.meshgrid(
+            np.arange(SENSOR_WIDTH), np.arange(SENSOR_HEIGHT), indexing="ij"
+        )
+        self.undist_pix_calibrated = (
+            np.column_stack((x.ravel(), y.ravel())) - SENSOR_WIDTH / 2
+        ) / 20.0
+        self.bearings = datasets.bearing_table(
+            self.undist_pix_calibrated, SENSOR_HEIGHT, SENSOR_WIDTH
+        )
+
+    def events(self, stop=None):
+        return self.t[:stop], self.x[:stop], self.y[:stop], self.pol[:stop]
+
+    def engine(self, **settings):
+        """
+        :param settings: settings of the engine, on top of the ones of the recording
+        :return: configured MosaicEngine
+        """
+        settings.setdefault("output_height", OUTPUT_HEIGHT)
+        settings.setdefault("output_width", OUTPUT_WIDTH)
+        settings.setdefault("num_events_batch", NUM_EVENTS_BATCH)
+        return MosaicEngine().configure(
+            SENSOR_HEIGHT,
+            SENSOR_WIDTH,
+            self.undist_pix_calibrated,
+            CONTRAST_THRESHOLD,
+            VAR_R,
+            self.poses_t,
+            self.rotmats_dict,
+            **settings
+        )
+
+
+@pytest.fixture
+def recording():
+    return Recording()
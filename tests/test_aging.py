@@ -0,0 +1,83 @@
+import numpy as np
+
+from sample.mosaicing.aging import CovarianceAging
+
+HEIGHT = 6
+WIDTH = 9
+PROCESS_NOISE = 0.5
+
+
+def initial_covariance(variance=1.0):
+    return {
+        "xx": np.full((HEIGHT, WIDTH), variance),
+        "xy": np.zeros((HEIGHT, WIDTH)),
+        "yx": np.zeros((HEIGHT, WIDTH)),
+        "yy": np.full((HEIGHT, WIDTH), 2 * variance),
+    }
+
+
+def random_batches(num_batches=20, num_events=8, seed=0):
+    rng = np.random.default_rng(seed)
+    for k in range(num_batches):
+        yield (
+            0.1 * (k + 1),
+            rng.integers(0, HEIGHT, num_events),
+            rng.integers(0, WIDTH, num_events),
+        )
+
+
+def test_lazy_aging_matches_inflation_of_the_whole_map():
+    map_time = np.full((HEIGHT, WIDTH), np.nan)
+    aging = CovarianceAging(map_time, PROCESS_NOISE)
+    grad_map_covar = initial_covariance()
+
+    # inflate every pixel observed so far at each batch
+    grad_map_covar_eager = initial_covariance()
+    observed = np.zeros((HEIGHT, WIDTH), dtype=bool)
+    t_previous = 0.0
+    for t, ir, ic in random_batches():
+        for key in ["xx", "yy"]:
+            grad_map_covar_eager[key][observed] += PROCESS_NOISE * (t - t_previous)
+        observed[ir, ic] = True
+        t_previous = t
+        ir_aged, ic_aged = aging.age(grad_map_covar, ir, ic, t)
+        assert len(ir_aged) == len(np.unique(ir * WIDTH + ic))
+
+    t_export = 2.5
+    for key in ["xx", "yy"]:
+        grad_map_covar_eager[key][observed] += PROCESS_NOISE * (t_export - t_previous)
+    exported = aging.aged(grad_map_covar, t_export)
+    for key in grad_map_covar_eager:
+        np.testing.assert_allclose(exported[key], grad_map_covar_eager[key])
+
+    # the export does not modify the map state
+    assert np.nanmax(map_time) == t_previous
+    assert np.all(grad_map_covar["xx"][observed] < exported["xx"][observed])
+    np.testing.assert_array_equal(grad_map_covar["xx"][~observed], 1.0)
+
+
+def test_max_variance():
+    map_time = np.zeros((HEIGHT, WIDTH))
+    aging = CovarianceAging(map_time, PROCESS_NOISE, max_variance=1.5)
+    grad_map_covar = initial_covariance()
+
+    aging.age(grad_map_covar, np.array([0, 1]), np.array([0, 2]), 0.4)
+    np.testing.assert_allclose(grad_map_covar["xx"][[0, 1], [0, 2]], 1.2)
+    # inflated up to the bound, a larger variance is never shrunk
+    exported = aging.aged(grad_map_covar, 10.0)
+    np.testing.assert_allclose(exported["xx"], 1.5)
+    np.testing.assert_allclose(exported["yy"], 2.0)
+
+
+def test_engine_exports_aged_covariance(recording):
+    engine = recording.engine(process_noise=0.1)
+    engine.run(*recording.events())
+
+    observed = ~np.isnan(engine.aging.map_time)
+    assert np.any(observed)
+    assert np.nanmax(engine.aging.map_time) == engine.t_last
+    assert np.nanmin(engine.aging.map_time) < engine.t_last
+    grad_map_covar = engine.snapshot()["grad_map_covar"]
+    expected = engine.aging.aged(engine.grad_map_covar, engine.t_last)
+    for key in expected:
+        np.testing.assert_array_equal(grad_map_covar[key], expected[key])
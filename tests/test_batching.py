@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from sample.mosaicing.batching import AdaptiveBatcher, trajectory_angles
+
+
+def rotation_z(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+
+
+def recording(num_events=12345, num_poses=50):
+    t = np.linspace(0.0, 1.0, num_events)
+    poses_t = pd.Series(np.linspace(0.0, 1.0, num_poses))
+    rotmats_dict = {pose_t: rotation_z(0.5 * np.sin(4 * pose_t)) for pose_t in poses_t}
+    return t, poses_t, rotmats_dict
+
+
+def run_to_end(batcher, num_events):
+    """
+    Same loop as MosaicEngine.run
+    :return: sizes of the batches
+    """
+    iEv = 0
+    sizes = []
+    while True:
+        size = batcher.next_size(iEv)
+        if iEv + size > num_events or size == 0:
+            break
+        batcher.record(iEv, size)
+        sizes.append(size)
+        iEv += size
+    return sizes
+
+
+def test_batcher_runs_to_end_of_recording():
+    t, poses_t, rotmats_dict = recording()
+    batcher = AdaptiveBatcher(
+        t,
+        poses_t,
+        rotmats_dict,
+        1000,
+        min_batch=100,
+        max_batch=2000,
+        target_angle=0.01,
+        latency_budget=1.0,
+    )
+    sizes = run_to_end(batcher, len(t))
+    assert sum(sizes) == len(t)
+    assert batcher.next_size(len(t)) == 0
+
+
+def test_batcher_fixed_size_runs_to_end_of_recording():
+    t, poses_t, rotmats_dict = recording()
+    batcher = AdaptiveBatcher(t, poses_t, rotmats_dict, 1000)
+    sizes = run_to_end(batcher, len(t))
+    assert sizes == [1000] * 12 + [345]
+
+
+def test_trajectory_angles_without_rotation():
+    poses_t = pd.Series(np.linspace(0.0, 1.0, 20))
+    # Rounding puts the trace of the relative rotations slightly above 3
+    rotmats_dict = {pose_t: rotation_z(1e-9) * (1 + 1e-15) for pose_t in poses_t}
+    angles = trajectory_angles(poses_t, rotmats_dict)
+    assert np.all(np.isfinite(angles))
+    np.testing.assert_allclose(angles, 0.0, atol=1e-6)
@@ -0,0 +1,31 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import pandas as pd
+
+from sample.mosaicing.cli import save_results
+
+
+def test_save_results_exports_batches(recording, tmp_path):
+    engine = recording.engine(adaptive_batching=True)
+    engine.run(*recording.events())
+    engine.close()
+
+    save_results(engine, str(tmp_path), engine.integrate())
+
+    batches = pd.read_csv(str(tmp_path / "batches.csv"))
+    assert list(batches.columns) == ["iEv", "size", "duration", "angle", "elapsed"]
+    assert len(batches) == len(engine.batcher.history)
+    assert batches["size"].sum() == engine.iEv
+    assert (tmp_path / "reconstructed_log.png").exists()
+
+
+def test_save_results_without_adaptive_batching(recording, tmp_path):
+    engine = recording.engine()
+    engine.run(*recording.events(5000))
+    engine.close()
+
+    save_results(engine, str(tmp_path), engine.integrate())
+
+    assert not (tmp_path / "batches.csv").exists()
@@ -0,0 +1,61 @@
+import numpy as np
+
+from sample.mosaicing.convergence import ConvergenceMask
+
+
+def covariance_maps(trace):
+    return {
+        "xx": 0.5 * trace,
+        "xy": np.zeros_like(trace),
+        "yx": np.zeros_like(trace),
+        "yy": 0.5 * trace,
+    }
+
+
+def test_mask_follows_the_updated_pixels():
+    covar = covariance_maps(np.ones((4, 6)))
+    covar["xx"][1, 2] = covar["yy"][1, 2] = 0.01
+    mask = ConvergenceMask(covar, threshold=0.05)
+    assert mask.frozen[1, 2] and mask.num_pixels_frozen() == 1
+
+    # only the updated pixels are re-evaluated
+    covar["xx"][3, 4] = covar["yy"][3, 4] = 0.01
+    covar["xx"][1, 2] = 1.0
+    mask.update(covar, np.array([1]), np.array([2]))
+    assert not mask.frozen[1, 2]
+    assert not mask.frozen[3, 4]
+    mask.update(covar, np.array([3]), np.array([4]))
+    assert mask.frozen[3, 4] and mask.num_pixels_frozen() == 1
+
+
+def test_cull_and_counters():
+    covar = covariance_maps(np.ones((4, 6)))
+    covar["xx"][3, 4] = covar["yy"][3, 4] = 0.0
+    mask = ConvergenceMask(covar, threshold=0.05)
+
+    # map points are (column, row), out of the map clipped to the border
+    pm = np.array([[4.5, 0.2, 4.9, 7.0], [3.2, 0.0, 3.99, 9.0]])
+    np.testing.assert_array_equal(mask.cull(pm), [False, True, False, True])
+    assert mask.num_events_seen == 4
+    assert mask.num_events_culled == 2
+    assert "2/4 (50.0%)" in mask.report()
+
+
+def test_engine_freezing(recording):
+    engine = recording.engine()
+    engine.run(*recording.events())
+
+    # below every trace nothing is frozen and the map is unchanged
+    thawed = recording.engine(freeze_converged=True, freeze_threshold=0.0)
+    thawed.run(*recording.events())
+    assert thawed.convergence.num_events_seen > 0
+    assert thawed.convergence.num_events_culled == 0
+    for key in ["x", "y"]:
+        np.testing.assert_array_equal(thawed.grad_map[key], engine.grad_map[key])
+
+    # above the initial trace every event is culled
+    frozen = recording.engine(freeze_converged=True, freeze_threshold=1e9)
+    frozen.run(*recording.events())
+    assert frozen.convergence.num_events_seen > 0
+    assert frozen.convergence.num_events_culled == frozen.convergence.num_events_seen
+    np.testing.assert_array_equal(frozen.grad_map["x"], 0.0)
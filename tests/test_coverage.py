@@ -0,0 +1,78 @@
+import numpy as np
+
+import sample.helpers.integration_methods as integration_methods
+from sample.mosaicing.coverage import CoverageBounds
+
+
+def covariance_maps(shape, grad_initial_variance):
+    return {
+        "xx": np.full(shape, float(grad_initial_variance)),
+        "yy": np.full(shape, float(grad_initial_variance)),
+    }
+
+
+def observed_gradients(shape, rows, cols, seed=0):
+    """
+    :return: random gradients inside the box rows x cols, zero outside
+    """
+    rng = np.random.default_rng(seed)
+    grad_x = np.zeros(shape)
+    grad_y = np.zeros(shape)
+    grad_x[rows, cols] = rng.normal(size=grad_x[rows, cols].shape)
+    grad_y[rows, cols] = rng.normal(size=grad_y[rows, cols].shape)
+    return grad_x, grad_y
+
+
+def test_coverage_bounds_grow_with_updates():
+    coverage = CoverageBounds(covariance_maps((64, 128), 10), 10)
+    assert coverage.empty()
+    assert coverage.crop() is None
+
+    coverage.update(np.array([10, 20]), np.array([30, 40]))
+    coverage.update(np.array([15]), np.array([50]))
+    assert coverage.crop() == (slice(10, 21), slice(30, 51))
+    assert coverage.crop(padding=4) == (slice(6, 25), slice(26, 55))
+    assert coverage.crop(level=1) == (slice(5, 11), slice(15, 26))
+    assert coverage.fraction() == 11 * 21 / (64.0 * 128)
+
+
+def test_coverage_bounds_from_resumed_covariance():
+    grad_map_covar = covariance_maps((64, 128), 10)
+    grad_map_covar["xx"][5:9, 100:110] = 0.1
+    coverage = CoverageBounds(grad_map_covar, 10)
+    assert coverage.crop() == (slice(5, 9), slice(100, 110))
+
+
+def test_crop_integrates_only_the_box():
+    shape = (64, 128)
+    crop = (slice(16, 40), slice(32, 80))
+    grad_x, grad_y = observed_gradients(shape, slice(20, 36), slice(40, 72))
+
+    rec_image = integration_methods.integrate_map(
+        grad_x, grad_y, method="poisson_neumann", crop=crop
+    )
+    expected = integration_methods.poisson_neumann(grad_x[crop], grad_y[crop])
+    np.testing.assert_allclose(rec_image[crop], expected - np.mean(expected))
+    outside = np.ones(shape, dtype=bool)
+    outside[crop] = False
+    assert np.all(rec_image[outside] == 0)
+
+
+def test_crop_is_not_applied_along_periodic_axes():
+    shape = (64, 128)
+    crop = (slice(16, 40), slice(32, 80))
+    grad_x, grad_y = observed_gradients(shape, slice(20, 36), slice(40, 72))
+
+    for method in ["frankotchellappa", "frankotchellappa_rfft"]:
+        np.testing.assert_allclose(
+            integration_methods.integrate_map(grad_x, grad_y, method, crop=crop),
+            integration_methods.integrate_map(grad_x, grad_y, method),
+        )
+
+    # Periodic in azimuth only: the whole width of the rows of the box
+    rec_image = integration_methods.integrate_map(
+        grad_x, grad_y, "poisson_periodic_azimuth", crop=crop
+    )
+    rows = crop[0]
+    expected = integration_methods.poisson_periodic_azimuth(grad_x[rows], grad_y[rows])
+    np.testing.assert_allclose(rec_image[rows], expected - np.mean(expected))
@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+from scipy import io
+
+import sample.helpers.datasets as datasets
+import sample.helpers.projections as projections
+from sample.mosaicing.measurements import batch_measurements
+
+SENSOR_HEIGHT = 6
+SENSOR_WIDTH = 8
+
+
+def calibration_table():
+    # calibration file order: index x * sensor_height + y
+    x, y = np.meshgrid(np.arange(SENSOR_WIDTH), np.arange(SENSOR_HEIGHT), indexing="ij")
+    return np.column_stack(((x.ravel() - 4.0) / 10, (y.ravel() - 3.0) / 10))
+
+
+def profile():
+    return {
+        "sensor_height": SENSOR_HEIGHT,
+        "sensor_width": SENSOR_WIDTH,
+        "calibration_file": "calibration.mat",
+    }
+
+
+def write_calibration(calibration_dir):
+    Kint = np.array([[100.0, 0.0, 4.0], [0.0, 100.0, 3.0], [0.0, 0.0, 1.0]])
+    io.savemat(
+        os.path.join(calibration_dir, "calibration.mat"),
+        {"undist_pix_calibrated": calibration_table(), "Kint": Kint},
+    )
+    return Kint
+
+
+def test_bearing_table_matches_calibration_order():
+    undist = calibration_table()
+    bearings = datasets.bearing_table(undist, SENSOR_HEIGHT, SENSOR_WIDTH)
+
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, SENSOR_WIDTH, 100)
+    y = rng.integers(0, SENSOR_HEIGHT, 100)
+    expected = np.ones((100, 3))
+    expected[:, :2] = undist[x * SENSOR_HEIGHT + y]
+    np.testing.assert_array_equal(bearings[y, x], expected)
+
+
+def test_sensor_tables_cached_and_rebuilt(tmp_path):
+    Kint = write_calibration(str(tmp_path))
+
+    tables = datasets.sensor_tables(profile(), str(tmp_path))
+    assert sorted(tables) == sorted(datasets.TABLE_KEYS)
+    assert tables["bearings"].shape == (SENSOR_HEIGHT, SENSOR_WIDTH, 3)
+    np.testing.assert_allclose(tables["Kint_inv"], np.linalg.inv(Kint))
+    np.testing.assert_allclose(
+        tables["pinhole_bearings"][2, 5], np.linalg.inv(Kint) @ [5.0, 2.0, 1.0]
+    )
+    filename_cache = os.path.join(str(tmp_path), "cache", "calibration_tables.npz")
+    assert os.path.exists(filename_cache)
+
+    cached = datasets.sensor_tables(profile(), str(tmp_path))
+    for key in datasets.TABLE_KEYS:
+        np.testing.assert_array_equal(cached[key], tables[key])
+
+    # a cache of an older layout is rebuilt
+    np.savez(filename_cache, bearings=np.zeros((3, 3)))
+    rebuilt = datasets.sensor_tables(profile(), str(tmp_path))
+    np.testing.assert_array_equal(rebuilt["bearings"], tables["bearings"])
+
+
+def test_batch_measurements_with_bearing_table():
+    bearings = datasets.bearing_table(calibration_table(), SENSOR_HEIGHT, SENSOR_WIDTH)
+    sae = np.full((SENSOR_HEIGHT, SENSOR_WIDTH), -1e-6)
+    rotations = np.full((SENSOR_HEIGHT, SENSOR_WIDTH, 3, 3), np.nan)
+    x = np.array([1, 2, 1, 2])
+    y = np.array([0, 5, 0, 5])
+    t = np.array([0.1, 0.2, 0.3, 0.4])
+    pol = np.array([1.0, -1.0, 1.0, 1.0])
+
+    # the first events only set the event maps
+    assert (
+        batch_measurements(
+            t[:2],
+            x[:2],
+            y[:2],
+            pol[:2],
+            np.eye(3),
+            np.eye(3),
+            sae,
+            rotations,
+            bearings,
+            64,
+            32,
+            0.0,
+        )
+        is None
+    )
+    measurements = batch_measurements(
+        t[2:],
+        x[2:],
+        y[2:],
+        pol[2:],
+        np.eye(3),
+        np.eye(3),
+        sae,
+        rotations,
+        bearings,
+        64,
+        32,
+        0.0,
+    )
+    np.testing.assert_allclose(measurements["tc"], [0.2, 0.2])
+    expected = np.ones((2, 3))
+    expected[:, :2] = calibration_table()[x[2:] * SENSOR_HEIGHT + y[2:]]
+    projection = projections.EquirectangularProjection(64, 32)
+    np.testing.assert_allclose(measurements["pm"], projection.project(expected.T))
+    np.testing.assert_array_equal(sae[y[2:], x[2:]], t[2:])
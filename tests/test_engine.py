@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        dict(pipelined=True, plot_events_animation=True),
+        dict(pipelined=True, plot_reconstruction_animation=True),
+        dict(num_time_chunks=2, plot_events_pm_animation=True),
+        dict(pipelined=True, live_integration=True),
+    ],
+)
+def test_previews_rejected_when_not_batch_by_batch(recording, settings, tmp_path):
+    with pytest.raises(ValueError):
+        recording.engine(animation_dir=str(tmp_path), **settings)
+
+
+def test_pipelined_matches_batch_by_batch(recording):
+    engine = recording.engine()
+    engine.run(*recording.events())
+    engine.close()
+
+    pipelined = recording.engine(pipelined=True)
+    pipelined.run(*recording.events())
+    pipelined.close()
+
+    assert pipelined.iEv == engine.iEv
+    for key in ["x", "y"]:
+        np.testing.assert_allclose(pipelined.grad_map[key], engine.grad_map[key])
+
+
+@pytest.mark.parametrize(
+    "settings", [dict(state_dir=True), dict(resume=True), dict(extend=True)]
+)
+def test_configurations_rejected_with_persistent_state(recording, settings, tmp_path):
+    if settings.get("state_dir"):
+        settings["state_dir"] = str(tmp_path)
+    configurations = [dict(measurement_criterion="contrast", var_R=0.1 ** 2)]
+    with pytest.raises(ValueError):
+        recording.engine(
+            configurations=configurations, recording="synthetic", **settings
+        )
+
+
+def test_events_counted_once_processed(recording):
+    engine = recording.engine()
+    t, x, y, pol = recording.events()
+    num_batches = engine.iBatch
+
+    # the first batch only fills the event map, its events are consumed
+    assert engine.process_batch(t[:1000], x[:1000], y[:1000], pol[:1000]) is None
+    assert engine.iEv == 1000
+    assert engine.iBatch == num_batches
+    assert engine.process_batch(
+        t[1000:2000], x[1000:2000], y[1000:2000], pol[1000:2000]
+    )
+    assert engine.iEv == 2000
+    assert engine.iBatch == num_batches + 1
+
+    # events after the last pose are not processed
+    late = t[1000:2000] + 10.0
+    assert (
+        engine.process_batch(late, x[1000:2000], y[1000:2000], pol[1000:2000]) is None
+    )
+    assert engine.iEv == 2000
+    assert engine.iBatch == num_batches + 1
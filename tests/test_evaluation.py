@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+import sample.helpers.coordinate_transforms as coordinate_transforms
+import sample.helpers.projections as projections
+import sample.tracking.evaluation as evaluation
+from sample.tracking.particles import ParticleSet
+
+LIKELIHOOD_PARAMETERS = {"mu": 0.45, "sigma": 0.17, "k_e": 1e-3, "flipped": True}
+
+
+def random_problem(num_particles=20, num_events=50, seed=0):
+    rng = np.random.default_rng(seed)
+    rotations = coordinate_transforms.rotvecs2rotmats(
+        rng.normal(0.0, 0.05, (num_particles, 3))
+    )
+    bearings = np.column_stack(
+        (rng.uniform(-0.4, 0.4, (num_events, 2)), np.ones(num_events))
+    )
+    pol = rng.choice([-1.0, 1.0], num_events)
+    logintensity_ttc = rng.normal(0.0, 0.5, num_events)
+    intensity_map = rng.normal(0.0, 1.0, (64, 128))
+    return rotations, bearings, pol, logintensity_ttc, intensity_map
+
+
+def reference_likelihoods(
+    rotations, rotation_world, bearings, pol, logintensity_ttc, intensity_map
+):
+    """
+    Event by event and particle by particle, as the loop of the original tracker
+    """
+    projection = projections.EquirectangularProjection(128, 64)
+    likelihood_sum = np.zeros(len(rotations))
+    for n, rotation in enumerate(rotations):
+        for b, bearing in enumerate(bearings):
+            pm = projection.project((rotation_world @ rotation @ bearing)[:, None])
+            ir = int(np.floor(pm[1, 0] - 1))
+            ic = int(np.floor(pm[0, 0] - 1)) % 128
+            z = intensity_map[min(max(ir, 0), 63), ic] - logintensity_ttc[b]
+            likelihood_sum[n] += evaluation.event_likelihood(
+                z, pol[b], **LIKELIHOOD_PARAMETERS
+            )
+    return likelihood_sum
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 50, 200])
+def test_batched_likelihood_matches_event_loop(chunk):
+    rotations, bearings, pol, logintensity_ttc, intensity_map = random_problem()
+    rotation_world = coordinate_transforms.rotvecs2rotmats(np.array([[0.0, 0.3, 0.0]]))[
+        0
+    ]
+    particles = ParticleSet(rotations)
+    evaluation.accumulate_likelihoods(
+        particles,
+        rotation_world,
+        bearings,
+        pol,
+        logintensity_ttc,
+        intensity_map,
+        projections.EquirectangularProjection(128, 64),
+        chunk,
+        LIKELIHOOD_PARAMETERS,
+    )
+    np.testing.assert_allclose(
+        particles.likelihood_sum,
+        reference_likelihoods(
+            rotations, rotation_world, bearings, pol, logintensity_ttc, intensity_map
+        ),
+        rtol=1e-12,
+    )
+
+
+def test_likelihood_sum_is_reset():
+    rotations, bearings, pol, logintensity_ttc, intensity_map = random_problem()
+    particles = ParticleSet(rotations)
+    arguments = (
+        np.eye(3),
+        bearings,
+        pol,
+        logintensity_ttc,
+        intensity_map,
+        projections.EquirectangularProjection(128, 64),
+        16,
+        LIKELIHOOD_PARAMETERS,
+    )
+    evaluation.accumulate_likelihoods(particles, *arguments)
+    first = particles.likelihood_sum.copy()
+    evaluation.accumulate_likelihoods(particles, *arguments)
+    np.testing.assert_array_equal(particles.likelihood_sum, first)
+
+
+def test_event_likelihood_sign_convention():
+    z = np.array([0.45, -0.45, 0.45])
+    pol = np.array([-1.0, -1.0, 1.0])
+    flipped = evaluation.event_likelihood(z, pol, 0.45, 0.17, 1e-3, True)
+    peak = 1e-3 + 1 / (0.17 * np.sqrt(2 * np.pi))
+    np.testing.assert_allclose(flipped, [peak, 1e-3, 1e-3])
+    unflipped = evaluation.event_likelihood(z, pol, 0.45, 0.17, 1e-3, False)
+    np.testing.assert_allclose(unflipped, [1e-3, peak, peak])
+
+
+def test_cached_intensities_match_event_by_event_updates():
+    rng = np.random.default_rng(3)
+    intensity_cache = rng.normal(0.0, 1.0, (4, 5))
+    reference_cache = intensity_cache.copy()
+    for _ in range(3):
+        # few pixels, so that they repeat within and across batches
+        x = rng.integers(0, 2, 12)
+        y = rng.integers(0, 2, 12)
+        # the intensity seen is a function of the pixel for a given pose
+        logintensity = rng.normal(0.0, 1.0, (4, 5))[y, x]
+
+        expected = np.empty(12)
+        for b in range(12):
+            expected[b] = reference_cache[y[b], x[b]]
+            reference_cache[y[b], x[b]] = logintensity[b]
+
+        logintensity_ttc = evaluation.swap_cached_intensities(
+            intensity_cache, x, y, logintensity
+        )
+        np.testing.assert_array_equal(logintensity_ttc, expected)
+        np.testing.assert_array_equal(intensity_cache, reference_cache)
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from sample.helpers.event_filters import (
+    BackgroundActivityFilter,
+    EventFilterChain,
+    HotPixelFilter,
+    RefractoryFilter,
+    latest_previous_time,
+)
+from sample.mosaicing.map_state import UNSET_TIME
+
+
+def unset_sae(unset_time):
+    return np.full((4, 5), -np.inf if unset_time is None else unset_time)
+
+
+@pytest.mark.parametrize("unset_time", [None, UNSET_TIME])
+def test_refractory_passes_first_event_of_each_pixel(unset_time):
+    refractory = RefractoryFilter(unset_sae(unset_time), 1e-3, unset_time=unset_time)
+    t = np.array([0.0, 1e-4, 2e-4, 5e-4, 2e-3])
+    x = np.array([0, 1, 0, 1, 0])
+    y = np.array([0, 2, 0, 2, 0])
+    keep = refractory.apply(t, x, y, np.ones(5))
+    np.testing.assert_array_equal(keep, [True, True, False, False, True])
+
+
+@pytest.mark.parametrize("unset_time", [None, UNSET_TIME])
+def test_background_activity_needs_a_neighbour_that_fired(unset_time):
+    sae = unset_sae(unset_time)
+    background_activity = BackgroundActivityFilter(sae, 1e-2, unset_time=unset_time)
+    t = np.array([1e-3, 2e-3, 3e-3])
+    x = np.array([2, 3, 0])
+    y = np.array([1, 1, 3])
+    keep = background_activity.apply(t, x, y, np.ones(3))
+    np.testing.assert_array_equal(keep, [False, True, False])
+
+    # support from the state of the previous batches
+    sae[2, 1] = 0.5
+    keep = background_activity.apply(
+        np.array([0.505]), np.array([0]), np.array([3]), np.ones(1)
+    )
+    np.testing.assert_array_equal(keep, [True])
+
+
+def test_latest_previous_time():
+    sae = unset_sae(UNSET_TIME)
+    sae[0, 0] = 0.25
+    t = np.array([1.0, 2.0, 3.0])
+    x = np.array([0, 1, 1])
+    y = np.array([0, 0, 0])
+    np.testing.assert_array_equal(
+        latest_previous_time(sae, x, y, t, unset_time=UNSET_TIME),
+        [0.25, -np.inf, 2.0],
+    )
+    # left neighbours, outside of the sensor for the first event
+    np.testing.assert_array_equal(
+        latest_previous_time(sae, x, y, t, dx=-1, unset_time=UNSET_TIME),
+        [-np.inf, 1.0, 1.0],
+    )
+
+
+def test_hot_pixel_mask_learned_from_the_first_events():
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 5, 1000)
+    y = rng.integers(0, 4, 1000)
+    x[::4] = 3
+    y[::4] = 2
+    hot_pixel = HotPixelFilter(4, 5, num_learning_events=600, num_std=3.0)
+
+    # events pass while learning
+    assert hot_pixel.apply(np.zeros(500), x[:500], y[:500], None).all()
+    assert hot_pixel.mask is None
+    assert hot_pixel.apply(np.zeros(500), x[500:], y[500:], None).all()
+    assert hot_pixel.mask[2, 3] and np.sum(hot_pixel.mask) == 1
+
+    keep = hot_pixel.apply(np.zeros(1000), x, y, None)
+    np.testing.assert_array_equal(keep, (x != 3) | (y != 2))
+
+
+def test_chain_applies_filters_in_order_and_counts():
+    mask = np.zeros((4, 5), dtype=bool)
+    mask[0, 0] = True
+    chain = EventFilterChain(
+        [
+            HotPixelFilter(4, 5, mask=mask),
+            RefractoryFilter(unset_sae(None), 1e-3),
+        ]
+    )
+    t = [0.0, 1e-4, 2e-4, 3e-3]
+    x = [0, 1, 1, 1]
+    y = [0, 2, 2, 2]
+    keep = chain.apply(t, x, y, [1.0, 1.0, 1.0, 1.0])
+    np.testing.assert_array_equal(keep, [False, True, False, True])
+    # the refractory filter only sees the events kept by the hot-pixel filter
+    assert chain.num_dropped == {"hot_pixel": 1, "refractory": 1}
+    assert chain.num_events_seen == 4 and chain.num_events_kept == 2
+    assert chain.report() == (
+        "Noise filter kept 2/4 events (50.0%), dropped hot_pixel: 1, refractory: 1"
+    )
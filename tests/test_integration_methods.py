@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import sample.helpers.integration_methods as integration_methods
+
+
+def random_gradients(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=shape), rng.normal(size=shape)
+
+
+@pytest.mark.parametrize(
+    "shape", [(64, 128), (63, 127), (64, 127), (63, 128), (1024, 2048)]
+)
+def test_frankotchellappa_rfft_matches_frankotchellappa(shape):
+    grad_x, grad_y = random_gradients(shape)
+    expected = integration_methods.frankotchellappa(grad_x, grad_y)
+    np.testing.assert_allclose(
+        integration_methods.frankotchellappa_rfft(grad_x, grad_y),
+        expected,
+        rtol=0,
+        atol=1e-9 * np.max(np.abs(expected)),
+    )
+
+
+def test_frankotchellappa_rfft32_is_close_to_frankotchellappa():
+    grad_x, grad_y = random_gradients((64, 128))
+    expected = integration_methods.frankotchellappa(grad_x, grad_y)
+    np.testing.assert_allclose(
+        integration_methods.frankotchellappa_rfft32(grad_x, grad_y),
+        expected,
+        rtol=0,
+        atol=1e-4 * np.max(np.abs(expected)),
+    )
+
+
+def test_frankotchellappa_rfft_reuses_cached_weights():
+    integrator = integration_methods.FrankotChellappa(max_cached_shapes=2)
+    for shape in [(16, 32), (15, 31), (16, 32), (8, 8)]:
+        integrator(*random_gradients(shape))
+    assert list(integrator.cache) == [(16, 32), (8, 8)]
+
+
+def smooth_surface(shape):
+    """
+    :return: surface periodic in the columns with zero derivative at the first and
+             last rows, and its gradients (central differences, periodic in columns)
+    """
+    rows, cols = np.mgrid[0 : shape[0], 0 : shape[1]]
+    z = np.cos(np.pi * (rows + 0.5) / shape[0]) * (
+        1 + 0.5 * np.sin(2 * np.pi * cols / shape[1])
+    )
+    grad_x = 0.5 * (np.roll(z, -1, axis=1) - np.roll(z, 1, axis=1))
+    grad_y = np.gradient(z, axis=0)
+    return z, grad_x, grad_y
+
+
+@pytest.mark.parametrize("method", ["poisson_neumann", "poisson_periodic_azimuth"])
+def test_integration_recovers_smooth_surface(method):
+    z, grad_x, grad_y = smooth_surface((128, 256))
+    rec_image = integration_methods.integrate_map(grad_x, grad_y, method)
+    error = rec_image - (z - np.mean(z))
+    assert np.sqrt(np.mean(error ** 2)) < 0.02 * np.std(z)
+
+
+def test_poisson_dirichlet_recovers_zero_boundary_surface():
+    rows, cols = np.mgrid[0:64, 0:96]
+    z = np.sin(np.pi * (rows + 1) / 65) * np.sin(np.pi * (cols + 1) / 97)
+    padded = np.pad(z, 1)
+    grad_x = 0.5 * (padded[1:-1, 2:] - padded[1:-1, :-2])
+    grad_y = 0.5 * (padded[2:, 1:-1] - padded[:-2, 1:-1])
+    rec_image = integration_methods.poisson_dirichlet(grad_x, grad_y)
+    error = rec_image - np.min(rec_image) - (z - np.min(z))
+    assert np.max(np.abs(error)) < 0.02 * np.max(z)
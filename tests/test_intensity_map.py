@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pytest
+
+from sample.tracking.intensity_map import (
+    LazyIntensityMap,
+    bilinear_lookup,
+    nearest_lookup,
+)
+
+
+def ramp_map(height=4, width=6):
+    rows, cols = np.mgrid[0:height, 0:width]
+    return 10.0 * rows + cols
+
+
+def test_nearest_lookup_wraps_columns_and_clamps_rows():
+    image = ramp_map()
+    rows = np.array([0.0, 2.7, -3.0, 9.0, 1.5])
+    cols = np.array([0.0, 3.99, 1.2, 2.0, -0.5])
+    np.testing.assert_array_equal(
+        nearest_lookup(image, rows, cols), [0.0, 23.0, 1.0, 32.0, 15.0]
+    )
+
+    out = np.empty((1, 5))
+    assert nearest_lookup(image, rows[None], cols[None], out=out) is out
+    np.testing.assert_array_equal(out[0], [0.0, 23.0, 1.0, 32.0, 15.0])
+
+
+def test_bilinear_lookup():
+    image = ramp_map()
+    # at the pixel centers the lookup is exact
+    rows, cols = np.mgrid[0:4, 0:6] + 0.5
+    np.testing.assert_allclose(bilinear_lookup(image, rows, cols), image)
+    # a linear map is reproduced in between
+    np.testing.assert_allclose(
+        bilinear_lookup(image, np.array([1.25, 2.0]), np.array([2.0, 3.75])),
+        [7.5 + 1.5, 15.0 + 3.25],
+    )
+    # columns wrap around between the last and the first column
+    np.testing.assert_allclose(
+        bilinear_lookup(image, np.array([0.5]), np.array([0.0])), [2.5]
+    )
+    # rows are clamped at the poles
+    np.testing.assert_allclose(
+        bilinear_lookup(image, np.array([0.0, 4.0]), np.array([1.5, 1.5])),
+        [1.0, 31.0],
+    )
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_lazy_intensity_map(tmp_path, dtype):
+    filename = os.path.join(str(tmp_path), "intensity_map.npy")
+    image = np.random.default_rng(0).normal(0.0, 1.0, (8, 16))
+    np.save(filename, image)
+
+    lazy = LazyIntensityMap(filename, dtype=dtype)
+    assert lazy._image is None
+    assert lazy.shape == (8, 16)
+    assert isinstance(lazy.image, np.memmap)
+    assert lazy.image.dtype == dtype
+    np.testing.assert_array_equal(lazy.image, image.astype(dtype))
+
+    rows = np.array([0.2, 3.5, 7.9])
+    cols = np.array([15.5, 0.1, 8.0])
+    for interpolation, lookup in [
+        ("nearest", nearest_lookup),
+        ("bilinear", bilinear_lookup),
+    ]:
+        np.testing.assert_allclose(
+            lazy.lookup(rows, cols, interpolation),
+            lookup(image, rows, cols),
+            rtol=1e-6,
+        )
+
+    converted = os.path.join(str(tmp_path), "intensity_map.float32.npy")
+    assert os.path.exists(converted) == (dtype == np.float32)
+
+
+def test_converted_copy_rewritten_when_the_map_changes(tmp_path):
+    filename = os.path.join(str(tmp_path), "intensity_map.npy")
+    np.save(filename, np.zeros((4, 8)))
+    LazyIntensityMap(filename, dtype=np.float32).image
+    converted = os.path.join(str(tmp_path), "intensity_map.float32.npy")
+    os.utime(converted, (0, 0))
+
+    np.save(filename, np.ones((4, 8)))
+    np.testing.assert_array_equal(
+        LazyIntensityMap(filename, dtype=np.float32).image, 1.0
+    )
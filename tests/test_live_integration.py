@@ -0,0 +1,60 @@
+import numpy as np
+
+import sample.helpers.integration_methods as integration_methods
+from sample.mosaicing.live_integration import IncrementalIntegrator
+
+HEIGHT = 128
+WIDTH = 256
+
+
+def smooth_maps():
+    rows, cols = np.mgrid[0:HEIGHT, 0:WIDTH]
+    image = np.sin(cols / 15.0) * np.cos(rows / 11.0)
+    grad_map = {"x": np.gradient(image, axis=1), "y": np.gradient(image, axis=0)}
+    grad_map_covar = {
+        "xx": np.full((HEIGHT, WIDTH), 0.01),
+        "xy": np.zeros((HEIGHT, WIDTH)),
+        "yx": np.zeros((HEIGHT, WIDTH)),
+        "yy": np.full((HEIGHT, WIDTH), 0.01),
+    }
+    return grad_map, grad_map_covar
+
+
+def full_solve(grad_map):
+    rec_image = integration_methods.integrate_map(
+        grad_map["x"], grad_map["y"], method="poisson_neumann"
+    )
+    return rec_image - np.mean(rec_image)
+
+
+def test_box_refresh_matches_full_solve():
+    grad_map, grad_map_covar = smooth_maps()
+    integrator = IncrementalIntegrator(
+        grad_map, grad_map_covar, tile_size=32, padding=16, tolerance=1e-8
+    )
+    np.testing.assert_allclose(integrator.refresh(), full_solve(grad_map), atol=1e-9)
+
+    # local change of the gradients: a bump in one tile
+    rows, cols = np.mgrid[0:HEIGHT, 0:WIDTH]
+    bump = np.exp(-((cols - 80.0) ** 2 + (rows - 50.0) ** 2) / 20.0)
+    grad_map["x"] += np.gradient(bump, axis=1)
+    grad_map["y"] += np.gradient(bump, axis=0)
+    integrator.mark_dirty([50], [80])
+
+    rec_image = integrator.refresh()
+    assert integrator.num_full_solves == 1
+    assert integrator.num_box_solves == 1
+    np.testing.assert_allclose(rec_image, full_solve(grad_map), atol=1e-4)
+
+
+def test_large_change_falls_back_to_full_solve():
+    grad_map, grad_map_covar = smooth_maps()
+    integrator = IncrementalIntegrator(grad_map, grad_map_covar, tile_size=32)
+    integrator.refresh()
+
+    grad_map["x"] *= 2.0
+    grad_map["y"] *= 2.0
+    integrator.mark_all_dirty()
+    np.testing.assert_allclose(integrator.refresh(), full_solve(grad_map), atol=1e-9)
+    assert integrator.num_full_solves == 2
+    assert integrator.num_box_solves == 0
@@ -0,0 +1,109 @@
+import json
+import os
+
+import numpy as np
+
+from sample.mosaicing.map_state import MapState, UNSET_TIME, update_event_map
+
+
+def open_state(state_dir, recording="recording", **kwargs):
+    return MapState(str(state_dir), 8, 16, 4, 5, 10.0, recording, **kwargs)
+
+
+def test_checkpoint_and_resume(tmp_path):
+    state = open_state(tmp_path)
+    np.testing.assert_array_equal(state.grad_map_covar["xx"], 10.0)
+    np.testing.assert_array_equal(state.event_map_sae, UNSET_TIME)
+    state.anchor_rotation(np.eye(3))
+    state.grad_map["x"][2, 3] = 1.5
+    state.event_map_sae[1, 1] = 0.25
+    state.checkpoint(1000, 4)
+
+    # changes after the checkpoint are lost when resuming
+    state.grad_map["x"][2, 3] = -7.0
+    state.grad_map["y"][0, 0] = 3.0
+
+    resumed = open_state(tmp_path, resume=True)
+    assert resumed.cursor["iEv"] == 1000
+    assert resumed.cursor["iBatch"] == 4
+    assert resumed.grad_map["x"][2, 3] == 1.5
+    assert resumed.grad_map["y"][0, 0] == 0.0
+    assert resumed.event_map_sae[1, 1] == 0.25
+    np.testing.assert_array_equal(resumed.anchor_rotation(np.zeros((3, 3))), np.eye(3))
+
+
+def test_only_the_latest_checkpoint_is_kept(tmp_path):
+    state = open_state(tmp_path)
+    state.checkpoint(100, 2)
+    state.checkpoint(200, 3)
+    with open(os.path.join(str(tmp_path), "checkpoint.json")) as f:
+        cursor = json.load(f)
+    assert cursor["directory"] == "checkpoint_2"
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "checkpoint.json",
+        "checkpoint_2",
+        "live",
+    ]
+
+
+def test_extend_keeps_the_map_and_resets_the_event_map(tmp_path):
+    state = open_state(tmp_path)
+    state.grad_map["x"][2, 3] = 1.5
+    state.event_map_sae[1, 1] = 0.25
+    state.map_time[2, 3] = 0.5
+    state.checkpoint(1000, 4)
+
+    extended = open_state(tmp_path, recording="other", extend=True)
+    assert extended.cursor["iEv"] == 0
+    assert extended.cursor["recording"] == "other"
+    assert extended.grad_map["x"][2, 3] == 1.5
+    np.testing.assert_array_equal(extended.event_map_sae, UNSET_TIME)
+    assert np.all(np.isnan(extended.map_time))
+
+
+def test_without_checkpoint_resume_starts_from_scratch(tmp_path):
+    state = open_state(tmp_path, resume=True)
+    assert state.cursor["iEv"] == 0
+    np.testing.assert_array_equal(state.grad_map["x"], 0.0)
+
+
+def test_in_memory_state():
+    state = MapState(None, 8, 16, 4, 5, 10.0, "recording")
+    state.checkpoint(500, 2)
+    assert state.cursor["iEv"] == 500
+    assert state.latest_checkpoint() is None
+
+
+def test_update_event_map_repeated_pixels():
+    sae = np.full((4, 5), UNSET_TIME)
+    rotations = np.full((4, 5, 3, 3), np.nan)
+    rot = 2.0 * np.eye(3)
+    t_prev, rot_prev = update_event_map(
+        sae, rotations, np.array([1, 1, 2]), np.array([0, 0, 3]), [0.1, 0.2, 0.3], rot
+    )
+    np.testing.assert_array_equal(t_prev, UNSET_TIME)
+    assert np.all(np.isnan(rot_prev[[0, 2]]))
+    np.testing.assert_array_equal(rot_prev[1], rot)
+    assert sae[0, 1] == 0.2 and sae[3, 2] == 0.3
+
+
+def test_engine_resume_matches_uninterrupted_run(recording, tmp_path):
+    engine = recording.engine()
+    engine.run(*recording.events())
+    engine.close()
+
+    interrupted = recording.engine(
+        state_dir=str(tmp_path), recording="synthetic", checkpoint_every=3
+    )
+    interrupted.run(*recording.events(12000))
+    interrupted.close()
+
+    resumed = recording.engine(
+        state_dir=str(tmp_path), recording="synthetic", resume=True
+    )
+    assert resumed.iEv == 12000
+    resumed.run(*recording.events())
+    resumed.close()
+
+    for key in ["x", "y"]:
+        np.testing.assert_array_equal(resumed.grad_map[key], engine.grad_map[key])
@@ -0,0 +1,226 @@
+import numpy as np
+
+import sample.mosaicing.ekf as ekf
+import sample.helpers.coordinate_transforms as coordinate_transforms
+from sample.mosaicing.measurements import batch_measurements
+from sample.mosaicing.parallel import ShardedEKF, mosaic_time_chunks
+
+from conftest import CONTRAST_THRESHOLD, VAR_R
+
+EKF_PARAMETERS = {
+    "measurement_criterion": "contrast",
+    "contrast_threshold": CONTRAST_THRESHOLD,
+    "var_R": VAR_R,
+}
+
+
+def prior_maps(height, width, grad_initial_variance=10.0):
+    grad_map = {key: np.zeros((height, width)) for key in ["x", "y"]}
+    grad_map_covar = {
+        "xx": np.full((height, width), grad_initial_variance),
+        "xy": np.zeros((height, width)),
+        "yx": np.zeros((height, width)),
+        "yy": np.full((height, width), grad_initial_variance),
+    }
+    return grad_map, grad_map_covar
+
+
+def copy_maps(maps):
+    return {key: value.copy() for key, value in maps.items()}
+
+
+def serial_mosaic(recording, num_events, num_events_batch, height, width):
+    """
+    Batch by batch EKF, as the loop of the mosaicing scripts
+    """
+    grad_map, grad_map_covar = prior_maps(height, width)
+    sensor_shape = recording.bearings.shape[:2]
+    event_map_sae = np.full(sensor_shape, -1e-6)
+    event_map_rotation = np.full(sensor_shape + (3, 3), np.nan)
+    t, x, y, pol = recording.events(num_events)
+    for start in range(0, len(t) - num_events_batch + 1, num_events_batch):
+        stop = start + num_events_batch
+        Rot = coordinate_transforms.rotation_interpolation(
+            recording.poses_t, recording.rotmats_dict, (t[start] + t[stop - 1]) * 0.5
+        )
+        measurements = batch_measurements(
+            t[start:stop],
+            x[start:stop],
+            y[start:stop],
+            pol[start:stop],
+            Rot,
+            np.eye(3),
+            event_map_sae,
+            event_map_rotation,
+            recording.bearings,
+            width,
+            height,
+            recording.poses_t.iloc[0],
+        )
+        if measurements is None:
+            continue
+        ekf.ekf_update(
+            grad_map,
+            grad_map_covar,
+            measurements["ir"],
+            measurements["ic"],
+            measurements["vel"],
+            measurements["tc"],
+            measurements["event_rate"],
+            measurements["pol"],
+            **EKF_PARAMETERS,
+        )
+    return grad_map, grad_map_covar
+
+
+def random_measurements(num_events, height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    tc = rng.uniform(1e-3, 1e-1, num_events)
+    return {
+        "ir": rng.integers(0, height, num_events),
+        "ic": rng.integers(0, width, num_events),
+        "vel": rng.standard_normal((2, num_events)) * 10,
+        "tc": tc,
+        "event_rate": 1.0 / tc,
+        "pol": rng.choice([-1.0, 1.0], num_events),
+    }
+
+
+def empty_information(height, width):
+    return {key: np.zeros((height, width)) for key in ekf.INFO_KEYS}
+
+
+def accumulate_information(info, measurements):
+    ekf.information_update(
+        info,
+        *[measurements[key] for key in ["ir", "ic", "vel", "tc", "event_rate", "pol"]],
+        **EKF_PARAMETERS,
+    )
+
+
+def fuse(grad_map, grad_map_covar, info):
+    flat_idx = np.flatnonzero(info["xx"] + info["yy"])
+    ekf.fuse_information(
+        grad_map,
+        grad_map_covar,
+        flat_idx,
+        {key: value.ravel()[flat_idx] for key, value in info.items()},
+    )
+
+
+def test_information_form_matches_ekf_on_distinct_pixels():
+    height, width = 10, 20
+    measurements = random_measurements(300, height, width)
+    _, idx = np.unique(
+        measurements["ir"] * width + measurements["ic"], return_index=True
+    )
+    measurements = {key: value[..., idx] for key, value in measurements.items()}
+    grad_map, grad_map_covar = prior_maps(height, width)
+    ekf.ekf_update(
+        grad_map,
+        grad_map_covar,
+        *[measurements[key] for key in ["ir", "ic", "vel", "tc", "event_rate", "pol"]],
+        **EKF_PARAMETERS,
+    )
+
+    grad_map_info, grad_map_covar_info = prior_maps(height, width)
+    info = empty_information(height, width)
+    accumulate_information(info, measurements)
+    fuse(grad_map_info, grad_map_covar_info, info)
+
+    for key in grad_map:
+        np.testing.assert_allclose(grad_map_info[key], grad_map[key], atol=1e-12)
+    for key in grad_map_covar:
+        np.testing.assert_allclose(
+            grad_map_covar_info[key], grad_map_covar[key], atol=1e-12
+        )
+
+
+def test_fusing_chunks_matches_one_accumulation():
+    height, width = 10, 20
+    first = random_measurements(500, height, width, seed=1)
+    second = random_measurements(500, height, width, seed=2)
+
+    grad_map, grad_map_covar = prior_maps(height, width)
+    info = empty_information(height, width)
+    accumulate_information(info, first)
+    accumulate_information(info, second)
+    fuse(grad_map, grad_map_covar, info)
+
+    # the chunks accumulate independently and are fused one after the other
+    grad_map_chunks, grad_map_covar_chunks = prior_maps(height, width)
+    for measurements in [first, second]:
+        info = empty_information(height, width)
+        accumulate_information(info, measurements)
+        fuse(grad_map_chunks, grad_map_covar_chunks, info)
+
+    for key in grad_map:
+        np.testing.assert_allclose(grad_map_chunks[key], grad_map[key], atol=1e-9)
+    for key in grad_map_covar:
+        np.testing.assert_allclose(
+            grad_map_covar_chunks[key], grad_map_covar[key], atol=1e-12
+        )
+
+
+def test_sharded_ekf_matches_serial_update():
+    height, width = 40, 70
+    grad_map, grad_map_covar = prior_maps(height, width)
+    grad_map_sharded, grad_map_covar_sharded = prior_maps(height, width)
+    sharded_ekf = ShardedEKF(
+        grad_map_sharded, grad_map_covar_sharded, num_workers=2, num_tiles=(3, 5)
+    )
+    try:
+        for seed in range(3):
+            measurements = random_measurements(2000, height, width, seed)
+            args = [
+                measurements[key]
+                for key in ["ir", "ic", "vel", "tc", "event_rate", "pol"]
+            ]
+            ekf.ekf_update(grad_map, grad_map_covar, *args, **EKF_PARAMETERS)
+            sharded_ekf.update(
+                grad_map_sharded, grad_map_covar_sharded, *args, **EKF_PARAMETERS
+            )
+    finally:
+        sharded_ekf.close()
+
+    for key in grad_map:
+        np.testing.assert_allclose(grad_map_sharded[key], grad_map[key], atol=1e-12)
+    for key in grad_map_covar:
+        np.testing.assert_allclose(
+            grad_map_covar_sharded[key], grad_map_covar[key], atol=1e-12
+        )
+
+
+def test_one_time_chunk_matches_serial_ekf(recording):
+    # With one event per batch, the EKF updates every map pixel event after event,
+    # and the information form fuses the same measurements
+    height, width = 64, 128
+    num_events = 4000
+    num_events_batch = 1
+    grad_map, grad_map_covar = serial_mosaic(
+        recording, num_events, num_events_batch, height, width
+    )
+    assert np.sum(grad_map_covar["xx"] < 10) > 100
+
+    grad_map_chunks, grad_map_covar_chunks = prior_maps(height, width)
+    num_processed = mosaic_time_chunks(
+        grad_map_chunks,
+        grad_map_covar_chunks,
+        *recording.events(num_events),
+        recording.poses_t,
+        recording.rotmats_dict,
+        np.eye(3),
+        recording.bearings,
+        num_events_batch,
+        EKF_PARAMETERS,
+        num_chunks=1,
+        num_warmup_events=0,
+    )
+    assert num_processed == num_events
+
+    for key in grad_map:
+        np.testing.assert_allclose(grad_map_chunks[key], grad_map[key], atol=1e-9)
+    for key in grad_map_covar:
+        np.testing.assert_allclose(
+            grad_map_covar_chunks[key], grad_map_covar[key], atol=1e-9
+        )
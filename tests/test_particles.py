@@ -0,0 +1,65 @@
+import numpy as np
+
+from sample.tracking.particles import BYTES_PER_EVENT_PARTICLE, ParticleSet
+
+
+def identity_particles(num_particles):
+    return ParticleSet(np.tile(np.eye(3), (num_particles, 1, 1)))
+
+
+def test_uniform_weights_and_events_per_chunk():
+    particles = identity_particles(4)
+    assert len(particles) == 4
+    np.testing.assert_array_equal(particles.weights, 0.25)
+    assert particles.events_per_chunk(10 * 4 * BYTES_PER_EVENT_PARTICLE) == 10
+    assert particles.events_per_chunk(1) == 1
+
+
+def test_buffers_reused_and_grown():
+    particles = identity_particles(4)
+    world, logintensity, z = particles.buffers(10)
+    assert world.shape == (10, 4, 3)
+    assert logintensity.shape == z.shape == (10, 4)
+    storage = particles._storage[0]
+
+    # a smaller chunk reuses the storage
+    world_small, _, _ = particles.buffers(3)
+    assert particles._storage[0] is storage
+    assert np.shares_memory(world_small, world)
+
+    # a larger chunk grows it, for all the sets sharing it
+    selected = particles.select([0, 0, 1, 2, 3, 3])
+    selected.buffers(20)
+    assert particles._storage[0] is not storage
+    assert len(particles._storage[0][1]) == 20 * 6
+
+
+def test_view_shares_the_arrays():
+    particles = identity_particles(6)
+    view = particles.view(2, 5)
+    assert len(view) == 3
+    view.likelihood_sum[:] = 1.0
+    view.weights[:] = 0.0
+    view.rotations[0] = -np.eye(3)
+    np.testing.assert_array_equal(particles.likelihood_sum, [0, 0, 1, 1, 1, 0])
+    np.testing.assert_array_equal(particles.weights[2:5], 0.0)
+    np.testing.assert_array_equal(particles.rotations[2], -np.eye(3))
+
+
+def test_select_and_copy_are_independent():
+    rotations = np.tile(np.eye(3), (3, 1, 1))
+    rotations[1] *= 2
+    particles = ParticleSet(rotations, weights=[0.5, 0.3, 0.2])
+
+    selected = particles.select([1, 1, 0])
+    np.testing.assert_array_equal(selected.rotations[0], 2 * np.eye(3))
+    np.testing.assert_array_equal(selected.weights, 1.0 / 3)
+    selected.rotations[0] = 0.0
+    np.testing.assert_array_equal(particles.rotations[1], 2 * np.eye(3))
+
+    copied = particles.copy()
+    copied.weights[0] = 1.0
+    copied.rotations[2] = 0.0
+    assert particles.weights[0] == 0.5
+    np.testing.assert_array_equal(particles.rotations[2], np.eye(3))
+    assert copied._storage is not particles._storage
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import sample.helpers.projections as projections
+
+SHAPES = {"equirectangular": (64, 128), "equal_area": (64, 128), "cube_map": (64, 96)}
+
+
+def random_directions(num=2000, seed=0):
+    point_3d = np.random.default_rng(seed).standard_normal((3, num))
+    return point_3d / np.sqrt(np.sum(np.square(point_3d), axis=0))
+
+
+@pytest.mark.parametrize("name", sorted(SHAPES))
+def test_bearing_pixel_bearing(name):
+    height, width = SHAPES[name]
+    projection = projections.get_projection(name, width, height)
+    point_3d = random_directions()
+
+    pm = projection.project(point_3d)
+    assert np.all((pm[0] >= 0) & (pm[0] < width) & (pm[1] >= 0) & (pm[1] < height))
+    np.testing.assert_allclose(projection.unproject(pm), point_3d, atol=1e-12)
+
+
+@pytest.mark.parametrize("name", sorted(SHAPES))
+def test_pixel_bearing_pixel(name):
+    height, width = SHAPES[name]
+    projection = projections.get_projection(name, width, height)
+    rows, cols = np.mgrid[0:height, 0:width]
+
+    ir, ic = projection.pixels(
+        projection.unproject(np.array([cols.ravel() + 0.5, rows.ravel() + 0.5]))
+    )
+    np.testing.assert_array_equal(ir, rows.ravel())
+    np.testing.assert_array_equal(ic, cols.ravel())
+
+
+def test_cube_map_regions_are_faces():
+    projection = projections.get_projection("cube_map", 96, 64)
+    regions = projection.regions((64, 96))
+    assert len(regions) == 6
+    cover = np.zeros((64, 96), dtype=int)
+    for rows, cols in regions:
+        cover[rows, cols] += 1
+    np.testing.assert_array_equal(cover, 1)
+
+    # directions on one face are compatible, across two faces they are not
+    pm = projection.project(np.array([[1.0, 0.999], [0.0, 0.0], [0.1, 1.0]]))
+    assert not projection.compatible(pm[:, :1], pm[:, 1:])[0]
+    assert projection.compatible(pm[:, :1], pm[:, :1])[0]
+
+
+@pytest.mark.parametrize("name", ["cube_map", "equal_area"])
+def test_engine_mosaics_with_projection(recording, name):
+    height, width = SHAPES[name]
+    settings = dict(map_projection=name, output_height=height, output_width=width)
+    engine = recording.engine(**settings)
+    engine.run(*recording.events())
+    engine.close()
+    assert np.sum(engine.grad_map_covar["xx"] < 10) > 100
+
+    pipelined = recording.engine(pipelined=True, **settings)
+    pipelined.run(*recording.events())
+    pipelined.close()
+    for key in ["x", "y"]:
+        np.testing.assert_allclose(pipelined.grad_map[key], engine.grad_map[key])
+
+    image = engine.integrate()
+    assert image.shape == (height, width)
+    assert np.all(np.isfinite(image))
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from sample.mosaicing.pyramid import MosaicPyramid
+
+
+def random_maps(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    grad_map = {key: rng.standard_normal((height, width)) for key in ["x", "y"]}
+    grad_map_covar = {
+        key: rng.random((height, width)) for key in ["xx", "xy", "yx", "yy"]
+    }
+    return grad_map, grad_map_covar
+
+
+def downsample(image, grad):
+    """
+    Reference 2x2 mean, with the last row / column repeated for odd sizes
+    """
+    height, width = image.shape
+    padded = np.pad(image, ((0, height % 2), (0, width % 2)), mode="edge")
+    mean = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).mean(
+        axis=(1, 3)
+    )
+    return 2.0 * mean if grad else mean
+
+
+@pytest.mark.parametrize("shape", [(128, 256), (100, 150), (37, 70)])
+def test_levels_match_reference(shape):
+    grad_map, grad_map_covar = random_maps(*shape)
+    pyramid = MosaicPyramid(grad_map, grad_map_covar, num_levels=3, tile_size=32)
+
+    reference = [dict(grad_map, **grad_map_covar)]
+    for k in range(1, 3):
+        reference.append(
+            {
+                key: downsample(value, key in grad_map)
+                for key, value in reference[-1].items()
+            }
+        )
+        grad, covar = pyramid.level(k)
+        assert grad["x"].shape == (-(-shape[0] // 2 ** k), -(-shape[1] // 2 ** k))
+        for key, value in dict(grad, **covar).items():
+            np.testing.assert_allclose(value, reference[k][key])
+
+
+def test_only_dirty_tiles_refreshed():
+    grad_map, grad_map_covar = random_maps(100, 150)
+    pyramid = MosaicPyramid(grad_map, grad_map_covar, num_levels=2, tile_size=32)
+    pyramid.level(1)
+    assert pyramid.num_tiles_refreshed == 4 * 5
+
+    # a change in the partial tile at the bottom right corner
+    grad_map["x"][99, 149] += 1.0
+    pyramid.mark_dirty([99], [149])
+    grad, _ = pyramid.level(1)
+    assert pyramid.num_tiles_refreshed == 4 * 5 + 1
+    np.testing.assert_allclose(grad["x"], downsample(grad_map["x"], True))
+
+
+def test_engine_builds_pyramid_on_demand(recording):
+    # not a multiple of the tile size
+    engine = recording.engine(output_height=40, output_width=80)
+    engine.run(*recording.events(5000))
+    assert engine.pyramid is None
+
+    np.testing.assert_array_equal(
+        engine.snapshot()["grad_map"]["x"], engine.grad_map["x"]
+    )
+    assert engine.pyramid is None
+
+    coarse = engine.snapshot(level=1)["grad_map"]["x"]
+    assert coarse.shape == (20, 40)
+    np.testing.assert_allclose(coarse, downsample(engine.grad_map["x"], True))
+
+    engine.run(*recording.events())
+    np.testing.assert_allclose(
+        engine.snapshot(level=1)["grad_map"]["x"],
+        downsample(engine.grad_map["x"], True),
+    )
+    engine.close()
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+
+from sample.mosaicing.renderer import BackgroundRenderer, _subsample
+
+PANELS = ["events_raw", "events_pm", "reconstruction"]
+
+
+def test_subsample():
+    points = np.vstack((np.arange(10), np.arange(10)))
+    np.testing.assert_array_equal(_subsample(points, 4)[0], [0, 3, 6, 9])
+    np.testing.assert_array_equal(_subsample(points, 20), points)
+
+
+def test_frames_written_per_panel(tmp_path):
+    renderer = BackgroundRenderer(str(tmp_path), 16, 16, 32, 16, queue_size=5)
+    rng = np.random.default_rng(0)
+    grad_map = {key: rng.standard_normal((16, 32)) for key in ["x", "y"]}
+    grad_map_covar = {key: np.full((16, 32), 0.01) for key in ["xx", "yy"]}
+    for iEv in [1000, 2000, 3000]:
+        pol = rng.choice([-1.0, 1.0], 100)
+        assert renderer.submit(
+            iEv,
+            rng.integers(0, 16, 100),
+            rng.integers(0, 16, 100),
+            pol,
+            rng.random((2, 100)) * [[32], [16]],
+            pol,
+            grad_map,
+            grad_map_covar,
+        )
+    renderer.close()
+
+    assert renderer.report() == "Animation frames: 3 rendered, 0 dropped"
+    for panel in PANELS:
+        assert sorted(os.listdir(os.path.join(str(tmp_path), panel))) == [
+            "fig_events_0000001000.png",
+            "fig_events_0000002000.png",
+            "fig_events_0000003000.png",
+        ]
+
+
+def test_engine_submits_frames(recording, tmp_path):
+    engine = recording.engine(
+        animation_dir=str(tmp_path),
+        plot_events_animation=True,
+        plot_reconstruction_animation=True,
+        render_every=4,
+        preview_level=1,
+    )
+    engine.run(*recording.events())
+    engine.close()
+
+    renderer = engine.renderer
+    assert renderer.num_frames_submitted > 0
+    assert renderer.num_frames_submitted + renderer.num_frames_dropped <= 5
+    assert not os.path.exists(os.path.join(str(tmp_path), "events_pm"))
+    for panel in ["events_raw", "reconstruction"]:
+        frames = os.listdir(os.path.join(str(tmp_path), panel))
+        assert len(frames) == renderer.num_frames_submitted
@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+import sample.tracking.resampling as resampling
+from sample.tracking.particles import ParticleSet
+
+METHODS = ["systematic", "stratified", "residual"]
+
+
+def random_weights(num, seed=0):
+    weights = np.random.default_rng(seed).gamma(0.5, size=num)
+    return weights / np.sum(weights)
+
+
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("num", [None, 37, 400])
+def test_index_counts(method, num):
+    weights = random_weights(100)
+    idx = resampling.RESAMPLING_METHODS[method](weights, np.random.default_rng(1), num)
+    assert len(idx) == (len(weights) if num is None else num)
+    assert np.all(np.diff(idx) >= 0)
+    assert idx.min() >= 0 and idx.max() < len(weights)
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_exact_multiplicities(method):
+    # N * w are integers: every method copies each particle exactly N * w times
+    weights = np.array([0.5, 0.25, 0.125, 0.0, 0.125])
+    for seed in range(5):
+        idx = resampling.RESAMPLING_METHODS[method](
+            weights, np.random.default_rng(seed), 8
+        )
+        np.testing.assert_array_equal(np.bincount(idx, minlength=5), [4, 2, 1, 0, 1])
+
+
+@pytest.mark.parametrize("method", ["systematic", "residual"])
+def test_multiplicities_floor_or_ceil(method):
+    weights = random_weights(100)
+    expected = 100 * weights
+    for seed in range(20):
+        counts = np.bincount(
+            resampling.RESAMPLING_METHODS[method](weights, np.random.default_rng(seed)),
+            minlength=100,
+        )
+        assert np.all(counts >= np.floor(expected))
+        assert np.all(counts <= np.ceil(expected))
+
+
+def test_stratified_multiplicities_bounded():
+    weights = random_weights(100)
+    expected = 100 * weights
+    for seed in range(20):
+        counts = np.bincount(
+            resampling.stratified_resampling(weights, np.random.default_rng(seed)),
+            minlength=100,
+        )
+        assert np.all(np.abs(counts - expected) < 2)
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_unbiased(method):
+    weights = random_weights(20)
+    rng = np.random.default_rng(2)
+    counts = np.zeros(20)
+    num_draws = 2000
+    for _ in range(num_draws):
+        counts += np.bincount(
+            resampling.RESAMPLING_METHODS[method](weights, rng), minlength=20
+        )
+    np.testing.assert_allclose(counts / num_draws, 20 * weights, atol=0.05)
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_fixed_seed_reproducible(method):
+    weights = random_weights(50)
+    first = resampling.RESAMPLING_METHODS[method](weights, np.random.default_rng(7))
+    second = resampling.RESAMPLING_METHODS[method](weights, np.random.default_rng(7))
+    np.testing.assert_array_equal(first, second)
+
+
+def test_ess_gate():
+    uniform = np.full(10, 0.1)
+    ess, needed = resampling.degenerate(uniform, 0.5)
+    assert ess == pytest.approx(10.0)
+    assert not needed
+
+    weights = np.array([0.7] + [0.3 / 9] * 9)
+    ess, needed = resampling.degenerate(weights, 0.5)
+    assert ess == pytest.approx(2.0)
+    assert needed
+    # the gate is strict: an ESS at the threshold keeps the particles
+    assert not resampling.degenerate(weights, ess / 10)[1]
+
+
+def test_select_resets_weights():
+    rotations = np.tile(np.eye(3), (4, 1, 1)) * np.arange(1, 5)[:, None, None]
+    particles = ParticleSet(rotations, weights=[0.7, 0.1, 0.1, 0.1])
+    idx = resampling.systematic_resampling(particles.weights, np.random.default_rng(0))
+    resampled = particles.select(idx)
+    assert len(resampled) == 4
+    np.testing.assert_array_equal(resampled.weights, np.full(4, 0.25))
+    np.testing.assert_array_equal(resampled.rotations, rotations[idx])
+
+
+def test_kld_num_particles():
+    # Fox, KLD-sampling: n = (k - 1) / (2 error) {1 - 2 / (9 (k - 1)) + sqrt(2 / (9 (k - 1))) z}^3
+    k = 11
+    a = 2.0 / (9.0 * (k - 1))
+    z = 2.3263478740408408  # quantile 0.99 of the standard normal
+    expected = np.ceil((k - 1) / 0.1 * (1.0 - a + np.sqrt(a) * z) ** 3)
+    assert resampling.kld_num_particles(k, 0.05, 0.99) == expected
+
+    needed = resampling.kld_num_particles(np.arange(2, 50))
+    assert np.all(np.diff(needed) > 0)
+
+
+def test_kld_resampling_bounds():
+    weights = random_weights(500)
+    rng = np.random.default_rng(3)
+
+    # all particles in one bin: the lower bound, or the count of a single bin
+    idx = resampling.kld_resampling(weights, rng, np.zeros(500, dtype=int), 100, 1000)
+    assert len(idx) == 100
+    idx = resampling.kld_resampling(weights, rng, np.zeros(500, dtype=int), 10, 1000)
+    assert len(idx) == resampling.kld_num_particles(1)
+
+    # one bin per particle: the upper bound
+    idx = resampling.kld_resampling(weights, rng, np.arange(500), 50, 300)
+    assert len(idx) == 300
+    assert idx.min() >= 0 and idx.max() < 500
+
+
+def test_kld_resampling_matches_occupied_bins():
+    weights = random_weights(1000)
+    bins = np.stack((np.arange(1000) % 4, np.arange(1000) % 5), axis=1)  # 20 bins
+    idx = resampling.kld_resampling(weights, np.random.default_rng(4), bins, 10, 5000)
+    num_bins = len(np.unique(bins[idx], axis=0))
+    assert len(idx) == resampling.kld_num_particles(num_bins)
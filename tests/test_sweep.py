@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from conftest import VAR_R
+
+
+def test_configuration_of_the_main_map_reproduces_it(recording):
+    engine = recording.engine(
+        configurations=[
+            {
+                "measurement_criterion": "contrast",
+                "var_R": VAR_R,
+                "grad_initial_variance": 10,
+            },
+            {
+                "measurement_criterion": "contrast",
+                "var_R": 4 * VAR_R,
+                "grad_initial_variance": 1,
+                "name": "noisy",
+            },
+        ]
+    )
+    engine.run(*recording.events())
+    sweep = engine.sweep
+
+    assert sweep.names() == ["contrast_varR{:g}_var010".format(VAR_R), "noisy"]
+    for key in ["x", "y"]:
+        np.testing.assert_array_equal(sweep.grad_maps[0][key], engine.grad_map[key])
+    for key in ["xx", "xy", "yx", "yy"]:
+        np.testing.assert_array_equal(
+            sweep.grad_map_covars[0][key], engine.grad_map_covar[key]
+        )
+    assert not np.allclose(sweep.grad_maps[1]["x"], engine.grad_map["x"])
+
+    image = sweep.integrate(0)
+    assert image.shape == engine.grad_map["x"].shape
+    assert np.all(np.isfinite(image))
+
+
+@pytest.mark.parametrize("settings", [{"pipelined": True}, {"num_time_chunks": 2}])
+def test_configurations_only_batch_by_batch(recording, settings):
+    configuration = {
+        "measurement_criterion": "contrast",
+        "var_R": VAR_R,
+        "grad_initial_variance": 10,
+    }
+    with pytest.raises(ValueError):
+        recording.engine(configurations=[configuration], **settings)
@@ -0,0 +1,93 @@
+import numpy as np
+
+import sample.helpers.coordinate_transforms as coordinate_transforms
+import sample.helpers.projections as projections
+import sample.tracking.evaluation as evaluation
+from sample.tracking.parallel import ParallelEvaluator
+from sample.tracking.particles import ParticleSet
+
+LIKELIHOOD_PARAMETERS = {"mu": 0.45, "sigma": 0.17, "k_e": 1e-3, "flipped": True}
+SIGMAS = (0.01, 0.02, 0.005)
+NUM_SHARDS = 8
+
+
+def fixed_particles(num_particles=300, seed=0):
+    rng = np.random.default_rng(seed)
+    rotvecs = rng.normal(0.0, 0.05, (num_particles, 3))
+    return ParticleSet(coordinate_transforms.rotvecs2rotmats(rotvecs))
+
+
+def random_events(num_events=200, seed=1):
+    rng = np.random.default_rng(seed)
+    bearings = np.column_stack(
+        (rng.uniform(-0.4, 0.4, (num_events, 2)), np.ones(num_events))
+    )
+    pol = rng.choice([-1.0, 1.0], num_events)
+    logintensity_ttc = rng.normal(0.0, 0.5, num_events)
+    return bearings, pol, logintensity_ttc
+
+
+def serial_step(particles, intensity_map, projection, entropy, step, interpolation):
+    """
+    Motion and measurement update of the serial tracker (see Tracker.motion_update)
+    """
+    for shard, (start, stop) in enumerate(
+        evaluation.shard_bounds(len(particles), NUM_SHARDS)
+    ):
+        evaluation.perturb_rotations(
+            particles.rotations[start:stop],
+            SIGMAS,
+            evaluation.shard_rng(entropy, step, shard),
+        )
+    bearings, pol, logintensity_ttc = random_events(seed=step)
+    evaluation.accumulate_likelihoods(
+        particles,
+        np.eye(3),
+        bearings,
+        pol,
+        logintensity_ttc,
+        intensity_map,
+        projection,
+        64,
+        LIKELIHOOD_PARAMETERS,
+        interpolation,
+    )
+
+
+def test_parallel_evaluator_matches_serial():
+    rng = np.random.default_rng(2)
+    intensity_map = rng.normal(0.0, 1.0, (64, 128))
+    projection = projections.get_projection("equirectangular", 128, 64)
+    entropy = np.random.SeedSequence(5).entropy
+
+    for interpolation in ["nearest", "bilinear"]:
+        serial = fixed_particles()
+        for step in range(3):
+            serial_step(serial, intensity_map, projection, entropy, step, interpolation)
+
+        particles = fixed_particles()
+        evaluator = ParallelEvaluator(
+            intensity_map,
+            projection,
+            np.eye(3),
+            LIKELIHOOD_PARAMETERS,
+            interpolation,
+            max_particles=len(particles),
+            max_events=200,
+            num_workers=2,
+            num_shards=NUM_SHARDS,
+        )
+        try:
+            for step in range(3):
+                evaluator.motion_update(particles, SIGMAS, entropy, step)
+                bearings, pol, logintensity_ttc = random_events(seed=step)
+                evaluator.accumulate_likelihoods(
+                    particles, bearings, pol, logintensity_ttc, 64
+                )
+        finally:
+            evaluator.close()
+
+        np.testing.assert_array_equal(particles.rotations, serial.rotations)
+        np.testing.assert_allclose(
+            particles.likelihood_sum, serial.likelihood_sum, rtol=1e-12
+        )